@@ -0,0 +1,950 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Бенчмарки бота на локальном поддельном RCON-сервере (работают без интернета)
+# Запуск: python bench_bot.py rcon --commands 500 --concurrency 10
+#         python bench_bot.py fragments --lines 2000
+#         python bench_bot.py bulk --commands 500
+#         python bench_bot.py render --iterations 2000
+#         python bench_bot.py webhook --updates 2000 --admins 20
+#         python bench_bot.py load --admins 10 --sessions 20 [--failure-mode hang --failure-rate 0.05]
+#         python bench_bot.py console --lines 5000 --consoles 3
+#         python bench_bot.py fleet --servers 5 --down 1
+#         python bench_bot.py store --history 200000 --players 20000
+#         python bench_bot.py scheduler --jobs 2000 --period 5 --duration 15
+# -------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import statistics
+import struct
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import template_bot as bot
+
+# =========================================================================
+# --- ПОДДЕЛЬНЫЕ СЕРВЕРЫ MINECRAFT ---
+# =========================================================================
+
+class FakeServer:
+    """Основа локальных TCP-серверов: запуск в текущем event loop или в отдельном потоке."""
+
+    _server = None
+
+    async def _handle(self, reader, writer):
+        raise NotImplementedError
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def start_in_thread(self) -> int:
+        """Запускает сервер в отдельном потоке со своим event loop (как настоящий внешний сервер)."""
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self._stop_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _stop_all(self):
+        # В своём потоке можно снять и зависшие обработчики соединений (режим "hang");
+        # обработчики глушат CancelledError: asyncio 3.11 иначе пишет в лог ошибку при отмене
+        self._server.close()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers: task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+class FakeRconServer(FakeServer):
+    """Локальная замена RCON-сервера Minecraft: отвечает на команды с заданной задержкой.
+
+    Как и настоящий сервер, режет длинные ответы на пакеты по fragment_size байт.
+    network_delay имитирует сеть до удалённого сервера: ответы приходят с задержкой,
+    но сервер тем временем уже обрабатывает следующие команды.
+
+    failure_mode с вероятностью failure_rate портит ответ на команду:
+    "error" — сервер отвечает ошибкой команды, "disconnect" — рвёт соединение,
+    "hang" — зависает на hang_time секунд (лаг главного потока сервера), задерживая и все следующие команды.
+    """
+
+    FAILURE_MODES = ("error", "disconnect", "hang")
+
+    def __init__(self, password: str = "bench", latency: float = 0.002, fragment_size: int = 4096, network_delay: float = 0,
+                 players: list = ("Steve", "Alex"), failure_mode: str = None, failure_rate: float = 0.0,
+                 hang_time: float = 10.0, seed: int = 0):
+        self.password, self.latency, self.fragment_size = password, latency, fragment_size
+        self.network_delay = network_delay
+        self.players = list(players)
+        self.failure_mode, self.failure_rate, self.hang_time = failure_mode, failure_rate, hang_time
+        self._random = random.Random(seed)
+        self.connections = 0
+        self.commands = 0
+        self.failures = 0
+
+    def respond(self, command: str) -> str:
+        """Ответ сервера на команду; переопределяется в наследниках."""
+        if command == "list":
+            return f"There are {len(self.players)} of a max of 100 players online: {', '.join(self.players)}"
+        if command.startswith("dump "): return dump_text(int(command.split()[1]))
+        return f"Executed: {command}"
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        authed = False
+        if self.network_delay:
+            writer = DelayedWriter(writer, self.network_delay)
+        try:
+            while True:
+                (length,) = struct.unpack("<i", await reader.readexactly(4))
+                body = await reader.readexactly(length)
+                request_id, packet_type = struct.unpack("<ii", body[:8])
+                payload = body[8:-2].decode("utf-8")
+                if packet_type == bot.RCON_PACKET_AUTH:
+                    authed = payload == self.password
+                    self._send(writer, request_id if authed else -1, bot.RCON_PACKET_AUTH_RESPONSE, "")
+                elif authed:
+                    self.commands += 1
+                    # Настоящий сервер обрабатывает команды одного соединения строго по очереди;
+                    # пустая команда-маркер конца ответа выполняется мгновенно
+                    if self.latency and payload: await asyncio.sleep(self.latency)
+                    failure = payload and self.failure_mode and self._random.random() < self.failure_rate
+                    if failure:
+                        self.failures += 1
+                        if self.failure_mode == "disconnect": break
+                        if self.failure_mode == "hang": await asyncio.sleep(self.hang_time)
+                    if failure and self.failure_mode == "error":
+                        data = b"Unknown or incomplete command, see below for error"
+                    else:
+                        data = self.respond(payload).encode("utf-8")
+                    # Режем по байтам, а не по символам: многобайтовые символы попадают на границу пакетов
+                    for offset in range(0, max(len(data), 1), self.fragment_size):
+                        self._send_bytes(writer, request_id, bot.RCON_PACKET_RESPONSE, data[offset:offset + self.fragment_size])
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _send(self, writer, request_id: int, packet_type: int, payload: str):
+        self._send_bytes(writer, request_id, packet_type, payload.encode("utf-8"))
+
+    def _send_bytes(self, writer, request_id: int, packet_type: int, data: bytes):
+        writer.write(struct.pack("<iii", len(data) + 10, request_id, packet_type) + data + b"\x00\x00")
+
+class DelayedWriter:
+    """Обёртка над StreamWriter, которая отправляет данные с постоянной задержкой, сохраняя порядок."""
+
+    def __init__(self, writer, delay: float):
+        self._writer, self._delay = writer, delay
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._pump())
+
+    def write(self, data: bytes):
+        self._queue.put_nowait((time.monotonic() + self._delay, data))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self._task.cancel()
+        self._writer.close()
+
+    async def _pump(self):
+        while True:
+            due, data = await self._queue.get()
+            if (wait := due - time.monotonic()) > 0: await asyncio.sleep(wait)
+            self._writer.write(data)
+
+class FakeStatusServer(FakeServer):
+    """Локальная замена игрового порта: отвечает на Server List Ping (статус и пинг) с задержкой.
+
+    online=False имитирует выключенный сервер: соединения принимаются и сразу закрываются.
+    """
+
+    def __init__(self, latency: float = 0.002, players: list = ("Steve", "Alex"), online: bool = True):
+        self.latency, self.players, self.online = latency, list(players), online
+        self.requests = 0
+
+    def status(self) -> dict:
+        return {"version": {"name": "1.21.1", "protocol": 767}, "description": {"text": "§aBench §rсервер"},
+                "players": {"online": len(self.players), "max": 100,
+                            "sample": [{"name": name, "id": "00000000-0000-0000-0000-000000000000"} for name in self.players[:12]]}}
+
+    async def _handle(self, reader, writer):
+        try:
+            handshaken = False
+            while self.online:
+                packet = await reader.readexactly(await read_varint(reader))
+                packet_id = packet[0]
+                if packet_id == 0 and not handshaken:
+                    handshaken = True
+                elif packet_id == 0:
+                    self.requests += 1
+                    if self.latency: await asyncio.sleep(self.latency)
+                    data = json.dumps(self.status()).encode("utf-8")
+                    writer.write(pack_packet(b"\x00" + encode_varint(len(data)) + data))
+                elif packet_id == 1:
+                    writer.write(pack_packet(packet))  # пинг: сервер возвращает тот же токен
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out.append(byte | (0x80 if value else 0))
+        if not value: return bytes(out)
+
+async def read_varint(reader) -> int:
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80: return value
+    raise ValueError("слишком длинный varint")
+
+def pack_packet(data: bytes) -> bytes:
+    return encode_varint(len(data)) + data
+
+def dump_text(lines: int) -> str:
+    """Длинный ответ с кириллицей и цветовыми кодами, как у `plugins` на большом сервере."""
+    return "\n".join(f"§aПлагин-{i:05d}§r: версия 1.{i % 20}.{i % 7} — §eвключён" for i in range(lines))
+
+# =========================================================================
+# --- ПОДДЕЛЬНЫЙ TELEGRAM BOT API ---
+# =========================================================================
+
+class FakeTelegramRequest(BaseRequest):
+    """Транспорт для Bot, который отвечает на вызовы API локально с заданной задержкой."""
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency: await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe": result = self.BOT_USER
+        elif endpoint in ("sendMessage", "editMessageText"):
+            result = {"message_id": params.get("message_id", 1), "date": int(time.time()),
+                      "chat": {"id": params.get("chat_id", 1), "type": "private"}, "text": params.get("text", "")}
+        else: result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    """JSON нажатия inline-кнопки — так его присылает Telegram."""
+    user = {"id": user_id, "is_bot": False, "first_name": f"Админ {user_id}"}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "меню"}}}
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    """JSON текстового сообщения админа."""
+    user = {"id": user_id, "is_bot": False, "first_name": f"Админ {user_id}"}
+    return {"update_id": update_id, "message": {"message_id": update_id, "date": 0, "from": user, "text": text,
+                                                "chat": {"id": user_id, "type": "private"}}}
+
+# =========================================================================
+# --- ГЕНЕРАТОР ДЕЙСТВИЙ АДМИНОВ ---
+# Сессии — типичные последовательности нажатий: (вид обновления, данные)
+# =========================================================================
+
+def navigation_session(rng, players):
+    return [("callback", data) for data in ("menu_status", "menu_server", "menu_main", "menu_world",
+                                            rng.choice(("action:exec:weather clear", "action:exec:time set 0")), "menu_main")]
+
+def kick_session(rng, players):
+    token = bot.player_tokens.token(rng.choice(players))
+    return [("callback", "menu_players"), ("callback", "wizard:punishment_menu"), ("callback", "wizard:kick_select_player"),
+            ("callback", "wizard:kick_select_player:1"), ("callback", f"wizard:kick_exec:#{token}")]
+
+def message_session(rng, players):
+    player = rng.choice(players)
+    return [("callback", "menu_players"), ("callback", "wizard:msg_select_player"),
+            ("callback", f"wizard:msg_prompt_message:#{bot.player_tokens.token(player)}"), ("text", f"Привет, {player}!")]
+
+def gamemode_session(rng, players):
+    token = bot.player_tokens.token(rng.choice(players))
+    return [("callback", "menu_players"), ("callback", "wizard:gamemode_select_player"),
+            ("callback", f"wizard:gamemode_select_mode:#{token}"), ("callback", f"wizard:gamemode_exec:{rng.choice(('creative', 'survival'))}")]
+
+def whitelist_session(rng, players):
+    return [("callback", "menu_players"), ("callback", "wizard:whitelist_menu"), ("callback", "wizard:whitelist_add_prompt"),
+            ("text", f"Newbie{rng.randrange(10000):04d}"), ("callback", "action:exec:whitelist list")]
+
+def console_session(rng, players):
+    spam = [("text", rng.choice(("list", "time query daytime", f"say Рестарт через {rng.randrange(1, 10)} мин")))
+            for _ in range(rng.randrange(3, 12))]
+    return [("callback", "menu_server"), ("callback", "wizard:console:start"), *spam, ("callback", "wizard:console:stop")]
+
+# Сессия и её относительная частота
+SESSIONS = {"навигация": (navigation_session, 4), "кик": (kick_session, 2), "сообщение": (message_session, 2),
+            "режим игры": (gamemode_session, 1), "whitelist": (whitelist_session, 1), "консоль": (console_session, 2)}
+
+def generate_updates(admins: list, sessions: int, players: list, seed: int = 0) -> list:
+    """Поток Update JSON от нескольких админов: у каждого свои сессии по порядку, между админами — вперемешку."""
+    rng = random.Random(seed)
+    names, weights = list(SESSIONS), [weight for _, weight in SESSIONS.values()]
+    queues = {}
+    for admin in admins:
+        steps = []
+        for name in rng.choices(names, weights, k=sessions): steps += SESSIONS[name][0](rng, players)
+        queues[admin] = collections.deque(steps)
+    updates = []
+    while queues:
+        admin = rng.choice(list(queues))
+        kind, data = queues[admin].popleft()
+        if not queues[admin]: del queues[admin]
+        make = callback_update if kind == "callback" else message_update
+        updates.append(make(len(updates) + 1, admin, data))
+    return updates
+
+def load_payloads(path: str) -> list:
+    """Записанные Update JSON, по одному на строку."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# =========================================================================
+# --- УТИЛИТЫ ИЗМЕРЕНИЙ ---
+# =========================================================================
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
+
+def report(name: str, latencies: list, elapsed: float):
+    print(f"{name:<28} {len(latencies) / elapsed:>9.0f} cmd/s   "
+          f"p50 {statistics.median(latencies) * 1000:>7.2f} ms   p99 {percentile(latencies, 99) * 1000:>7.2f} ms")
+
+def report_percentiles(name: str, samples: list, unit: float = 1000, suffix: str = "мс"):
+    print(f"{name:<28} p50 {percentile(samples, 50) * unit:>8.1f}   p95 {percentile(samples, 95) * unit:>8.1f}   "
+          f"p99 {percentile(samples, 99) * unit:>8.1f}   max {max(samples, default=0) * unit:>8.1f} {suffix}")
+
+async def measure_loop_lag(samples: list, interval: float = 0.01):
+    """Насколько позже положенного просыпается event loop: признак блокирующего кода в обработчиках."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+class TimedUpdateProcessor(bot.ChatOrderedUpdateProcessor):
+    """Обработчик обновлений бота, который засекает время от постановки в очередь до конца обработки."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.enqueued, self.latencies = {}, []
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            await super().do_process_update(update, coroutine)
+        finally:
+            started = self.enqueued.pop(getattr(update, "update_id", None), None)
+            if started is not None: self.latencies.append(time.perf_counter() - started)
+
+async def run_load(call, commands: int, concurrency: int) -> tuple:
+    """Выполняет `commands` вызовов с заданной параллельностью и возвращает задержки и общее время."""
+    latencies, queue = [], iter(range(commands))
+
+    async def worker():
+        for _ in queue:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+# =========================================================================
+# --- СЦЕНАРИИ ---
+# =========================================================================
+
+async def bench_rcon(args):
+    """Сравнивает старый MCRcon (подключение на каждую команду) с пулом постоянных соединений."""
+    server = FakeRconServer(latency=args.latency)
+    port = server.start_in_thread()
+    print(f"Поддельный RCON на 127.0.0.1:{port}, задержка сервера {args.latency * 1000:.1f} мс, "
+          f"{args.commands} команд, параллельность {args.concurrency}\n")
+    try:
+        try:
+            from mcrcon import MCRcon
+        except ImportError:
+            print("mcrcon не установлен — пропускаю сравнение со старой реализацией")
+        else:
+            async def legacy_call():
+                # Так работал execute_rcon раньше: синхронный вызов прямо в event loop
+                with MCRcon("127.0.0.1", server.password, port=port, timeout=5) as mcr:
+                    mcr.command("list")
+            latencies, elapsed = await run_load(legacy_call, args.commands, args.concurrency)
+            report("MCRcon на каждую команду", latencies, elapsed)
+
+        pool = bot.RconPool("127.0.0.1", port, server.password, size=args.pool_size)
+        try:
+            latencies, elapsed = await run_load(lambda: pool.command("list"), args.commands, args.concurrency)
+            report(f"RconPool (size={args.pool_size})", latencies, elapsed)
+        finally:
+            await pool.close()
+        print(f"\nВсего TCP-подключений к серверу: {server.connections}")
+    finally:
+        server.stop_thread()
+
+async def bench_fragments(args):
+    """Проверяет сборку многопакетных ответов и постраничную выдачу, замеряя скорость."""
+    server = FakeRconServer(latency=0, fragment_size=args.fragment_size)
+    port = server.start_in_thread()
+    bot.current_server().pool = pool = bot.RconPool("127.0.0.1", port, server.password, size=args.pool_size)
+    expected = bot.strip_colors(dump_text(args.lines))
+    print(f"Ответ {len(dump_text(args.lines).encode()) / 1024:.0f} КБ, пакеты по {args.fragment_size} байт, "
+          f"{args.parallel} параллельных запросов\n")
+    try:
+        async def fetch_pages():
+            pages = [page async for page in bot.paginate(bot.stream_rcon(f"dump {args.lines}"))]
+            assert all(len(page) <= bot.RCON_OUTPUT_PAGE_SIZE for page in pages), "страница длиннее лимита"
+            # Страницы режутся по переводам строк, которые при этом отбрасываются
+            assert "\n".join(pages) == expected, "ответ собран неверно"
+            return pages
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(fetch_pages() for _ in range(args.parallel)))
+        elapsed = time.perf_counter() - started
+        print(f"OK: {args.parallel} ответов собраны без ошибок, по {len(results[0])} страниц в каждом")
+        print(f"{args.parallel * len(expected.encode()) / elapsed / 1024 / 1024:.1f} МБ/с, {elapsed * 1000:.1f} мс всего")
+    finally:
+        await pool.close()
+        server.stop_thread()
+
+async def bench_bulk(args):
+    """Сравнивает пакет из N команд по одной с пакетным конвейером execute_rcon_bulk."""
+    server = FakeRconServer(latency=args.latency, network_delay=args.network_delay)
+    port = server.start_in_thread()
+    bot.current_server().pool = pool = bot.RconPool("127.0.0.1", port, server.password)
+    commands = [f"whitelist add Player{i:04d}" for i in range(args.commands)]
+    print(f"{args.commands} команд, обработка на сервере {args.latency * 1000:.1f} мс, "
+          f"сеть {args.network_delay * 1000:.0f} мс\n")
+    try:
+        started = time.perf_counter()
+        for command in commands: await bot.execute_rcon(command)
+        elapsed = time.perf_counter() - started
+        print(f"{'По одной (execute_rcon)':<28} {elapsed * 1000:>8.0f} мс   {args.commands / elapsed:>7.0f} cmd/s")
+        for concurrency in (1, 4, bot.RCON_BULK_CONCURRENCY):
+            started = time.perf_counter()
+            results = await bot.execute_rcon_bulk(commands, concurrency=concurrency)
+            elapsed = time.perf_counter() - started
+            assert all(ok for _, ok, _ in results), "часть команд пакета не выполнена"
+            print(f"{f'Пакет, concurrency={concurrency}':<28} {elapsed * 1000:>8.0f} мс   {args.commands / elapsed:>7.0f} cmd/s")
+    finally:
+        await pool.close()
+        server.stop_thread()
+
+def fake_update(data: str = "menu_main"):
+    """Минимальные Update/Context для вызова обработчиков без Telegram: все вызовы API — пустышки."""
+    async def api_call(*args, **kwargs): return SimpleNamespace(message_id=1)
+    query = SimpleNamespace(data=data, answer=api_call, edit_message_text=api_call)
+    update = SimpleNamespace(callback_query=query, message=None, effective_user=SimpleNamespace(id=1, first_name="Админ_1"),
+                             effective_chat=SimpleNamespace(id=1))
+    context = SimpleNamespace(user_data={}, bot=SimpleNamespace(send_message=api_call, edit_message_text=api_call))
+    return update, context
+
+async def bench_render(args):
+    """Процессорное время обработчиков меню на одно обновление (сеть и Telegram исключены)."""
+    players = [f"Player_{i:03d}" for i in range(args.players)]
+    cache = bot.current_server().cache
+    cache.ttls["players"] = 10**9
+    cache.put("players", players)
+    response_line = "[12:00:00] [Server thread/INFO]: Player_001 (UUID 1234-abcd) joined the game! x=1.5, y=-2 [world]"
+    scenarios = {
+        "Главное меню": lambda u, c: bot.show_main_menu(u, c),
+        "Меню сервера": lambda u, c: bot.server_menu_handler(u, c),
+        "Меню игроков": lambda u, c: bot.players_menu_handler(u, c),
+        "Меню мира": lambda u, c: bot.world_menu_handler(u, c),
+        "Подменю (whitelist)": lambda u, c: bot.wizard_handler(u, c, ["whitelist_menu"]),
+        f"Выбор игрока ({args.players})": lambda u, c: bot.wizard_handler(u, c, ["kick_select_player"]),
+        "Выбор игрока, стр. 5": lambda u, c: bot.wizard_handler(u, c, ["kick_select_player", "4"]),
+    }
+    print(f"{args.iterations} обновлений на сценарий\n")
+    for name, handler in scenarios.items():
+        update, context = fake_update()
+        started = time.process_time()
+        for _ in range(args.iterations): await handler(update, context)
+        print(f"{name:<28} {(time.process_time() - started) / args.iterations * 1e6:>8.1f} мкс CPU / обновление")
+    started = time.process_time()
+    for _ in range(args.iterations * 10): bot.escape_markdown(response_line)
+    print(f"{'escape_markdown (строка)':<28} {(time.process_time() - started) / (args.iterations * 10) * 1e6:>8.2f} мкс CPU / вызов")
+
+async def post_updates(port: int, path: str, secret: str, payloads: list, connections: int) -> list:
+    """Отправляет JSON-обновления на webhook по нескольким keep-alive соединениям; возвращает HTTP-статусы."""
+    statuses, queue = [], iter(payloads)
+
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for body in queue:
+            writer.write(f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                         f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while (line := await reader.readline()) != b"\r\n":
+                if line.lower().startswith(b"content-length:"): length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            statuses.append(status)
+        writer.close()
+
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return statuses
+
+async def bench_webhook(args):
+    """Пропускная способность webhook: приём обновлений по HTTP и их полная обработка ботом."""
+    server = FakeRconServer(latency=0.001)
+    port = server.start_in_thread()
+    bot.current_server().pool = bot.RconPool("127.0.0.1", port, server.password)
+    admins = list(range(1000, 1000 + args.admins))
+    bot.ALLOWED_USER_IDS = admins
+    bot.WEBHOOK_LISTEN, bot.WEBHOOK_PORT, bot.UPDATE_CONCURRENCY = "127.0.0.1", 0, args.concurrency
+    if args.payloads:
+        updates = load_payloads(args.payloads)
+    else:
+        clicks = ["menu_main", "menu_server", "menu_players", "wizard:whitelist_menu", "wizard:kick_select_player",
+                  "action:exec:time set 0"]
+        updates = [callback_update(i, admins[i % len(admins)], clicks[i % len(clicks)]) for i in range(args.updates)]
+    payloads = [json.dumps(update).encode() for update in updates]
+    telegram = FakeTelegramRequest(latency=args.api_latency)
+    application = bot.build_application(request=telegram)
+    secret = "bench-secret"
+    webhook = await bot.start_webhook(application, secret, register=False)
+    print(f"{len(payloads)} обновлений от {len(admins)} админов, {args.connections} HTTP-соединений, "
+          f"задержка Bot API {args.api_latency * 1000:.0f} мс, параллельная обработка {args.concurrency}\n")
+    try:
+        rejected = await post_updates(webhook.port, bot.WEBHOOK_PATH, "wrong-secret", payloads[:1], 1)
+        assert rejected == [403], f"неверный секрет должен отклоняться, получено {rejected}"
+        started = time.perf_counter()
+        statuses = await post_updates(webhook.port, bot.WEBHOOK_PATH, secret, payloads, args.connections)
+        accepted = time.perf_counter() - started
+        await application.update_queue.join()
+        processed = time.perf_counter() - started
+        assert statuses.count(200) == len(payloads), f"не все обновления приняты: {collections.Counter(statuses)}"
+        print(f"Приём (HTTP 200):       {len(payloads) / accepted:>8.0f} обновлений/с")
+        print(f"Полная обработка:       {len(payloads) / processed:>8.0f} обновлений/с  ({processed:.2f} с)")
+        print(f"Вызовы Bot API:         {dict(telegram.calls)}")
+    finally:
+        await bot.stop_webhook(application, webhook)
+        server.stop_thread()
+
+async def bench_load(args):
+    """Нагрузочный тест: поток реалистичных действий N админов через Application, с поддельными RCON, SLP и Bot API."""
+    players = [f"Player_{i:03d}" for i in range(args.players)]
+    rcon = FakeRconServer(latency=args.rcon_latency, players=players, failure_mode=args.failure_mode,
+                          failure_rate=args.failure_rate, seed=args.seed)
+    status = FakeStatusServer(latency=args.rcon_latency, players=players)
+    rcon_port, status_port = rcon.start_in_thread(), status.start_in_thread()
+    bot.configure_servers({"main": {"host": "127.0.0.1", "rcon_port": rcon_port, "password": rcon.password, "game_port": status_port}})
+    bot.current_server().pool = bot.RconPool("127.0.0.1", rcon_port, rcon.password, timeout=args.rcon_timeout)
+    admins = list(range(1000, 1000 + args.admins))
+    bot.ALLOWED_USER_IDS = admins
+    updates = load_payloads(args.payloads) if args.payloads else generate_updates(admins, args.sessions, players, args.seed)
+    # Ошибки RCON при имитации сбоев ожидаемы и попадают в отчёт — в логе они только мешают
+    if args.failure_mode: logging.getLogger(bot.__name__).setLevel(logging.CRITICAL)
+
+    # build_application создаёт обработчик обновлений бота — подменяем его на засекающий время
+    original_processor, bot.ChatOrderedUpdateProcessor = bot.ChatOrderedUpdateProcessor, TimedUpdateProcessor
+    try:
+        telegram = FakeTelegramRequest(latency=args.api_latency)
+        application = bot.build_application(request=telegram)
+    finally:
+        bot.ChatOrderedUpdateProcessor = original_processor
+    processor = application.update_processor
+    print(f"{len(updates)} обновлений от {len(admins)} админов ({args.sessions} сессий у каждого), {args.players} игроков онлайн\n"
+          f"RCON {args.rcon_latency * 1000:.0f} мс, Bot API {args.api_latency * 1000:.0f} мс, "
+          f"сбои RCON: {args.failure_mode or 'нет'}" + (f" ({args.failure_rate:.0%})" if args.failure_mode else "") + "\n")
+    lag = []
+    await application.initialize()
+    await application.start()
+    lag_task = asyncio.create_task(measure_loop_lag(lag))
+    try:
+        started = time.perf_counter()
+        for i, data in enumerate(updates):
+            update = Update.de_json(data, application.bot)
+            processor.enqueued[update.update_id] = time.perf_counter()
+            await application.update_queue.put(update)
+            # --rate задаёт равномерный поток, иначе всё разом
+            if args.rate and (delay := started + (i + 1) / args.rate - time.perf_counter()) > 0: await asyncio.sleep(delay)
+        await application.update_queue.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        lag_task.cancel()
+        await application.stop()
+        await application.shutdown()
+        await bot.post_shutdown(application)
+        rcon.stop_thread()
+        status.stop_thread()
+
+    print(f"{'Пропускная способность':<28} {len(updates) / elapsed:>8.0f} обновлений/с  ({elapsed:.2f} с)")
+    report_percentiles("Задержка обновления", processor.latencies)
+    report_percentiles("Лаг event loop", lag)
+    print()
+    print(bot.stats_table("Обработчики по действиям, мс", "bot_handler_seconds"))
+    print()
+    print(bot.stats_table("RCON по командам, мс", "bot_rcon_seconds"))
+    errors = collections.Counter()
+    for key, value in bot.metrics.counters.get("bot_rcon_errors_total", {}).items(): errors[dict(key)["kind"]] += int(value)
+    print(f"\nRCON: {rcon.commands} пакетов на сервере, сбоев сервера {rcon.failures}, ошибок у бота {dict(errors) or 0}, "
+          f"подключений {rcon.connections}")
+    print(f"SLP-запросов статуса: {status.requests}, ошибок обработчиков: {int(bot.metrics.total('bot_handler_errors_total'))}")
+    print(f"Вызовы Bot API: {dict(telegram.calls)}")
+
+def write_log(path: str, lines: int, bursts: int, period: float, rotate_before: int, restart_time: float):
+    """Пишет строки в лог пачками, как сервер; перед пачкой rotate_before делает ротацию, как Minecraft при рестарте.
+
+    Minecraft архивирует latest.log при запуске, то есть через restart_time после последних строк старого лога.
+    """
+    written = 0
+    for burst in range(bursts):
+        if burst == rotate_before:
+            time.sleep(restart_time)
+            os.replace(path, path + ".archived")
+        with open(path, "a", encoding="utf-8") as f:
+            for _ in range(lines // bursts):
+                written += 1
+                f.write(f"[12:00:{written % 60:02d}] [Server thread/INFO]: Строка лога №{written} <Player_{written % 50:03d}> `привет`\n")
+        time.sleep(period)
+    return written
+
+async def bench_console(args):
+    """Живая консоль: поток строк лога с ротацией превращается в несколько правок сообщения на каждую консоль."""
+    workdir = tempfile.mkdtemp(prefix="bench_console_")
+    log_path = os.path.join(workdir, "latest.log")
+    old_lines = 100
+    with open(log_path, "w", encoding="utf-8") as f:
+        f.writelines(f"[11:59:59] [Server thread/INFO]: Старая строка {i}\n" for i in range(old_lines))
+    console = bot.current_server().console
+    console.log_path = log_path
+    bot.CONSOLE_EDIT_INTERVAL, bot.LOG_POLL_INTERVAL = args.edit_interval, args.poll_interval
+    telegram = FakeTelegramRequest(latency=args.api_latency)
+    application = bot.build_application(request=telegram)
+    await application.initialize()
+    print(f"{args.lines} строк лога пачками за {args.bursts * args.period:.1f} с, ротация на середине, "
+          f"{args.consoles} открытых консолей, правка не чаще раза в {args.edit_interval} с\n")
+    try:
+        sessions = [console.open(application.bot, chat_id, 1) for chat_id in range(1, args.consoles + 1)]
+        for session in sessions: session.refresh()
+        # Первое чтение берёт только хвост лога — начинаем писать, когда оно уже прошло
+        await asyncio.sleep(args.poll_interval * 2)
+        started = time.perf_counter()
+        written = await asyncio.to_thread(write_log, log_path, args.lines, args.bursts, args.period, args.bursts // 2,
+                                          args.poll_interval * 3)
+        # Даём последнему опросу и отложенной правке дойти до Telegram
+        await asyncio.sleep(args.poll_interval * 2 + args.edit_interval + args.api_latency * 2)
+        elapsed = time.perf_counter() - started
+        last_line = f"Строка лога №{written} "
+        assert all(last_line in session._rendered for session in sessions), "последняя строка не попала в консоль"
+        read = int(bot.metrics.total("bot_console_log_lines_total"))
+        # При открытии консоль показывает хвост уже существующего лога (он короче LOG_BACKLOG_BYTES)
+        assert read == written + old_lines, f"прочитано {read} строк, ожидалось {written + old_lines}"
+        edits = [session.edits for session in sessions]
+        print(f"Строк прочитано:          {read} ({old_lines} из старого лога + {written} новых, ни одна не потеряна)")
+        print(f"Правок на консоль:        {min(edits)}–{max(edits)} за {elapsed:.1f} с "
+              f"(вместо {written} правок при перерисовке на каждую строку)")
+        print(f"Вызовов editMessageText:  {telegram.calls['editMessageText']}")
+        print("OK: ротация лога обработана, последняя строка видна во всех консолях")
+    finally:
+        for chat_id in list(console.sessions): console.close(chat_id)
+        await application.shutdown()
+        for name in os.listdir(workdir): os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+async def bench_fleet(args):
+    """Сеть серверов: команда и пинг на всех серверах последовательно и одновременно (execute_fleet, fleet_status)."""
+    rcons, statuses, config = [], [], {}
+    for i in range(args.servers):
+        # Серверы сети стоят в разных местах: у каждого своя сетевая задержка
+        rcon = FakeRconServer(latency=0.001, network_delay=args.network_delay * (1 + i % 3))
+        status = FakeStatusServer(latency=args.network_delay * (1 + i % 3))
+        rcons.append(rcon)
+        statuses.append(status)
+        config[f"srv{i + 1}"] = {"host": "127.0.0.1", "rcon_port": rcon.start_in_thread(), "password": rcon.password,
+                                 "game_port": status.start_in_thread()}
+    # Выключенные серверы: на порт 1 подключение сразу отклоняется
+    for i in range(args.down): config[f"down{i + 1}"] = {"host": "127.0.0.1", "rcon_port": 1, "game_port": 1}
+    servers = list(bot.configure_servers(config).values())
+    command = "say Рестарт сети через 5 минут"
+    print(f"{args.servers} серверов онлайн и {args.down} выключенных, сетевая задержка "
+          f"{args.network_delay * 1000:.0f}–{args.network_delay * 3000:.0f} мс\n")
+    try:
+        # Прогрев: подключения к RCON и DNS-резолв адресов не должны попасть в замер
+        await bot.execute_fleet("list", servers)
+        await bot.fleet_status()
+        started = time.perf_counter()
+        for server in servers: await bot.execute_rcon(command, server)
+        sequential = time.perf_counter() - started
+        started = time.perf_counter()
+        results = await bot.execute_fleet(command, servers)
+        fanout = time.perf_counter() - started
+        assert sum(ok for _, ok, _, _ in results) == args.servers, "команда выполнилась не на всех живых серверах"
+        print(f"{'Команда по очереди':<28} {sequential * 1000:>8.0f} мс")
+        print(f"{'Команда на всю сеть':<28} {fanout * 1000:>8.0f} мс")
+        for server, ok, resp, elapsed in results:
+            print(f"  {'✅' if ok else '❌'} {server.name:<8} {elapsed * 1000:>6.0f} мс  {resp.splitlines()[0][:60]}")
+        for server in servers: server.cache.invalidate("status", "players")
+        started = time.perf_counter()
+        for server in servers: await bot.collect_server_status(server)
+        sequential = time.perf_counter() - started
+        for server in servers: server.cache.invalidate("status", "players")
+        started = time.perf_counter()
+        report = await bot.fleet_status()
+        fanout = time.perf_counter() - started
+        online = sum(not isinstance(status, Exception) for _, status, _, _ in report)
+        assert online == args.servers, f"онлайн {online} серверов из {args.servers}"
+        print(f"\n{'Статус по очереди':<28} {sequential * 1000:>8.0f} мс")
+        print(f"{'Статус всей сети':<28} {fanout * 1000:>8.0f} мс  (онлайн {online} из {len(report)})")
+    finally:
+        for server in servers: await server.pool.close()
+        for fake in rcons + statuses: fake.stop_thread()
+
+async def open_sessions(path: str) -> tuple:
+    """Открывает базу и загружает диалоги админов, как Application.initialize; возвращает (время, сколько загружено)."""
+    store = bot.StateStore(path)
+    started = time.perf_counter()
+    sessions = await bot.StatePersistence(store).get_user_data()
+    elapsed = time.perf_counter() - started
+    await store.close()
+    return elapsed, len(sessions)
+
+async def bench_store(args):
+    """Хранилище: журнал команд пишется пачками без лага event loop, запуск и подсказки не зависят от размера истории."""
+    workdir = tempfile.mkdtemp(prefix="bench_store_")
+    paths = {"пустая история": os.path.join(workdir, "empty.db"), "большая история": os.path.join(workdir, "state.db")}
+    print(f"Журнал {args.history} команд, история {args.players} ников, {args.admins} админов с незаконченными диалогами\n")
+    try:
+        for path in paths.values():
+            store = bot.StateStore(path)
+            persistence = bot.StatePersistence(store)
+            for user_id in range(args.admins):
+                await persistence.update_user_data(user_id, {"next_action": "ban", "server": "main", "console_mode": True})
+            await store.close()
+        store = bot.StateStore(paths["большая история"])
+        lag = []
+        lag_task = asyncio.create_task(measure_loop_lag(lag, interval=0.005))
+        started = time.perf_counter()
+        enqueue_time = 0.0
+        for i in range(0, args.history, 500):
+            # Как в живом боте: записи идут вперемешку с другой работой event loop
+            chunk_started = time.perf_counter()
+            for j in range(i, min(i + 500, args.history)):
+                store.audit((1000 + j % args.admins, f"Админ_{j % args.admins}"), "main", f"kick Player_{j % args.players:06d}",
+                            0.004, 64)
+            enqueue_time += time.perf_counter() - chunk_started
+            await asyncio.sleep(0)
+        store.players_seen("main", [f"Player_{i:06d}" for i in range(args.players)])
+        await store.flush()
+        elapsed = time.perf_counter() - started
+        lag_task.cancel()
+        print(f"{'Постановка в очередь':<28} {args.history / enqueue_time:>9.0f} записей/с (в event loop)")
+        print(f"{'Запись в базу':<28} {(args.history + args.players) / elapsed:>9.0f} записей/с ({elapsed:.2f} с)")
+        report_percentiles("Лаг event loop", lag)
+
+        latencies = collections.defaultdict(list)
+        rng = random.Random(0)
+        for _ in range(args.queries):
+            for name, call in (("Подсказка по началу ника", lambda: store.find_players(f"player_{rng.randrange(args.players):06d}"[:10], 9)),
+                               ("Недавние игроки", lambda: store.recent_players(8)),
+                               ("/audit kick (20 записей)", lambda: store.audit_entries(20, "kick"))):
+                started = time.perf_counter()
+                await call()
+                latencies[name].append(time.perf_counter() - started)
+        await store.close()
+        print()
+        for name, samples in latencies.items(): report_percentiles(name, samples)
+
+        print()
+        for name, path in paths.items():
+            elapsed, loaded = await open_sessions(path)
+            size = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+            print(f"{'Запуск, ' + name:<28} {elapsed * 1000:>8.1f} мс  (диалогов {loaded}, база {size / 1024 / 1024:.1f} МБ)")
+    finally:
+        for name in os.listdir(workdir): os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+def bench_timer_queue(sizes: tuple, ticks: int):
+    """Стоимость одного срабатывания таймера: куча TimerQueue против поиска ближайшей задачи перебором."""
+    print(f"{'Задач':>8} {'TimerQueue':>14} {'перебор':>14}")
+    for size in sizes:
+        rng = random.Random(size)
+        periods = [rng.uniform(1, 100) for _ in range(size)]
+        queue, naive = bot.TimerQueue(), {}
+        for key, period in enumerate(periods):
+            queue.push(period, key)
+            naive[key] = period
+        # Срабатывание: снять ближайший таймер и поставить его на следующий период
+        started = time.perf_counter()
+        for _ in range(ticks):
+            when = queue.next_time()
+            for when, key in queue.pop_due(when): queue.push(when + periods[key], key)
+        heap_cost = (time.perf_counter() - started) / ticks
+        naive_ticks = max(10, ticks * 1000 // size // 10)
+        started = time.perf_counter()
+        for _ in range(naive_ticks):
+            key = min(naive, key=naive.get)
+            naive[key] += periods[key]
+        naive_cost = (time.perf_counter() - started) / naive_ticks
+        print(f"{size:>8} {heap_cost * 1e6:>11.2f} мкс {naive_cost * 1e6:>11.1f} мкс")
+
+async def bench_scheduler(args):
+    """Планировщик: стоимость таймеров, опоздание запусков тысяч задач и откладывание на недоступных серверах."""
+    bench_timer_queue((1000, 10000, 100000), args.ticks)
+    # Пороги уменьшены, чтобы откладывание и пропуск успели случиться за время замера
+    bot.SCHEDULER_OVERLOAD_PING, bot.SCHEDULER_DEFER_DELAY, bot.SCHEDULER_MAX_DEFERS = 0.05, 1, 2
+    bot.RESTART_COUNTDOWN = (3, 2, 1)
+    main_rcon, slow_rcon = FakeRconServer(latency=0.001), FakeRconServer(latency=0.001)
+    main_status, slow_status = FakeStatusServer(latency=0.001), FakeStatusServer(latency=0.2)
+    config = {"main": {"host": "127.0.0.1", "rcon_port": main_rcon.start_in_thread(), "password": main_rcon.password,
+                       "game_port": main_status.start_in_thread()},
+              "overloaded": {"host": "127.0.0.1", "rcon_port": slow_rcon.start_in_thread(), "password": slow_rcon.password,
+                             "game_port": slow_status.start_in_thread()},
+              "down": {"host": "127.0.0.1", "rcon_port": 1, "game_port": 1}}
+    servers = list(bot.configure_servers(config).values())
+    # Окно гистограммы опозданий — на весь замер, а не на последние METRICS_WINDOW запусков
+    lateness = bot.Histogram(window=10 ** 7)
+    bot.metrics.histograms["bot_scheduler_lateness_seconds"] = {(): lateness}
+    scheduler = bot.Scheduler(bot.StateStore(None))
+    rng = random.Random(0)
+    now = time.time()
+    for i in range(args.jobs):
+        job = scheduler.add(f"Объявление {i}", "main", "commands", f"{args.period}s", [f"say Сообщение {i}"])
+        # Живые задачи созданы в разное время, поэтому их сроки разбросаны по периоду
+        job.next_run = now + rng.uniform(0, args.period)
+        scheduler._schedule(job)
+    for name in ("overloaded", "down"): scheduler.add(f"Погода на {name}", name, "commands", "1d", ["weather clear"])
+    restart = scheduler.add("Рестарт", "main", "restart", "1d")
+    print(f"\n{args.jobs} задач с периодом {args.period} с на одном сервере, замер {args.duration} с\n")
+    lag = []
+    lag_task = asyncio.create_task(measure_loop_lag(lag))
+    try:
+        await scheduler.start(None)
+        # Задачи на перегруженном и выключенном серверах должны сработать сразу: откладывание, затем пропуск
+        for job in scheduler.jobs.values():
+            if job.server != "main":
+                job.next_run = time.time()
+                scheduler._schedule(job)
+        scheduler.run_now(restart.id)
+        await asyncio.sleep(args.duration)
+    finally:
+        lag_task.cancel()
+        await scheduler.stop()
+        for server in servers: await server.pool.close()
+    runs = bot.metrics.counters.get("bot_scheduler_runs_total", {})
+    print("Запуски: " + ", ".join(f"{dict(key)['result']} {value:g}" for key, value in sorted(runs.items()))
+          + f" (по расписанию ожидалось ~{args.jobs * args.duration / args.period:.0f})\n")
+    report_percentiles("Опоздание запуска", list(lateness.recent))
+    report_percentiles("Лаг event loop", lag)
+    for job in scheduler.jobs.values():
+        if job.server != "main" or job.action == "restart": print(f"  #{job.id} {job.title} [{job.server}]: {job.last_result}")
+    for fake in (main_rcon, slow_rcon, main_status, slow_status): fake.stop_thread()
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки Telegram-бота для Minecraft")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+    rcon = sub.add_parser("rcon", help="Пропускная способность и задержка RCON")
+    rcon.add_argument("--commands", type=int, default=500)
+    rcon.add_argument("--concurrency", type=int, default=10)
+    rcon.add_argument("--pool-size", type=int, default=bot.RCON_POOL_SIZE)
+    rcon.add_argument("--latency", type=float, default=0.002, help="Задержка ответа сервера, сек")
+    fragments = sub.add_parser("fragments", help="Сборка длинных многопакетных ответов")
+    fragments.add_argument("--lines", type=int, default=2000)
+    fragments.add_argument("--fragment-size", type=int, default=4096)
+    fragments.add_argument("--parallel", type=int, default=8)
+    fragments.add_argument("--pool-size", type=int, default=bot.RCON_POOL_SIZE)
+    bulk = sub.add_parser("bulk", help="Пакетное выполнение сотен команд")
+    bulk.add_argument("--commands", type=int, default=500)
+    bulk.add_argument("--latency", type=float, default=0.0005, help="Время обработки команды сервером, сек")
+    bulk.add_argument("--network-delay", type=float, default=0.02, help="Сетевая задержка до сервера, сек")
+    render = sub.add_parser("render", help="Процессорное время отрисовки меню")
+    render.add_argument("--iterations", type=int, default=2000)
+    render.add_argument("--players", type=int, default=200)
+    webhook = sub.add_parser("webhook", help="Пропускная способность webhook с обработкой обновлений")
+    webhook.add_argument("--updates", type=int, default=2000)
+    webhook.add_argument("--admins", type=int, default=20)
+    webhook.add_argument("--connections", type=int, default=4)
+    webhook.add_argument("--concurrency", type=int, default=bot.UPDATE_CONCURRENCY)
+    webhook.add_argument("--api-latency", type=float, default=0.02, help="Задержка ответа Bot API, сек")
+    webhook.add_argument("--payloads", help="Файл с записанными Update JSON, по одному на строку")
+    load = sub.add_parser("load", help="Нагрузочный тест: поток действий нескольких админов")
+    load.add_argument("--admins", type=int, default=10)
+    load.add_argument("--sessions", type=int, default=20, help="Сколько сессий (меню, мастер, консоль...) у каждого админа")
+    load.add_argument("--players", type=int, default=50)
+    load.add_argument("--rate", type=float, default=0, help="Обновлений в секунду (0 — все сразу)")
+    load.add_argument("--api-latency", type=float, default=0.02, help="Задержка ответа Bot API, сек")
+    load.add_argument("--rcon-latency", type=float, default=0.002, help="Задержка ответа сервера (RCON и SLP), сек")
+    load.add_argument("--rcon-timeout", type=float, default=bot.RCON_TIMEOUT)
+    load.add_argument("--failure-mode", choices=FakeRconServer.FAILURE_MODES)
+    load.add_argument("--failure-rate", type=float, default=0.05)
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--payloads", help="Файл с записанными Update JSON вместо сгенерированных")
+    console = sub.add_parser("console", help="Живая консоль: объединение правок при потоке строк лога")
+    console.add_argument("--lines", type=int, default=5000)
+    console.add_argument("--bursts", type=int, default=10)
+    console.add_argument("--period", type=float, default=0.5, help="Пауза между пачками строк, сек")
+    console.add_argument("--consoles", type=int, default=3)
+    console.add_argument("--edit-interval", type=float, default=bot.CONSOLE_EDIT_INTERVAL)
+    console.add_argument("--poll-interval", type=float, default=bot.LOG_POLL_INTERVAL)
+    console.add_argument("--api-latency", type=float, default=0.05, help="Задержка ответа Bot API, сек")
+    fleet = sub.add_parser("fleet", help="Команды и статус на всей сети серверов одновременно")
+    fleet.add_argument("--servers", type=int, default=5)
+    fleet.add_argument("--down", type=int, default=1, help="Сколько серверов сети выключено")
+    fleet.add_argument("--network-delay", type=float, default=0.02, help="Сетевая задержка до ближайшего сервера, сек")
+    store = sub.add_parser("store", help="Хранилище: журнал команд, история ников и время запуска")
+    store.add_argument("--history", type=int, default=200000, help="Сколько команд записать в журнал")
+    store.add_argument("--players", type=int, default=20000, help="Сколько ников в истории")
+    store.add_argument("--admins", type=int, default=10)
+    store.add_argument("--queries", type=int, default=200)
+    scheduler = sub.add_parser("scheduler", help="Планировщик: таймеры на куче и опоздание запусков")
+    scheduler.add_argument("--jobs", type=int, default=2000)
+    scheduler.add_argument("--period", type=int, default=5, help="Период задач, сек")
+    scheduler.add_argument("--duration", type=float, default=15, help="Длительность замера, сек")
+    scheduler.add_argument("--ticks", type=int, default=100000, help="Срабатываний таймера в микробенчмарке очереди")
+    args = parser.parse_args()
+    # Остальные сценарии не пишут базу состояния рядом с ботом
+    if args.scenario != "store": bot.state_store.path = None
+    # Бот пишет в лог каждое действие админа — в замерах это лишний шум
+    logging.getLogger(bot.__name__).setLevel(logging.WARNING)
+    logging.getLogger("telegram").setLevel(logging.WARNING)
+    scenarios = {"rcon": bench_rcon, "fragments": bench_fragments, "bulk": bench_bulk, "render": bench_render,
+                 "webhook": bench_webhook, "load": bench_load, "console": bench_console,
+                 "fleet": bench_fleet, "store": bench_store, "scheduler": bench_scheduler}
+    asyncio.run(scenarios[args.scenario](args))
+
+if __name__ == "__main__":
+    main()
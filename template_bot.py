@@ -3,13 +3,36 @@
 # Шаблон многофункционального Telegram-бота для управления сервером Minecraft
 # -------------------------------------------------------------------------
 
+import asyncio
+import bisect
+import codecs
+import collections
+import contextlib
+import contextvars
+import heapq
+import hmac
+import itertools
+import json
 import logging
+import math
+import os
 import re
+import secrets
+import signal
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
 from functools import wraps
-from mcrcon import MCRcon
+from http import HTTPStatus
+from queue import Empty, SimpleQueue
 from mcstatus import JavaServer
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from telegram.ext import (
+    BaseUpdateProcessor,
+    BasePersistence,
+    PersistenceInput,
     Application,
     CommandHandler,
     ContextTypes,
@@ -18,7 +41,8 @@ from telegram.ext import (
     filters,
 )
 from telegram.constants import ParseMode
-from telegram.error import BadRequest
+from telegram.request import BaseRequest, HTTPXRequest
+from telegram.error import BadRequest, RetryAfter
 
 # =========================================================================
 # --- СЕКЦИЯ КОНФИГУРАЦИИ ---
@@ -42,6 +66,133 @@ RCON_PASSWORD = "YOUR_RCON_PASSWORD"
 # Игровой порт сервера (для команды статуса)
 GAME_PORT = 25565
 
+# -- Сеть из нескольких серверов --
+# None — бот управляет одним сервером с настройками выше. Для сети серверов перечислите их здесь
+# (log — необязательный путь к logs/latest.log для живой консоли, см. SERVER_LOG_PATH):
+# SERVERS = {
+#     "lobby": {"host": "10.0.0.2", "rcon_port": 25575, "password": "...", "game_port": 25565},
+#     "survival": {"host": "10.0.0.3", "rcon_port": 25575, "password": "...", "game_port": 25565,
+#                  "log": "/opt/survival/logs/latest.log"},
+# }
+# Первый сервер выбран по умолчанию; в главном меню появятся переключатель серверов и режим «Вся сеть».
+SERVERS = None
+
+# -- Настройки RCON-клиента --
+# Количество постоянных RCON-соединений в пуле
+RCON_POOL_SIZE = 2
+# Таймаут подключения и ожидания ответа на команду (в секундах)
+RCON_TIMEOUT = 5
+# Как часто проверять простаивающие соединения (в секундах)
+RCON_KEEPALIVE_INTERVAL = 60
+# Максимальная длина одной страницы ответа сервера в сообщении Telegram (в символах после экранирования MarkdownV2)
+RCON_OUTPUT_PAGE_SIZE = 3000
+
+# -- Пакетное выполнение команд --
+# Сколько команд пакета одновременно «в полёте» на одном RCON-соединении
+RCON_BULK_CONCURRENCY = 16
+# Максимум команд в одном пакете и максимальный размер загружаемого .txt файла (в байтах)
+BULK_MAX_COMMANDS = 1000
+BULK_MAX_FILE_SIZE = 256 * 1024
+# Фрагменты ответа сервера, по которым команда считается неудачной
+RCON_FAILURE_MARKERS = ("Unknown or incomplete command", "Incorrect argument", "<--[HERE]", "No player was found",
+                        "That player does not exist", "Unknown command")
+
+# -- Параллельная работа и защита от зависаний --
+# Сколько обновлений от Telegram обрабатывать одновременно. Обновления разных чатов идут параллельно,
+# а одного чата — строго по очереди, чтобы не перепутались диалоги (ввод ника, режим консоли)
+UPDATE_CONCURRENCY = 16
+# Сколько RCON-команд (от всех админов и пакетов вместе) может выполняться одновременно
+RCON_MAX_CONCURRENCY = 16
+# После стольких сбоев подряд сервер считается недоступным, и бот сразу отвечает ошибкой,
+# не дожидаясь таймаутов; через CIRCUIT_RESET_TIMEOUT секунд пробует снова
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_RESET_TIMEOUT = 15
+
+# -- Статус сервера --
+# Таймаут пинга сервера по игровому порту (в секундах)
+STATUS_TIMEOUT = 3
+
+# -- Кэш состояния сервера --
+# Сколько секунд считать свежими список игроков, статус, список плагинов и адрес сервера (DNS/SRV)
+CACHE_TTL = {"players": 5, "status": 10, "plugins": 300, "address": 300}
+# Команды, после которых закэшированные данные устаревают (команда -> какие ключи сбросить)
+CACHE_INVALIDATING_COMMANDS = {
+    "kick": ("players", "status"), "ban": ("players", "status"), "ban-ip": ("players", "status"),
+    "pardon": ("players",), "whitelist": ("players", "status"), "op": ("players",), "deop": ("players",),
+    "stop": ("players", "status", "plugins"), "reload": ("players", "status", "plugins"),
+}
+
+# -- Фоновый мониторинг сервера --
+# Требует: pip install "python-telegram-bot[job-queue]"
+# Включить периодический опрос сервера и уведомления о входе/выходе игроков и падении сервера
+MONITOR_ENABLED = False
+# Интервал опроса подстраивается под активность: от минимального (игроки заходят/выходят)
+# до максимального (на сервере тихо или он выключен), в секундах
+MONITOR_MIN_INTERVAL = 5
+MONITOR_MAX_INTERVAL = 60
+# Куда отправлять уведомления; None — всем пользователям из ALLOWED_USER_IDS
+MONITOR_NOTIFY_CHAT_IDS = None
+
+# -- Режим получения обновлений от Telegram --
+# None — long polling (по умолчанию, ничего настраивать не нужно).
+# Для webhook укажите публичный HTTPS-адрес, куда Telegram будет присылать обновления,
+# например "https://bot.example.com/telegram". Перед ботом нужен прокси с TLS (nginx, Caddy),
+# который перенаправляет запросы на WEBHOOK_LISTEN:WEBHOOK_PORT.
+WEBHOOK_URL = None
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+# Секрет, которым Telegram подписывает запросы; None — случайный при каждом запуске
+WEBHOOK_SECRET = None
+# Сколько секунд при остановке ждать завершения уже отправленных RCON-команд
+SHUTDOWN_DRAIN_TIMEOUT = 10
+
+# -- Живая консоль --
+# Путь к logs/latest.log сервера, если бот запущен на той же машине, например "/opt/minecraft/logs/latest.log".
+# Тогда в режиме консоли под ответом на команду показываются последние строки лога в реальном времени.
+# None — консоль показывает только ответы на команды.
+SERVER_LOG_PATH = None
+# Сколько последних строк лога держать и показывать в сообщении консоли
+CONSOLE_LOG_LINES = 25
+# Не чаще одного редактирования сообщения консоли за столько секунд (лимиты Telegram на правки)
+CONSOLE_EDIT_INTERVAL = 2
+# Как часто проверять лог на новые строки (в секундах)
+LOG_POLL_INTERVAL = 0.5
+
+# -- Метрики --
+# Порт локального HTTP-эндпоинта /metrics в формате Prometheus; None — не запускать.
+# Команда /stats в боте работает в любом случае.
+METRICS_PORT = None
+METRICS_LISTEN = "127.0.0.1"
+# Сколько последних замеров каждой метрики хранить для расчёта перцентилей
+METRICS_WINDOW = 1000
+
+# -- Постоянное хранилище --
+# Файл SQLite для незаконченных диалогов админов (переживают перезапуск бота), журнала RCON-команд (/audit)
+# и истории ников для подсказок при ручном вводе. None — всё только в памяти, журнала и подсказок нет.
+STATE_DB_PATH = "bot_state.db"
+# Записи копятся в памяти и уходят в базу одной транзакцией не чаще раза в столько секунд
+STATE_DB_FLUSH_INTERVAL = 1
+# Сколько дней хранить журнал команд
+AUDIT_RETENTION_DAYS = 90
+
+# -- Планировщик задач --
+# Рестарты с отсчётом, объявления и другие команды по расписанию (меню «⏰ Планировщик»; задачи хранятся в STATE_DB_PATH).
+# Перед запуском бот смотрит последний пинг сервера: если сервер не отвечает или пинг дольше SCHEDULER_OVERLOAD_PING
+# секунд (сервер перегружен), запуск откладывается на SCHEDULER_DEFER_DELAY секунд, а после SCHEDULER_MAX_DEFERS
+# откладываний подряд пропускается до следующего раза по расписанию.
+SCHEDULER_OVERLOAD_PING = 1.0
+SCHEDULER_DEFER_DELAY = 60
+SCHEDULER_MAX_DEFERS = 5
+# Запуск, пропущенный пока бот был выключен, выполняется при старте, только если опоздание меньше стольких секунд
+SCHEDULER_MISFIRE_GRACE = 300
+# За сколько секунд до рестарта предупреждать игроков в чате игры и тексты предупреждений
+RESTART_COUNTDOWN = (300, 60, 30, 10, 5, 4, 3, 2, 1)
+RESTART_MESSAGE = "Рестарт сервера через {}"
+RESTART_CANCELLED_MESSAGE = "Рестарт сервера отменён"
+# Сколько секунд ждать ответа на save-all flush перед рестартом: на большом мире сохранение идёт дольше RCON_TIMEOUT
+RESTART_SAVE_TIMEOUT = 120
+
 # --- КОНФИГУРАЦИЯ ЛОГИРОВАНИЯ ---
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -51,11 +202,15 @@ logger = logging.getLogger(__name__)
 # Эту часть обычно не нужно трогать
 # =========================================================================
 
+# Таблица замен для MarkdownV2 собирается один раз при запуске (str.translate быстрее re.sub)
+MARKDOWN_ESCAPE_TABLE = str.maketrans({char: "\\" + char for char in '\\_*[]()~`>#+=-|{}.!'})
+# Внутри блока кода MarkdownV2 экранируются только ` и \
+CODE_ESCAPE_TABLE = str.maketrans({"\\": "\\\\", "`": "\\`"})
+
 def escape_markdown(text: str) -> str:
     """Экранирует специальные символы для Telegram MarkdownV2."""
     if not isinstance(text, str): text = str(text)
-    escape_chars = r'_*[]()~`>#+=-|{}.!'
-    return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', text)
+    return text.translate(MARKDOWN_ESCAPE_TABLE)
 
 def restricted(func):
     """Декоратор для проверки прав доступа и логирования действий."""
@@ -64,55 +219,2040 @@ def restricted(func):
         user_id = update.effective_user.id
         if user_id not in ALLOWED_USER_IDS:
             logger.warning(f"Неавторизованный доступ от пользователя {user_id}")
+            metrics.inc("bot_unauthorized_total")
             return
         action_name = func.__name__
         if update.callback_query: action_name = update.callback_query.data
         elif update.message: action_name = update.message.text
         logger.info(f"Админ {update.effective_user.first_name} ({user_id}) -> Действие: {action_name}")
-        return await func(update, context, *args, **kwargs)
+        # Команды обработчика идут на сервер, выбранный админом в меню (см. current_server)
+        current_server_name.set(context.user_data.get('server'))
+        current_admin.set((user_id, update.effective_user.first_name))
+        # В метке — только вид действия (wizard:kick_exec), без ников и аргументов
+        action = ":".join(update.callback_query.data.split(":", 2)[:2]) if update.callback_query else func.__name__
+        try:
+            with metrics.time("bot_handler_seconds", action=action):
+                return await func(update, context, *args, **kwargs)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", action=action)
+            raise
     return wrapped
 
+def command_verb(command: str) -> str:
+    """Первое слово команды (kick, ban, list...) — по нему сбрасывается кэш и группируются метрики."""
+    return command.strip().lstrip("/").split(" ", 1)[0].lower()
+
+COLOR_CODE_RE = re.compile(r'§[0-9a-fk-or]')
+
+def strip_colors(text: str) -> str:
+    """Удаляет цветовые коды Minecraft (§ и символ) из ответа сервера."""
+    return COLOR_CODE_RE.sub('', text)
+
+def is_failure(resp: str) -> bool:
+    """Ответ означает, что команда не выполнилась: ошибка RCON (❌ от execute_rcon) или отказ сервера."""
+    return resp.startswith("❌") or any(marker in resp for marker in RCON_FAILURE_MARKERS)
+
+# =========================================================================
+# --- МЕТРИКИ ---
+# Счётчики и гистограммы в памяти: /metrics для Prometheus и /stats для админов
+# =========================================================================
+
+# Экранирование значений меток в формате Prometheus
+PROMETHEUS_ESCAPE_TABLE = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+class Histogram:
+    """Гистограмма длительностей: корзины для Prometheus и окно последних замеров для точных перцентилей."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # последняя корзина — +Inf
+        self.count, self.sum = 0, 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentiles(self, *quantiles: float) -> list:
+        """Перцентили по окну последних замеров (quantile от 0 до 1)."""
+        values = sorted(self.recent)
+        if not values: return [0.0] * len(quantiles)
+        return [values[min(len(values) - 1, int(q * len(values)))] for q in quantiles]
+
+class Metrics:
+    """Реестр счётчиков и гистограмм с метками.
+
+    Число рядов одной метрики ограничено MAX_SERIES: команды из консоли могут быть любыми,
+    и без лимита каждая опечатка навсегда оставалась бы в памяти отдельным рядом.
+    """
+
+    MAX_SERIES = 200
+
+    def __init__(self):
+        self.counters = {}    # имя -> {метки: значение}
+        self.histograms = {}  # имя -> {метки: Histogram}
+        self.collectors = []  # функции, которые в момент выгрузки отдают (имя, тип, метки, значение)
+        self.started = time.monotonic()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = self._key(series, labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = self._key(series, labels)
+        histogram = series.get(key)
+        if histogram is None: histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name: str, **labels):
+        """Замеряет длительность блока (успешного или нет), в секундах."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def total(self, name: str) -> float:
+        """Сумма счётчика по всем меткам."""
+        return sum(self.counters.get(name, {}).values())
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{self._labels(key)} {value:g}" for key, value in series.items()]
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for le, count in zip((*Histogram.BUCKETS, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(key)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{self._labels(key)} {histogram.count}")
+        collected = collections.defaultdict(list)
+        for collect in self.collectors:
+            for name, kind, labels, value in collect(): collected[(name, kind)].append((labels, value))
+        for (name, kind), samples in collected.items():
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [f"{name}{self._labels(tuple(labels.items()))} {value:g}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+    def _key(self, series: dict, labels: dict) -> tuple:
+        key = tuple(sorted(labels.items()))
+        if key not in series and len(series) >= self.MAX_SERIES: key = tuple((name, "other") for name, _ in key)
+        return key
+
+    @staticmethod
+    def _labels(key: tuple) -> str:
+        if not key: return ""
+        return "{" + ",".join(f'{name}="{str(value).translate(PROMETHEUS_ESCAPE_TABLE)}"' for name, value in key) + "}"
+
+metrics = Metrics()
+
+class InstrumentedRequest(BaseRequest):
+    """Обёртка над HTTP-клиентом Telegram, которая замеряет задержку каждого вызова Bot API."""
+
+    def __init__(self, request: BaseRequest):
+        self.request = request
+
+    @property
+    def read_timeout(self):
+        return self.request.read_timeout
+
+    async def initialize(self):
+        await self.request.initialize()
+
+    async def shutdown(self):
+        await self.request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        try:
+            with metrics.time("bot_telegram_api_seconds", method=api_method):
+                code, payload = await self.request.do_request(url, method, request_data, read_timeout, write_timeout,
+                                                              connect_timeout, pool_timeout)
+        except Exception:
+            metrics.inc("bot_telegram_api_errors_total", method=api_method)
+            raise
+        if code >= 400: metrics.inc("bot_telegram_api_errors_total", method=api_method)
+        return code, payload
+
+# =========================================================================
+# --- ПОСТОЯННОЕ ХРАНИЛИЩЕ ---
+# SQLite в режиме WAL: диалоги админов, журнал RCON-команд и история ников
+# =========================================================================
+
+# Не чаще раза в столько секунд обновлять в истории время, когда игрок был онлайн
+PLAYER_HISTORY_REFRESH = 300
+
+class StateStore:
+    """Хранилище в SQLite, которое не блокирует event loop.
+
+    Записи ставятся в очередь и пишутся отдельным потоком пачками — одна транзакция на
+    STATE_DB_FLUSH_INTERVAL секунд. Чтения идут через to_thread по своему соединению и в режиме WAL
+    не ждут писателя. База открывается при первом обращении, а при запуске читаются только
+    диалоги админов: журнал и история запрашиваются по мере надобности и на старт не влияют.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS audit (
+            id INTEGER PRIMARY KEY, ts REAL NOT NULL, user_id INTEGER, user_name TEXT, server TEXT NOT NULL,
+            command TEXT NOT NULL, verb TEXT NOT NULL, latency_ms REAL NOT NULL, response_bytes INTEGER NOT NULL, error TEXT);
+        CREATE INDEX IF NOT EXISTS audit_ts ON audit (ts);
+        CREATE INDEX IF NOT EXISTS audit_user ON audit (user_id, ts);
+        CREATE INDEX IF NOT EXISTS audit_verb ON audit (verb, ts);
+        CREATE TABLE IF NOT EXISTS players (
+            name TEXT PRIMARY KEY COLLATE NOCASE, server TEXT, first_seen REAL NOT NULL, last_seen REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS players_last_seen ON players (last_seen);
+        CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH, flush_interval: float = STATE_DB_FLUSH_INTERVAL):
+        self.path, self.flush_interval = path, flush_interval
+        self.written = 0
+        self._queue = SimpleQueue()  # (sql, параметры) | (None, вызвать после записи) | None — остановка
+        self._writer = None
+        self._reader = None
+        self._read_lock = threading.Lock()
+        self._seen_players = {}  # ник -> когда последний раз записан в историю
+
+    def write(self, sql: str, params: tuple = ()):
+        """Ставит запись в очередь; в базу она попадёт с ближайшей пачкой."""
+        if self._start(): self._queue.put((sql, params))
+
+    async def query(self, sql: str, params: tuple = ()) -> list:
+        """Выполняет чтение в отдельном потоке; без базы возвращает пустой список."""
+        if not self._start(): return []
+        return await asyncio.to_thread(self._query, sql, params)
+
+    async def flush(self):
+        """Ждёт, пока всё, что уже стоит в очереди, окажется в базе."""
+        if not self._start(): return
+        loop, done = asyncio.get_running_loop(), asyncio.Event()
+        self._queue.put((None, lambda: loop.call_soon_threadsafe(done.set)))
+        await done.wait()
+
+    async def close(self):
+        """Дописывает очередь и закрывает базу."""
+        if self._writer is None: return
+        self._queue.put(None)
+        await asyncio.to_thread(self._writer.join)
+        self._writer = None
+        with self._read_lock:
+            if self._reader: self._reader.close()
+            self._reader = None
+
+    def audit(self, admin: tuple, server: str, command: str, latency: float, response_bytes: int, error: str = None):
+        """Добавляет выполненную RCON-команду в журнал; admin — (id, имя) админа."""
+        self.write("INSERT INTO audit (ts, user_id, user_name, server, command, verb, latency_ms, response_bytes, error) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                   (time.time(), *admin, server, command, command_verb(command), latency * 1000, response_bytes, error))
+
+    def players_seen(self, server: str, names: list):
+        """Отмечает игроков онлайн в истории ников (каждого — не чаще раза в PLAYER_HISTORY_REFRESH секунд)."""
+        now = time.time()
+        for name in names:
+            if now - self._seen_players.get(name, 0) < PLAYER_HISTORY_REFRESH: continue
+            self._seen_players[name] = now
+            self.write("INSERT INTO players (name, server, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT(name) DO UPDATE SET server = excluded.server, last_seen = excluded.last_seen",
+                       (name, server, now, now))
+
+    async def recent_players(self, limit: int) -> list:
+        """Ники игроков, которые заходили последними."""
+        return [name for name, in await self.query("SELECT name FROM players ORDER BY last_seen DESC LIMIT ?", (limit,))]
+
+    async def find_players(self, prefix: str, limit: int) -> list:
+        """Ники из истории, начинающиеся с prefix (без учёта регистра), по алфавиту."""
+        return [name for name, in await self.query("SELECT name FROM players WHERE name >= ? AND name < ? ORDER BY name LIMIT ?",
+                                                   (prefix, prefix + "\U0010ffff", limit))]
+
+    async def audit_entries(self, limit: int, verb: str = None) -> list:
+        """Последние записи журнала (все или только команды verb): (время, админ, сервер, команда, мс, байт, ошибка)."""
+        where, params = ("WHERE verb = ? ", (verb,)) if verb else ("", ())
+        return await self.query("SELECT ts, user_name, server, command, latency_ms, response_bytes, error FROM audit "
+                                f"{where}ORDER BY ts DESC LIMIT ?", (*params, limit))
+
+    def _start(self) -> bool:
+        if not self.path: return False
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="state-store", daemon=True)
+            self._writer.start()
+        return True
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10, **kwargs)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL synchronous=NORMAL не теряет целостность, но не ждёт fsync на каждую транзакцию
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(self.SCHEMA)
+        return connection
+
+    def _query(self, sql: str, params: tuple) -> list:
+        with self._read_lock:
+            try:
+                if self._reader is None: self._reader = self._connect(check_same_thread=False)
+                return self._reader.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось прочитать из {self.path}: {e}")
+                return []
+
+    def _write_loop(self):
+        try:
+            connection = self._connect()
+            with connection: connection.execute("DELETE FROM audit WHERE ts < ?", (time.time() - AUDIT_RETENTION_DAYS * 86400,))
+        except sqlite3.Error as e:
+            logger.error(f"Хранилище {self.path} недоступно, данные останутся только в памяти: {e}")
+            connection = None
+        while True:
+            # Пачка копится flush_interval секунд; flush() и остановка записывают её сразу
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while items[-1] is not None and items[-1][0] is not None:
+                try: items.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except Empty: break
+            writes = [item for item in items if item is not None and item[0] is not None]
+            if connection is not None and writes:
+                try:
+                    with connection:
+                        # Подряд идущие одинаковые запросы (журнал, история ников) — одним executemany
+                        for sql, group in itertools.groupby(writes, key=lambda item: item[0]):
+                            connection.executemany(sql, [params for _, params in group])
+                    self.written += len(writes)
+                except sqlite3.Error as e:
+                    logger.error(f"Не удалось записать в {self.path} ({len(writes)} записей): {e}")
+            for item in items:
+                if item is None:
+                    if connection: connection.close()
+                    return
+                if item[0] is None: item[1]()
+
+state_store = StateStore()
+# Админ (id, имя), от имени которого выполняются команды; restricted выставляет его для каждого обновления
+current_admin = contextvars.ContextVar("current_admin", default=None)
+
+class StatePersistence(BasePersistence):
+    """Сохраняет context.user_data (незаконченные мастера, режим консоли, выбранный сервер) в StateStore.
+
+    Остальные данные PTB бот не использует, поэтому они не хранятся.
+    """
+
+    def __init__(self, store: StateStore, update_interval: float = STATE_DB_FLUSH_INTERVAL):
+        super().__init__(PersistenceInput(bot_data=False, chat_data=False, callback_data=False), update_interval)
+        self.store = store
+        self._saved = {}  # админ -> последний записанный JSON, чтобы не переписывать неизменившееся
+
+    async def get_user_data(self) -> dict:
+        rows = await self.store.query("SELECT user_id, data FROM user_data")
+        self._saved = dict(rows)
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def update_user_data(self, user_id: int, data: dict):
+        encoded = json.dumps(data, ensure_ascii=False, default=str)
+        if self._saved.get(user_id) == encoded: return
+        self._saved[user_id] = encoded
+        self.store.write("INSERT INTO user_data (user_id, data) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                         (user_id, encoded))
+
+    async def drop_user_data(self, user_id: int):
+        self._saved.pop(user_id, None)
+        self.store.write("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def flush(self):
+        await self.store.flush()
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+# =========================================================================
+# --- АСИНХРОННЫЙ RCON-КЛИЕНТ ---
+# Постоянные соединения вместо подключения на каждую команду
+# =========================================================================
+
+# Типы пакетов протокола RCON (у ответа на аутентификацию тот же номер, что у команды)
+RCON_PACKET_RESPONSE = 0
+RCON_PACKET_AUTH_RESPONSE = 2
+RCON_PACKET_COMMAND = 2
+RCON_PACKET_AUTH = 3
+
+class RconError(Exception):
+    """Ошибка соединения или протокола RCON."""
+
+class RconTimeoutError(RconError):
+    """Сервер не ответил за RCON_TIMEOUT секунд."""
+
+class CircuitOpenError(ConnectionError):
+    """Операция отклонена сразу: предохранитель считает сервер недоступным."""
+
+class CircuitBreaker:
+    """Предохранитель: после нескольких сбоев подряд отклоняет операции сразу, не дожидаясь таймаутов.
+
+    Через reset_timeout секунд пропускает одну пробную операцию: удалась — работа восстанавливается,
+    не удалась — ещё reset_timeout секунд быстрых отказов.
+    """
+
+    def __init__(self, name: str, threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name, self.threshold, self.reset_timeout = name, threshold, reset_timeout
+        self.failures = 0
+        self.opened_at = None  # None — предохранитель замкнут, операции идут как обычно
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half-open" if time.monotonic() >= self.opened_at + self.reset_timeout else "open"
+
+    def check(self):
+        """Бросает CircuitOpenError, если операцию нужно отклонить, не начиная."""
+        if self.opened_at is None: return
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0 or self._probing:
+            raise CircuitOpenError(f"{self.name} недоступен, следующая попытка через {max(1, math.ceil(remaining))} с")
+        self._probing = True
+
+    def record(self, ok: bool):
+        """Учитывает результат операции."""
+        if ok:
+            if self.opened_at is not None: logger.info(f"Предохранитель '{self.name}': связь восстановлена")
+            self.failures, self.opened_at = 0, None
+            return
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None: logger.warning(f"Предохранитель '{self.name}': сбоев подряд: {self.failures}, быстрые отказы на {self.reset_timeout} с")
+            self.opened_at = time.monotonic()
+
+    @contextlib.contextmanager
+    def guard(self, failures: tuple = (Exception,)):
+        """Оборачивает одну операцию: проверяет предохранитель и учитывает исход (сбоем считаются исключения failures)."""
+        self.check()
+        try:
+            yield
+        except failures:
+            self.record(False)
+            raise
+        else:
+            self.record(True)
+        finally:
+            # Пробная операция закончилась (в том числе отменой) — следующая может пробовать снова
+            self._probing = False
+
+class RconConnection:
+    """Одно аутентифицированное RCON-соединение с мультиплексированием запросов по request ID."""
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = RCON_TIMEOUT, name: str = "main"):
+        self.host, self.port, self.password, self.timeout, self.name = host, port, password, timeout, name
+        self._reader = self._writer = self._read_task = None
+        self._pending = {}  # request_id -> (очередь фрагментов, это ли пакет-маркер конца)
+        self._ids = itertools.count(1)
+        self.last_used = time.monotonic()
+
+    @property
+    def in_flight(self) -> int:
+        """Сколько запросов на этом соединении ещё ждут ответа."""
+        return len(self._pending)
+
+    @property
+    def is_alive(self) -> bool:
+        return self._read_task is not None and not self._read_task.done() and not self._writer.is_closing()
+
+    async def connect(self):
+        """Открывает TCP-соединение и проходит аутентификацию."""
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        self._read_task = asyncio.create_task(self._read_loop())
+        queue = self._register(self._next_id())
+        try:
+            self._send(queue.request_id, RCON_PACKET_AUTH, self.password)
+            await self._writer.drain()
+            await self._next_fragment(queue)
+        except Exception:
+            await self.close()
+            raise
+        finally:
+            self._pending.pop(queue.request_id, None)
+
+    async def command(self, command: str, timeout: float = None) -> str:
+        """Отправляет команду и возвращает полностью собранный ответ."""
+        return "".join([chunk async for chunk in self.stream(command, timeout)])
+
+    async def stream(self, command: str, timeout: float = None):
+        """Отправляет команду и отдаёт ответ по фрагментам по мере их прихода.
+
+        timeout — сколько ждать каждого фрагмента вместо self.timeout (для долгих команд вроде save-all flush).
+
+        Ответы длиннее 4096 байт сервер режет на несколько пакетов без признака конца.
+        Поэтому сразу за командой отправляется пустая команда-маркер: сервер обрабатывает
+        запросы одного соединения по порядку, и ответ на маркер означает, что все фрагменты получены.
+        """
+        if not self.is_alive: raise RconError("нет соединения с сервером")
+        queue = self._register(self._next_id())
+        sentinel_id = self._next_id()
+        self._pending[sentinel_id] = (queue, True)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.last_used = time.monotonic()
+        sent = received = 0
+        try:
+            sent = self._send(queue.request_id, RCON_PACKET_COMMAND, command)
+            self._send(sentinel_id, RCON_PACKET_COMMAND, "")
+            await self._writer.drain()
+            while (fragment := await self._next_fragment(queue, timeout)) is not None:
+                received += len(fragment)
+                # Многобайтовый символ UTF-8 может оказаться разрезан между пакетами
+                text = decoder.decode(fragment)
+                if text: yield text
+            if tail := decoder.decode(b"", final=True): yield tail
+        finally:
+            self._pending.pop(queue.request_id, None)
+            self._pending.pop(sentinel_id, None)
+            # Пустая команда — это проверка соединения, в трафик команд её не записываем
+            if command:
+                verb = command_verb(command)
+                metrics.inc("bot_rcon_bytes_total", sent, server=self.name, verb=verb, direction="out")
+                metrics.inc("bot_rcon_bytes_total", received, server=self.name, verb=verb, direction="in")
+
+    async def close(self):
+        if self._read_task: self._read_task.cancel()
+        if self._writer:
+            self._writer.close()
+            try: await self._writer.wait_closed()
+            except Exception: pass
+        self._fail_pending(RconError("соединение закрыто"))
+
+    def _next_id(self) -> int:
+        # ID должен помещаться в int32 и не быть равен -1 (признак неверного пароля)
+        request_id = next(self._ids)
+        if request_id >= 2**31 - 1:
+            self._ids = itertools.count(1)
+            request_id = next(self._ids)
+        return request_id
+
+    def _register(self, request_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        queue.request_id = request_id
+        self._pending[request_id] = (queue, False)
+        return queue
+
+    async def _next_fragment(self, queue: asyncio.Queue, timeout: float = None):
+        """Ждёт следующий фрагмент ответа; None означает конец ответа."""
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise RconTimeoutError("сервер не ответил вовремя") from None
+        if isinstance(item, Exception): raise item
+        return item
+
+    def _send(self, request_id: int, packet_type: int, payload: str) -> int:
+        data = payload.encode("utf-8")
+        self._writer.write(struct.pack("<iii", len(data) + 10, request_id, packet_type) + data + b"\x00\x00")
+        return len(data) + 14
+
+    async def _read_loop(self):
+        """Читает пакеты и раздаёт их ожидающим запросам по request ID."""
+        try:
+            while True:
+                (length,) = struct.unpack("<i", await self._reader.readexactly(4))
+                body = await self._reader.readexactly(length)
+                request_id, packet_type = struct.unpack("<ii", body[:8])
+                if request_id == -1:
+                    self._fail_pending(RconError("неверный RCON пароль"))
+                    return
+                entry = self._pending.get(request_id)
+                # Пакеты других типов ответом на наши запросы не являются
+                if entry and packet_type in (RCON_PACKET_RESPONSE, RCON_PACKET_AUTH_RESPONSE):
+                    queue, is_sentinel = entry
+                    queue.put_nowait(None if is_sentinel else body[8:-2])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._fail_pending(RconError(f"соединение разорвано ({e or type(e).__name__})"))
+        finally:
+            if self._writer: self._writer.close()
+
+    def _fail_pending(self, error: Exception):
+        for queue, _ in self._pending.values(): queue.put_nowait(error)
+        self._pending.clear()
+
+class RconPool:
+    """Небольшой пул постоянных RCON-соединений с ленивым подключением и автоматическим переподключением."""
+
+    def __init__(self, host: str, port: int, password: str, size: int = RCON_POOL_SIZE,
+                 timeout: float = RCON_TIMEOUT, keepalive: float = RCON_KEEPALIVE_INTERVAL,
+                 max_concurrency: int = RCON_MAX_CONCURRENCY, name: str = "main"):
+        self.host, self.port, self.password, self.timeout, self.keepalive = host, port, password, timeout, keepalive
+        self.name = name
+        self.breaker = CircuitBreaker(f"RCON {name}")
+        self.limiter = asyncio.Semaphore(max_concurrency)
+        self._slots = [None] * max(1, size)
+        self._slot_locks = [asyncio.Lock() for _ in self._slots]
+        self._round_robin = itertools.cycle(range(len(self._slots)))
+        self._keepalive_task = None
+
+    async def acquire(self) -> RconConnection:
+        """Возвращает живое соединение пула, подключаясь при необходимости."""
+        return await self._acquire(next(self._round_robin))
+
+    @contextlib.asynccontextmanager
+    async def operation(self, command: str):
+        """Место для одной RCON-операции: не больше max_concurrency одновременно, с учётом предохранителя.
+
+        Длительность (включая ожидание места) и ошибки попадают в метрики по серверу и первому слову команды,
+        а команды админов (current_admin) — ещё и в журнал state_store. Размер ответа для журнала
+        выполняющий команду записывает в отданный словарь: result["bytes"].
+        """
+        verb = command_verb(command)
+        result, error, started = {"bytes": 0}, None, time.monotonic()
+        try:
+            with metrics.time("bot_rcon_seconds", server=self.name, verb=verb):
+                # Предохранитель проверяется до очереди за местом: при лежащем сервере отказ приходит сразу
+                with self.breaker.guard(failures=(RconError,)):
+                    async with self.limiter: yield result
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if isinstance(e, (RconError, CircuitOpenError)):
+                kind = "timeout" if isinstance(e, RconTimeoutError) else "circuit" if isinstance(e, CircuitOpenError) else "error"
+                metrics.inc("bot_rcon_errors_total", server=self.name, verb=verb, kind=kind)
+            raise
+        finally:
+            # Фоновые опросы мониторинга идут без админа и в журнал не попадают
+            if (admin := current_admin.get()) is not None:
+                state_store.audit(admin, self.name, command, time.monotonic() - started, result["bytes"], error)
+
+    async def command(self, command: str, timeout: float = None) -> str:
+        """Выполняет команду на одном из соединений пула (timeout — см. RconConnection.stream)."""
+        async with self.operation(command) as result:
+            connection = await self.acquire()
+            try:
+                resp = await connection.command(command, timeout)
+                result["bytes"] = len(resp.encode("utf-8"))
+                return resp
+            except RconTimeoutError:
+                await self.discard(connection)
+                raise
+
+    async def stream(self, command: str, timeout: float = None):
+        """Выполняет команду и отдаёт ответ по фрагментам (см. RconConnection.stream)."""
+        async with self.operation(command) as result:
+            connection = await self.acquire()
+            try:
+                async for chunk in connection.stream(command, timeout):
+                    result["bytes"] += len(chunk.encode("utf-8"))
+                    yield chunk
+            except RconTimeoutError:
+                await self.discard(connection)
+                raise
+
+    async def discard(self, connection: RconConnection):
+        """Закрывает соединение, которое перестало отвечать, и освобождает его слот для переподключения.
+
+        Полуоткрытое TCP-соединение (например, после сброса NAT) выглядит живым, но ответы по нему
+        не приходят — без этого все следующие команды на нём ждали бы таймаута.
+        """
+        for i, slot in enumerate(self._slots):
+            if slot is connection: self._slots[i] = None
+        await connection.close()
+
+    async def drain(self, timeout: float = SHUTDOWN_DRAIN_TIMEOUT):
+        """Ждёт (не дольше timeout), пока на соединениях пула не останется команд без ответа."""
+        deadline = time.monotonic() + timeout
+        while any(c and c.in_flight for c in self._slots) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def close(self):
+        """Закрывает все соединения и останавливает keepalive."""
+        if self._keepalive_task: self._keepalive_task.cancel()
+        self._keepalive_task = None
+        for i, connection in enumerate(self._slots):
+            if connection: await connection.close()
+            self._slots[i] = None
+
+    async def _acquire(self, slot: int) -> RconConnection:
+        connection = self._slots[slot]
+        if connection and connection.is_alive: return connection
+        async with self._slot_locks[slot]:
+            # Другая корутина могла уже переподключить этот слот, пока мы ждали
+            connection = self._slots[slot]
+            if connection and connection.is_alive: return connection
+            if connection: await connection.close()
+            connection = RconConnection(self.host, self.port, self.password, self.timeout, self.name)
+            try:
+                await connection.connect()
+            except asyncio.TimeoutError:
+                raise RconTimeoutError("сервер не отвечает") from None
+            except OSError as e:
+                raise RconError(f"не удалось подключиться ({e.strerror or e})") from None
+            self._slots[slot] = connection
+            if self._keepalive_task is None and self.keepalive:
+                self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+            return connection
+
+    async def _keepalive_loop(self):
+        """Пингует простаивающие соединения, чтобы NAT/фаервол не разорвал их незаметно."""
+        while True:
+            await asyncio.sleep(self.keepalive)
+            for i, connection in enumerate(self._slots):
+                if not connection: continue
+                if not connection.is_alive:
+                    await self.discard(connection)
+                elif time.monotonic() - connection.last_used >= self.keepalive:
+                    try:
+                        await connection.command("")
+                    except RconError as e:
+                        logger.info(f"RCON-соединение #{i} ({self.name}) потеряно при проверке: {e}")
+                        await self.discard(connection)
+
+# =========================================================================
+# --- КЭШ СОСТОЯНИЯ СЕРВЕРА ---
+# Одинаковые запросы от нескольких админов превращаются в один запрос к серверу
+# =========================================================================
+
+class StateCache:
+    """Кэш с отдельным TTL на каждый ключ и объединением одновременных запросов.
+
+    Если значение устарело и его уже кто-то загружает, остальные ждут ту же загрузку,
+    а не отправляют на сервер свой запрос. Ошибки загрузки не кэшируются.
+    """
+
+    def __init__(self, ttls: dict):
+        self.ttls = ttls
+        self._values = {}    # ключ -> (момент устаревания, значение)
+        self._inflight = {}  # ключ -> задача загрузки
+        self._generation = {}  # ключ -> номер поколения; растёт при каждом сбросе
+        self._versions = {}    # ключ -> версия значения; растёт, когда значение меняется
+        self.counters = {key: {"hits": 0, "misses": 0, "coalesced": 0} for key in ttls}
+
+    async def get(self, key: str, loader):
+        """Возвращает свежее значение из кэша или загружает его через loader()."""
+        counters = self.counters.setdefault(key, {"hits": 0, "misses": 0, "coalesced": 0})
+        entry = self._values.get(key)
+        if entry and entry[0] > time.monotonic():
+            counters["hits"] += 1
+            return entry[1]
+        task = self._inflight.get(key)
+        if task:
+            counters["coalesced"] += 1
+        else:
+            counters["misses"] += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        # shield: отмена одного ожидающего не должна отменять загрузку для остальных
+        return await asyncio.shield(task)
+
+    def put(self, key: str, value, ttl: float = None):
+        """Кладёт в кэш значение, полученное в обход get() (например, фоновым опросом)."""
+        previous = self._values.get(key)
+        if previous is None or previous[1] != value: self._versions[key] = self._versions.get(key, 0) + 1
+        self._values[key] = (time.monotonic() + (self.ttls.get(key, 0) if ttl is None else ttl), value)
+
+    def invalidate(self, *keys: str):
+        """Сбрасывает значения; уже идущие загрузки этих ключей не попадут в кэш."""
+        for key in keys or tuple(self._values):
+            self._values.pop(key, None)
+            self._inflight.pop(key, None)
+            self._generation[key] = self._generation.get(key, 0) + 1
+
+    def version(self, key: str) -> int:
+        """Версия значения: меняется только при изменении самих данных (удобно как ключ мемоизации)."""
+        return self._versions.get(key, 0)
+
+    def stats(self) -> dict:
+        """Счётчики попаданий/промахов по каждому ключу и общая доля попаданий."""
+        hits = sum(c["hits"] + c["coalesced"] for c in self.counters.values())
+        total = hits + sum(c["misses"] for c in self.counters.values())
+        return {"keys": self.counters, "hit_rate": hits / total if total else 0.0}
+
+    async def _load(self, key: str, loader):
+        generation = self._generation.get(key, 0)
+        try:
+            value = await loader()
+            if self._generation.get(key, 0) == generation: self.put(key, value)
+            return value
+        finally:
+            if self._generation.get(key, 0) == generation: self._inflight.pop(key, None)
+
+def invalidate_state_for(command: str, server=None):
+    """Сбрасывает кэш сервера, если команда меняет его состояние (кик, бан, whitelist и т.п.).
+
+    Вызывается после ответа на команду, а не перед ней: иначе список игроков, загруженный,
+    пока команда шла, попал бы в кэш уже устаревшим и жил бы весь TTL.
+    """
+    keys = CACHE_INVALIDATING_COMMANDS.get(command_verb(command))
+    if keys: (server or current_server()).cache.invalidate(*keys)
+
 # =========================================================================
 # --- ОСНОВНЫЕ ФУНКЦИИ ВЗАИМОДЕЙСТВИЯ С MINECRAFT ---
 # =========================================================================
 
-async def execute_rcon(command: str) -> str:
-    """Безопасно выполняет RCON команду и возвращает ответ."""
+# Все функции ниже работают с сервером server, а если он не передан — с выбранным админом (current_server)
+
+def collect_state_metrics():
+    """Метрики кэша и предохранителей, которые считаются в момент выгрузки."""
+    for server in servers.values():
+        for key, counters in server.cache.counters.items():
+            for result, value in counters.items():
+                yield "bot_cache_requests_total", "counter", {"server": server.name, "key": key, "result": result}, value
+        yield "bot_cache_hit_ratio", "gauge", {"server": server.name}, server.cache.stats()["hit_rate"]
+        for breaker in (server.pool.breaker, server.status_breaker):
+            yield "bot_circuit_open", "gauge", {"name": breaker.name}, int(breaker.state != "closed")
+    yield "bot_uptime_seconds", "gauge", {}, time.monotonic() - metrics.started
+
+metrics.collectors.append(collect_state_metrics)
+
+async def execute_rcon(command: str, server=None, timeout: float = None) -> str:
+    """Безопасно выполняет RCON команду и возвращает ответ (timeout — сколько ждать ответа вместо RCON_TIMEOUT)."""
+    server = server or current_server()
     try:
-        with MCRcon(RCON_HOST, RCON_PASSWORD, port=RCON_PORT, timeout=5) as mcr:
-            resp = mcr.command(command)
-            # Удаляем цветовые коды Minecraft из ответа для чистоты
-            return re.sub(r'§[0-9a-fk-or]', '', resp) if resp else "✅ Команда выполнена."
+        resp = await server.pool.command(command, timeout)
+        # Удаляем цветовые коды Minecraft из ответа для чистоты
+        return strip_colors(resp) if resp else "✅ Команда выполнена."
     except Exception as e:
         logger.error(f"Ошибка RCON: {e}")
         return f"❌ Ошибка RCON: {e}"
+    finally:
+        invalidate_state_for(command, server)
 
-async def get_online_players() -> list:
-    """Возвращает список ников игроков онлайн."""
-    resp = await execute_rcon('list')
+async def stream_rcon(command: str, server=None):
+    """Выполняет RCON команду и отдаёт ответ частями, не собирая его целиком в памяти."""
+    carry, produced = "", False
+    server = server or current_server()
+    try:
+        async for chunk in server.pool.stream(command):
+            chunk = carry + chunk
+            # Цветовой код (§ + символ) может оказаться разрезан между фрагментами
+            carry = "§" if chunk.endswith("§") else ""
+            chunk = strip_colors(chunk[:-1] if carry else chunk)
+            if chunk:
+                produced = True
+                yield chunk
+    except Exception as e:
+        logger.error(f"Ошибка RCON: {e}")
+        produced = True
+        yield f"❌ Ошибка RCON: {e}"
+    finally:
+        invalidate_state_for(command, server)
+    if not produced: yield "✅ Команда выполнена."
+
+async def cached_rcon(key: str, command: str, server=None):
+    """Отдаёт ответ на команду из кэша (ключ key) тем же потоком фрагментов, что и stream_rcon."""
+    server = server or current_server()
+    try:
+        resp = await server.cache.get(key, lambda: server.pool.command(command))
+        yield strip_colors(resp) if resp else "✅ Команда выполнена."
+    except Exception as e:
+        logger.error(f"Ошибка RCON: {e}")
+        yield f"❌ Ошибка RCON: {e}"
+
+async def paginate(chunks, page_size: int = RCON_OUTPUT_PAGE_SIZE):
+    """Собирает поток фрагментов в страницы не длиннее page_size, по возможности разрезая по строкам.
+
+    Длина считается после escape_markdown: в выводе с множеством _ | ( ) . - экранирование почти удваивает текст.
+    """
+    buffer = ""
+    async for chunk in chunks:
+        buffer += chunk
+        while len(escape_markdown(buffer)) > page_size:
+            limit = page_size
+            while (escaped := len(escape_markdown(buffer[:limit]))) > page_size:
+                limit = max(1, min(limit - 1, limit * page_size // escaped))
+            cut = buffer.rfind("\n", 0, limit)
+            if cut < limit // 2: cut = limit
+            yield buffer[:cut]
+            buffer = buffer[cut:].lstrip("\n")
+    yield buffer
+
+async def for_each_page(chunks, deliver):
+    """Передаёт каждую страницу потока фрагментов в deliver(escaped_page, index, is_last).
+
+    Одна страница придерживается до прихода следующей, чтобы deliver знал, последняя ли она.
+    Каждая страница экранируется отдельно — весь ответ никогда не собирается в одну строку.
+    """
+    held, index = None, 0
+    async for page in paginate(chunks):
+        if held is not None:
+            await deliver(escape_markdown(held), index, False)
+            index += 1
+        held = page
+    await deliver(escape_markdown(held), index, True)
+
+async def fetch_online_players(server=None) -> list:
+    """Запрашивает у сервера список ников игроков онлайн (без кэша)."""
+    server = server or current_server()
+    with metrics.time("bot_status_seconds", stage="list"):
+        resp = strip_colors(await server.pool.command('list'))
     if "There are 0 of a max" in resp or not ":" in resp: return []
+    players_str = resp.split(":", 1)[1]
+    players = [p.strip() for p in players_str.split(",") if p.strip()]
+    state_store.players_seen(server.name, players)
+    return players
+
+async def get_online_players(server=None) -> list:
+    """Возвращает список ников игроков онлайн."""
+    server = server or current_server()
+    snapshot = server.monitor.fresh_snapshot()
+    if snapshot and not snapshot.online: return []
+    try:
+        return await server.cache.get("players", lambda: fetch_online_players(server))
+    except Exception as e:
+        logger.error(f"Ошибка RCON: {e}")
+        return []
+
+async def resolve_status_server(server=None) -> JavaServer:
+    """Асинхронно резолвит адрес сервера (с учётом SRV-записи); результат живёт в кэше CACHE_TTL['address'] секунд."""
+    server = server or current_server()
+    async def lookup():
+        with metrics.time("bot_status_seconds", stage="resolve"):
+            return await JavaServer.async_lookup(server.address, timeout=STATUS_TIMEOUT)
+    return await server.cache.get("address", lookup)
+
+async def fetch_server_status(server=None):
+    """Пингует сервер по игровому порту (Server List Ping) и возвращает его статус."""
+    server = server or current_server()
+    with server.status_breaker.guard():
+        target = await resolve_status_server(server)
+        with metrics.time("bot_status_seconds", stage="ping"):
+            return await asyncio.wait_for(target.async_status(tries=1), STATUS_TIMEOUT)
+
+async def collect_server_status(server=None) -> tuple:
+    """Параллельно получает статус (пинг) и список игроков (RCON).
+
+    Возвращает пару (статус, игроки); вместо части, которую получить не удалось, — исключение.
+    """
+    server = server or current_server()
+    return tuple(await asyncio.gather(server.cache.get("status", lambda: fetch_server_status(server)),
+                                      server.cache.get("players", lambda: fetch_online_players(server)),
+                                      return_exceptions=True))
+
+# =========================================================================
+# --- ПАКЕТНОЕ ВЫПОЛНЕНИЕ КОМАНД ---
+# Сотни команд конвейером по одному соединению вместо сотен отдельных запросов
+# =========================================================================
+
+# Массовые действия над списком ников: ключ -> (название, шаблон команды)
+BULK_ACTIONS = {
+    "whitelist_add": ("➕ Добавить в WL", "whitelist add {}"),
+    "whitelist_remove": ("➖ Удалить из WL", "whitelist remove {}"),
+    "op": ("👑 Выдать OP", "op {}"),
+    "deop": ("🚫 Забрать OP", "deop {}"),
+    "kick": ("🚷 Кикнуть", "kick {}"),
+    "ban": ("🚫 Забанить", "ban {}"),
+    "pardon": ("🔓 Разбанить", "pardon {}"),
+}
+
+def parse_script(text: str) -> list:
+    """Разбирает многострочный скрипт: одна команда на строку, пустые строки и # комментарии пропускаются."""
+    return [line.strip().lstrip("/") for line in text.splitlines() if line.strip() and not line.strip().startswith("#")]
+
+def parse_nicknames(text: str) -> list:
+    """Разбирает список ников, разделённых пробелами, запятыми или переводами строк (без повторов)."""
+    return list(dict.fromkeys(n for n in re.split(r"[\s,;]+", text) if n))
+
+async def execute_rcon_bulk(commands: list, concurrency: int = RCON_BULK_CONCURRENCY, server=None) -> list:
+    """Выполняет команды конвейером по одному RCON-соединению, не более concurrency одновременно.
+
+    Возвращает список (команда, успех, ответ) в исходном порядке.
+    """
+    server = server or current_server()
+    semaphore, connection_lock = asyncio.Semaphore(concurrency), asyncio.Lock()
+    connection = None
+
+    async def shared_connection() -> RconConnection:
+        # Подключается одна задача, остальные ждут её — иначе первая волна разобрала бы все слоты пула
+        nonlocal connection
+        async with connection_lock:
+            if connection is None or not connection.is_alive: connection = await server.pool.acquire()
+            return connection
+
+    async def run(command: str) -> tuple:
+        async with semaphore:
+            try:
+                async with server.pool.operation(command) as result:
+                    # Все команды идут по одному соединению; если оно упало — берём новое из пула
+                    current = await shared_connection()
+                    try:
+                        resp = await current.command(command)
+                    except RconTimeoutError:
+                        await server.pool.discard(current)
+                        raise
+                    result["bytes"] = len(resp.encode("utf-8"))
+                    resp = strip_colors(resp)
+            except Exception as e:
+                return command, False, f"Ошибка RCON: {e}"
+            return command, not is_failure(resp), resp
+
+    try:
+        return await asyncio.gather(*(run(c) for c in commands))
+    finally:
+        for verb_command in {c.split(" ", 1)[0]: c for c in commands}.values(): invalidate_state_for(verb_command, server)
+
+async def rcon_report(results, header: str):
+    """Ждёт results — список (подпись, успех, ответ) — и отдаёт сводный отчёт построчно (поток фрагментов, как у stream_rcon).
+
+    Первая строка — header, число строк отчёта, время и итог; дальше строка на каждую команду.
+    """
+    started = time.perf_counter()
+    results = await results
+    failed = sum(1 for _, ok, _ in results if not ok)
+    yield f"{header}{len(results)} за {time.perf_counter() - started:.2f} с: ✅ {len(results) - failed}, ❌ {failed}\n\n"
+    for label, ok, resp in results:
+        # Для компактности — только первая строка ответа
+        first_line = resp.strip().split("\n", 1)[0][:80]
+        yield f"{'✅' if ok else '❌'} {label}" + (f" — {first_line}" if first_line else "") + "\n"
+
+async def bulk_report(commands: list):
+    """Выполняет пакет и отдаёт компактный отчёт построчно (см. rcon_report)."""
+    if len(commands) > BULK_MAX_COMMANDS:
+        yield f"❌ Слишком много команд в пакете: {len(commands)} (максимум {BULK_MAX_COMMANDS})."
+        return
+    async for line in rcon_report(execute_rcon_bulk(commands), "Выполнено команд: "): yield line
+
+# =========================================================================
+# --- ФОНОВЫЙ МОНИТОРИНГ СЕРВЕРА ---
+# Опрашивает сервер через job queue и присылает админам уведомления о событиях
+# =========================================================================
+
+class ServerSnapshot:
+    """Состояние сервера на момент опроса."""
+
+    def __init__(self, online: bool, status=None, players: list = None):
+        # online — ответил пинг или RCON; status — None, если пинг не прошёл
+        self.online, self.status = online, status
+        # None — список игроков получить не удалось (RCON недоступен), а не «никого нет»
+        self.players = frozenset(players) if players is not None else None
+        self.taken_at = time.monotonic()
+
+async def notify_admins(bot, text: str):
+    """Отправляет уведомление (MarkdownV2, без звука) в MONITOR_NOTIFY_CHAT_IDS или всем админам."""
+    for chat_id in dict.fromkeys(MONITOR_NOTIFY_CHAT_IDS or ALLOWED_USER_IDS):
+        try:
+            await bot.send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN_V2, disable_notification=True)
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление в чат {chat_id}: {e}")
+
+class ServerMonitor:
+    """Периодический опрос статуса и игроков с адаптивным интервалом.
+
+    Результаты каждого опроса кладутся в кэш сервера на время до следующего опроса,
+    поэтому меню берут данные из снимка, не обращаясь к серверу.
+    """
+
+    def __init__(self, server, min_interval: float = MONITOR_MIN_INTERVAL, max_interval: float = MONITOR_MAX_INTERVAL):
+        self.server = server
+        self.job_name = f"server_monitor:{server.name}"
+        self.min_interval, self.max_interval = min_interval, max_interval
+        self.interval = min_interval
+        self.snapshot = None
+
+    def start(self, application: Application):
+        if application.job_queue is None:
+            logger.warning('Мониторинг не запущен: установите pip install "python-telegram-bot[job-queue]"')
+            return
+        application.job_queue.run_once(self.poll, 0, name=self.job_name)
+        logger.info(f"Фоновый мониторинг сервера {self.server.name} запущен")
+
+    def fresh_snapshot(self):
+        """Последний снимок, если он не старше текущего интервала опроса."""
+        if self.snapshot and time.monotonic() - self.snapshot.taken_at <= self.interval + self.min_interval:
+            return self.snapshot
+        return None
+
+    async def poll(self, context: ContextTypes.DEFAULT_TYPE):
+        previous, snapshot = self.snapshot, await self._collect()
+        self.snapshot = snapshot
+        self.interval = self._next_interval(previous, snapshot)
+        # Снимок живёт в кэше до следующего опроса (с запасом на сам опрос)
+        ttl = self.interval + self.min_interval
+        if snapshot.status is not None: self.server.cache.put("status", snapshot.status, ttl)
+        if snapshot.players is not None: self.server.cache.put("players", sorted(snapshot.players), ttl)
+        events = self._diff(previous, snapshot)
+        if events: await self._notify(context, events)
+        context.job_queue.run_once(self.poll, self.interval, name=self.job_name)
+
+    async def _collect(self) -> ServerSnapshot:
+        status, players = await asyncio.gather(fetch_server_status(self.server), fetch_online_players(self.server),
+                                               return_exceptions=True)
+        status = None if isinstance(status, Exception) else status
+        players = None if isinstance(players, Exception) else players
+        # Сервер доступен, если ответила хотя бы одна проверка: пинг может быть закрыт (enable-status=false), а RCON работать
+        return ServerSnapshot(status is not None or players is not None, status, players)
+
+    def _next_interval(self, previous, snapshot) -> float:
+        changed = (previous is not None and previous.online and snapshot.online and None not in (previous.players, snapshot.players)
+                   and previous.players != snapshot.players)
+        if changed: return self.min_interval
+        # Сервер выключен — отступаем быстрее, чем когда он просто пустой
+        factor = 2 if not snapshot.online else 1.5
+        return min(self.max_interval, self.interval * factor)
+
+    def _diff(self, previous, snapshot) -> list:
+        if previous is None: return []
+        if previous.online and not snapshot.online: return ["🔴 *Сервер перестал отвечать*"]
+        events = ["🟢 *Сервер снова онлайн*"] if snapshot.online and not previous.online else []
+        if previous.players is not None and snapshot.players is not None:
+            events += [f"➡️ ``{escape_markdown(p)}`` зашёл на сервер" for p in sorted(snapshot.players - previous.players)]
+            events += [f"⬅️ ``{escape_markdown(p)}`` вышел с сервера" for p in sorted(previous.players - snapshot.players)]
+        return events
+
+    async def _notify(self, context: ContextTypes.DEFAULT_TYPE, events: list):
+        text = "\n".join(events)
+        # В сети из нескольких серверов уведомление подписано именем сервера
+        if len(servers) > 1: text = f"🖥 *{escape_markdown(self.server.name)}*\n{text}"
+        await notify_admins(context.bot, text)
+
+# =========================================================================
+# --- ЖИВАЯ КОНСОЛЬ (ЛОГ СЕРВЕРА) ---
+# =========================================================================
+
+# Сколько байт с конца лога прочитать при открытии, чтобы консоль сразу показала последние строки
+LOG_BACKLOG_BYTES = 16 * 1024
+# Больше за один опрос не читаем: если лог вырос на мегабайты, догоняем его за несколько опросов
+LOG_READ_LIMIT = 1024 * 1024
+LOG_LINE_MAX_LENGTH = 300
+# Цветовые ANSI-коды, которые пишут в лог некоторые плагины
+ANSI_ESCAPE_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+class LogTailer:
+    """Инкрементально читает растущий лог-файл, запоминая смещение между вызовами.
+
+    Ротацию (сервер архивирует latest.log и начинает новый файл) замечает по смене inode
+    или по уменьшению размера и читает новый файл с начала. Недописанная последняя строка
+    ждёт своего окончания до следующего чтения.
+    """
+
+    def __init__(self, path: str, backlog: int = 0):
+        self.path, self.backlog = path, backlog
+        self._inode = self._offset = None
+        self._partial = b""
+        self._skip_partial = False  # начали с середины строки: её хвост до \n отбрасывается
+
+    def read(self) -> list:
+        """Новые полные строки с прошлого вызова. Блокирующий вызов — из event loop запускать через to_thread."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if self._offset is None:
+            self._inode, self._offset = stat.st_ino, max(0, stat.st_size - self.backlog)
+            if self._offset > 0:
+                # Первая строка неполная, только если смещение попало не на начало строки
+                with open(self.path, "rb") as f:
+                    f.seek(self._offset - 1)
+                    self._skip_partial = f.read(1) != b"\n"
+        elif stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._inode, self._offset, self._partial, self._skip_partial = stat.st_ino, 0, b"", False
+        if stat.st_size == self._offset: return []
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(LOG_READ_LIMIT)
+        self._offset += len(data)
+        if self._skip_partial:
+            newline = data.find(b"\n")
+            if newline < 0: return []
+            data, self._skip_partial = data[newline + 1:], False
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        return [line.decode("utf-8", errors="replace").rstrip("\r") for line in lines]
+
+class ConsoleSession:
+    """Сообщение консоли одного чата: ответ на последнюю команду и хвост лога сервера.
+
+    Правки объединяются: сколько бы строк лога ни пришло, сообщение редактируется не чаще
+    раза в CONSOLE_EDIT_INTERVAL секунд, последним состоянием и только если текст изменился.
+    """
+
+    WAITING = "Ожидание команды\\.\\.\\."
+    TEXT_LIMIT = 4000  # Telegram ограничивает сообщение 4096 символами
+
+    def __init__(self, bot, chat_id: int, message_id: int, lines=()):
+        self.bot, self.chat_id, self.message_id = bot, chat_id, message_id
+        self.header = self.WAITING
+        self.lines = collections.deque(lines, maxlen=CONSOLE_LOG_LINES)
+        self.edits = 0
+        self._rendered = None
+        self._next_edit = 0.0
+        self._dirty = False
+        self._task = None
+
+    def append(self, lines: list):
+        self.lines.extend(lines)
+        self.refresh()
+
+    def show(self, header: str):
+        """Заменяет верхнюю часть сообщения (ответ на команду, MarkdownV2)."""
+        self.header = header
+        self.refresh()
+
+    def refresh(self):
+        """Просит перерисовать сообщение; запросы, пришедшие до правки, объединяются в одну."""
+        self._dirty = True
+        if self._task is None or self._task.done(): self._task = asyncio.create_task(self._flush())
+
+    def close(self):
+        if self._task: self._task.cancel()
+
+    def render(self) -> str:
+        text = f"🕹️ *Режим консоли*\n\n{self.header}"
+        budget, shown = self.TEXT_LIMIT - len(text) - 40, []
+        # Свежие строки важнее: берём с конца, пока помещаются
+        for line in reversed(self.lines):
+            line = line.translate(CODE_ESCAPE_TABLE)
+            if len(line) + 1 > budget: break
+            budget -= len(line) + 1
+            shown.append(line)
+        if shown: text += "\n\n_Лог сервера:_\n```\n" + "\n".join(reversed(shown)) + "\n```"
+        return text
+
+    async def _flush(self):
+        while self._dirty:
+            if (delay := self._next_edit - time.monotonic()) > 0: await asyncio.sleep(delay)
+            self._dirty = False
+            text = self.render()
+            if text == self._rendered: continue
+            self._next_edit = time.monotonic() + CONSOLE_EDIT_INTERVAL
+            try:
+                await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text,
+                                                 reply_markup=CONSOLE_MARKUP, parse_mode=ParseMode.MARKDOWN_V2)
+                self._rendered = text
+                self.edits += 1
+            except RetryAfter as e:
+                # Telegram просит подождать — повторим последним состоянием, когда будет можно
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                self._next_edit, self._dirty = time.monotonic() + retry_after, True
+            except BadRequest as e:
+                if "Message is not modified" in str(e): self._rendered = text
+                else: logger.error(f"Ошибка обновления консоли: {e}")
+            except Exception as e:
+                logger.error(f"Ошибка обновления консоли: {e}")
+
+class ServerConsole:
+    """Открытые консоли всех чатов и общий на всех опрос лога сервера (только пока открыта хоть одна консоль)."""
+
+    def __init__(self, log_path: str = SERVER_LOG_PATH):
+        self.log_path = log_path
+        self.sessions = {}  # чат -> ConsoleSession
+        self.recent = collections.deque(maxlen=CONSOLE_LOG_LINES)
+        self._task = None
+
+    def open(self, bot, chat_id: int, message_id: int) -> ConsoleSession:
+        """Открывает (или переоткрывает) консоль чата в сообщении message_id."""
+        if previous := self.sessions.pop(chat_id, None): previous.close()
+        session = self.sessions[chat_id] = ConsoleSession(bot, chat_id, message_id, self.recent)
+        if self.log_path and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._tail())
+        return session
+
+    def close(self, chat_id: int):
+        if session := self.sessions.pop(chat_id, None): session.close()
+        if not self.sessions and self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _tail(self):
+        tailer = LogTailer(self.log_path, backlog=LOG_BACKLOG_BYTES)
+        while True:
+            try:
+                lines = await asyncio.to_thread(tailer.read)
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать лог сервера {self.log_path}: {e}")
+                lines = []
+            if lines:
+                lines = [ANSI_ESCAPE_RE.sub("", line)[:LOG_LINE_MAX_LENGTH] for line in lines]
+                self.recent.extend(lines)
+                metrics.inc("bot_console_log_lines_total", len(lines))
+                for session in self.sessions.values(): session.append(lines)
+            await asyncio.sleep(LOG_POLL_INTERVAL)
+
+# =========================================================================
+# --- РЕЕСТР СЕРВЕРОВ ---
+# У каждого сервера сети свои пул RCON, кэш, мониторинг и консоль
+# =========================================================================
+
+class MinecraftServer:
+    """Один сервер из SERVERS со всем, что боту нужно для работы с ним."""
+
+    def __init__(self, name: str, host: str, rcon_port: int = 25575, password: str = "", game_port: int = 25565,
+                 log: str = None):
+        self.name, self.host, self.game_port = name, host, game_port
+        self.pool = RconPool(host, rcon_port, password, name=name)
+        self.cache = StateCache(CACHE_TTL)
+        # Пинг идёт по игровому порту, а не по RCON, поэтому у него свой предохранитель
+        self.status_breaker = CircuitBreaker(f"Игровой порт {name}")
+        self.monitor = ServerMonitor(self)
+        self.console = ServerConsole(log)
+
+    @property
+    def address(self) -> str:
+        """Адрес для пинга по игровому порту."""
+        return f"{self.host}:{self.game_port}"
+
+servers = {}  # имя -> MinecraftServer, в порядке из конфигурации
+# Имя сервера, выбранного админом; restricted выставляет его для каждого обновления из user_data
+current_server_name = contextvars.ContextVar("current_server_name", default=None)
+
+def configure_servers(config: dict = None) -> dict:
+    """Заполняет реестр из SERVERS, а если он не задан — одним сервером из RCON_HOST, RCON_PORT и т.д."""
+    if not config:
+        config = {"main": {"host": RCON_HOST, "rcon_port": RCON_PORT, "password": RCON_PASSWORD,
+                           "game_port": GAME_PORT, "log": SERVER_LOG_PATH}}
+    servers.clear()
+    servers.update((name, MinecraftServer(name, **options)) for name, options in config.items())
+    return servers
+
+def current_server() -> MinecraftServer:
+    """Сервер, с которым работает текущий обработчик (по умолчанию — первый из реестра)."""
+    return servers.get(current_server_name.get()) or next(iter(servers.values()))
+
+configure_servers(SERVERS)
+
+async def execute_fleet(command: str, targets: list) -> list:
+    """Выполняет одну команду на нескольких серверах одновременно (у каждого свой пул и предохранитель).
+
+    Возвращает список (сервер, успех, ответ, время в секундах) в порядке targets.
+    """
+    async def run(server: MinecraftServer) -> tuple:
+        started = time.perf_counter()
+        try:
+            resp = strip_colors(await server.pool.command(command))
+            ok = not is_failure(resp)
+        except Exception as e:
+            resp, ok = f"Ошибка RCON: {e}", False
+        invalidate_state_for(command, server)
+        return server, ok, resp, time.perf_counter() - started
+    return await asyncio.gather(*(run(server) for server in targets))
+
+async def fleet_report(command: str, targets: list):
+    """Выполняет команду на серверах сети и отдаёт сводный отчёт построчно (см. rcon_report)."""
+    async def results() -> list:
+        return [(f"{server.name} ({elapsed * 1000:.0f} мс)", ok, resp)
+                for server, ok, resp, elapsed in await execute_fleet(command, targets)]
+    async for line in rcon_report(results(), f"> {command}\nСерверов: "): yield line
+
+async def fleet_status() -> list:
+    """Параллельно пингует все серверы сети: список (сервер, статус, игроки, время в секундах)."""
+    async def probe(server: MinecraftServer) -> tuple:
+        started = time.perf_counter()
+        status, players = await collect_server_status(server)
+        return server, status, players, time.perf_counter() - started
+    return await asyncio.gather(*(probe(server) for server in servers.values()))
+
+# =========================================================================
+# --- ПЛАНИРОВЩИК ЗАДАЧ ---
+# Рестарты с отсчётом, объявления и любые команды по расписанию (интервал или cron)
+# =========================================================================
+
+INTERVAL_RE = re.compile(r"^(\d+)\s*([smhd])$")
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+class IntervalSchedule:
+    """Расписание «каждые N секунд/минут/часов/дней»: 45s, 30m, 2h, 1d."""
+
+    def __init__(self, expression: str):
+        match = INTERVAL_RE.match(expression.strip().lower())
+        if not match or not int(match[1]): raise ValueError("интервал записывается как 45s, 30m, 2h или 1d")
+        self.expression, self.seconds = expression.strip().lower(), int(match[1]) * INTERVAL_UNITS[match[2]]
+
+    def next_after(self, ts: float) -> float:
+        return ts + self.seconds
+
+    def describe(self) -> str:
+        return f"каждые {self.expression}"
+
+class CronSchedule:
+    """Расписание cron из 5 полей «минуты часы день месяц день_недели» по местному времени.
+
+    Поддерживаются *, */n, a-b, a-b/n и списки через запятую; воскресенье — 0 или 7.
+    Если заданы и день месяца, и день недели, подходит любой из них (как в cron).
+    """
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5: raise ValueError("ожидается интервал (45s, 30m, 2h, 1d) или cron из 5 полей: минуты часы день месяц день_недели")
+        self.expression = " ".join(parts)
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(part, low, high) for part, (low, high) in zip(parts, self.FIELDS))
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.any_day = parts[2] == "*" or parts[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> frozenset:
+        values = set()
+        try:
+            for item in field.split(","):
+                body, _, step = item.partition("/")
+                if body == "*": start, end = low, high
+                elif "-" in body: start, end = map(int, body.split("-", 1))
+                else: start = end = int(body)
+                if step and body != "*" and "-" not in body: end = high  # 5/15 — с 5-й каждую 15-ю
+                if not low <= start <= end <= high or (step and int(step) < 1): raise ValueError
+                values.update(range(start, end + 1, int(step) if step else 1))
+        except ValueError:
+            raise ValueError(f"неверное поле cron «{field}» (допустимо {low}-{high})") from None
+        return frozenset(values)
+
+    def _day_matches(self, moment: datetime) -> bool:
+        in_month, in_week = moment.day in self.days, (moment.weekday() + 1) % 7 in self.weekdays
+        return in_month and in_week if self.any_day else in_month or in_week
+
+    def next_after(self, ts: float) -> float:
+        """Ближайший подходящий момент строго после ts; неподходящие месяцы, дни и часы пропускаются целиком."""
+        moment = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 8)  # 29 февраля в понедельник бывает раз в 28 лет, но дальше не ищем
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"по расписанию «{self.expression}» нет ни одного запуска")
+
+    def describe(self) -> str:
+        return f"cron {self.expression}"
+
+def parse_schedule(expression: str):
+    """Интервал (30m) или cron (0 4 * * *); при ошибке — ValueError с понятным текстом."""
+    schedule = IntervalSchedule(expression) if INTERVAL_RE.match(expression.strip().lower()) else CronSchedule(expression)
+    schedule.next_after(time.time())  # невыполнимое расписание (например, 31 февраля) отсекается сразу
+    return schedule
+
+class TimerQueue:
+    """Очередь таймеров на двоичной куче: постановка и снятие ближайшего — O(log n), а не перебор всех задач.
+
+    Отменённый или переставленный таймер не ищется в куче: запись помечается мёртвой и выбрасывается,
+    когда окажется на вершине. Если мёртвых больше половины, куча пересобирается.
+    """
+
+    def __init__(self):
+        self._heap = []     # [момент, порядковый номер, ключ, действует ли]
+        self._entries = {}  # ключ -> его действующая запись в куче
+        self._order = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def push(self, when: float, key):
+        """Ставит таймер key на момент when (прежний таймер этого ключа отменяется)."""
+        self.cancel(key)
+        entry = self._entries[key] = [when, next(self._order), key, True]
+        heapq.heappush(self._heap, entry)
+
+    def cancel(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None: return
+        entry[3] = False
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [entry for entry in self._heap if entry[3]]
+            heapq.heapify(self._heap)
+
+    def next_time(self):
+        """Момент ближайшего таймера или None, если таймеров нет."""
+        while self._heap and not self._heap[0][3]: heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list:
+        """Снимает таймеры, срок которых наступил: список (момент, ключ) по порядку срабатывания."""
+        due = []
+        while (when := self.next_time()) is not None and when <= now:
+            key = heapq.heappop(self._heap)[2]
+            del self._entries[key]
+            due.append((when, key))
+        return due
+
+class ScheduledJob:
+    """Задача планировщика: action "restart" — отсчёт в чате игры, save-all и stop; "commands" — команды по порядку."""
+
+    def __init__(self, job_id: int, title: str, server: str, action: str, schedule: str, commands: list = (),
+                 enabled: bool = True, next_run: float = None, last_run: float = None, last_result: str = None):
+        self.id, self.title, self.server, self.action, self.schedule = job_id, title, server, action, schedule
+        self.commands, self.enabled = list(commands), enabled
+        self.next_run, self.last_run, self.last_result = next_run, last_run, last_result
+        self.trigger = parse_schedule(schedule)
+        self.defers = 0  # сколько раз подряд запуск откладывался
+
+    @property
+    def lead(self) -> float:
+        """За сколько секунд до next_run начинать: рестарт случается в назначенное время, а отсчёт идёт до него."""
+        return max(RESTART_COUNTDOWN, default=0) if self.action == "restart" else 0
+
+    def data(self) -> dict:
+        return {"job_id": self.id, "title": self.title, "server": self.server, "action": self.action,
+                "schedule": self.schedule, "commands": self.commands, "enabled": self.enabled,
+                "next_run": self.next_run, "last_run": self.last_run, "last_result": self.last_result}
+
+def countdown_text(seconds: int) -> str:
+    return RESTART_MESSAGE.format(f"{seconds // 60} мин" if seconds >= 60 and not seconds % 60 else f"{seconds} с")
+
+async def run_restart(job: ScheduledJob, server: MinecraftServer, at: float) -> str:
+    """Предупреждает игроков по RESTART_COUNTDOWN к моменту at, затем save-all flush и stop."""
     try:
-        players_str = resp.split(":", 1)[1]
-        return [p.strip() for p in players_str.split(",")]
-    except IndexError: return []
+        for seconds in sorted(RESTART_COUNTDOWN, reverse=True):
+            delay = at - seconds - time.time()
+            if delay < -1: continue  # отсчёт начался позже (отложен или запущен вручную) — этот порог уже прошёл
+            await asyncio.sleep(max(0.0, delay))
+            await execute_rcon(f"say {countdown_text(seconds)}", server)
+        await asyncio.sleep(max(0.0, at - time.time()))
+    except asyncio.CancelledError:
+        await execute_rcon(f"say {RESTART_CANCELLED_MESSAGE}", server)
+        raise
+    # Без сохранённого мира не останавливаем: лучше пропустить рестарт, чем потерять данные
+    if is_failure(resp := await execute_rcon("save-all flush", server, RESTART_SAVE_TIMEOUT)):
+        await execute_rcon(f"say {RESTART_CANCELLED_MESSAGE}", server)
+        return f"save-all не выполнен, рестарт отменён: {resp[:80]}"
+    await execute_rcon("stop", server)
+    return "мир сохранён, сервер остановлен"
+
+async def run_commands(job: ScheduledJob, server: MinecraftServer, at: float) -> str:
+    responses = [await execute_rcon(command, server) for command in job.commands]
+    failed = sum(map(is_failure, responses))
+    return f"выполнено {len(responses) - failed} из {len(responses)}"
+
+JOB_ACTIONS = {"restart": run_restart, "commands": run_commands}
+
+class Scheduler:
+    """Задачи по расписанию для всех серверов сети.
+
+    Одна фоновая задача спит до ближайшего срока из TimerQueue, так что тысячи задач не опрашиваются
+    каждую секунду. Перед запуском проверяется последний пинг сервера: если сервер недоступен или перегружен,
+    запуск откладывается на SCHEDULER_DEFER_DELAY секунд (до SCHEDULER_MAX_DEFERS раз), затем пропускается.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self.jobs = {}  # id -> ScheduledJob
+        # Последний выданный id: хранится в базе и только растёт, чтобы id удалённой задачи не достался новой
+        # (иначе старая кнопка в чате или запись в журнале указала бы на чужую задачу)
+        self.last_id = 0
+        self.timers = TimerQueue()
+        self.bot = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = {}  # id задачи -> выполняющаяся asyncio-задача
+        self._stopping = False
+
+    async def start(self, bot):
+        """Загружает задачи из хранилища и запускает цикл планировщика."""
+        self.bot, self._stopping = bot, False
+        now = time.time()
+        for value, in await self.store.query("SELECT value FROM counters WHERE name = 'jobs'"):
+            self.last_id = max(self.last_id, value)
+        for data, in await self.store.query("SELECT data FROM jobs"):
+            try:
+                job = ScheduledJob(**json.loads(data))
+            except (ValueError, TypeError) as e:
+                logger.error(f"Задача планировщика не загружена: {e}")
+                continue
+            self.jobs[job.id] = job
+            self.last_id = max(self.last_id, job.id)
+            # Запуск, пропущенный пока бот был выключен, выполняем, только если опоздали ненамного
+            if job.next_run is None or job.next_run - job.lead < now - SCHEDULER_MISFIRE_GRACE:
+                job.next_run = job.trigger.next_after(now)
+            self._schedule(job)
+        self._task = asyncio.create_task(self._loop())
+        if self.jobs: logger.info(f"Планировщик запущен, задач: {len(self.jobs)}")
+
+    async def stop(self):
+        """Останавливает цикл и выполняющиеся задачи (идущий отсчёт рестарта отменяется с сообщением игрокам)."""
+        self._stopping = True
+        tasks = [task for task in (self._task, *self._running.values()) if task]
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def add(self, title: str, server: str, action: str, schedule: str, commands: list = ()) -> ScheduledJob:
+        self.last_id += 1
+        self.store.write("INSERT INTO counters (name, value) VALUES ('jobs', ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                         (self.last_id,))
+        job = ScheduledJob(self.last_id, title, server, action, schedule, commands)
+        job.next_run = job.trigger.next_after(time.time())
+        self.jobs[job.id] = job
+        self._save(job)
+        self._schedule(job)
+        return job
+
+    def remove(self, job_id: int):
+        if self.jobs.pop(job_id, None) is None: return
+        self.timers.cancel(job_id)
+        if task := self._running.get(job_id): task.cancel()
+        self.store.write("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def set_enabled(self, job_id: int, enabled: bool):
+        job = self.jobs[job_id]
+        job.enabled = enabled
+        if enabled:
+            job.next_run = job.trigger.next_after(time.time())
+            self._schedule(job)
+        else:
+            self.timers.cancel(job_id)
+            if task := self._running.get(job_id): task.cancel()
+        self._save(job)
+
+    def run_now(self, job_id: int) -> bool:
+        """Запускает задачу вне расписания; False, если она уже выполняется."""
+        return self._launch(self.jobs[job_id], manual=True)
+
+    def running(self, job_id: int) -> bool:
+        return job_id in self._running
+
+    def _schedule(self, job: ScheduledJob):
+        if not job.enabled or job.next_run is None: return
+        self.timers.push(job.next_run - job.lead, job.id)
+        self._wakeup.set()
+
+    def _save(self, job: ScheduledJob):
+        self.store.write("INSERT INTO jobs (id, data) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                         (job.id, json.dumps(job.data(), ensure_ascii=False)))
+
+    async def _loop(self):
+        while True:
+            self._wakeup.clear()
+            when = self.timers.next_time()
+            if when is None or when > time.time():
+                timeout = None if when is None else when - time.time()
+                with contextlib.suppress(asyncio.TimeoutError): await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+            now = time.time()
+            for when, job_id in self.timers.pop_due(now):
+                job = self.jobs.get(job_id)
+                if job is None: continue
+                metrics.observe("bot_scheduler_lateness_seconds", now - when)
+                if not self._launch(job):
+                    # Прошлый запуск ещё идёт (например, длинный отсчёт рестарта) — этот пропускаем
+                    logger.warning(f"Задача #{job.id} ещё выполняется, запуск пропущен")
+                    metrics.inc("bot_scheduler_runs_total", result="overlap")
+                    self._reschedule(job)
+
+    def _launch(self, job: ScheduledJob, manual: bool = False) -> bool:
+        if job.id in self._running: return False
+        task = self._running[job.id] = asyncio.create_task(self._run(job, manual))
+        task.add_done_callback(lambda _: self._running.pop(job.id, None))
+        return True
+
+    def _reschedule(self, job: ScheduledJob):
+        if job.id not in self.jobs or not job.enabled: return
+        now = time.time()
+        next_run = job.trigger.next_after(job.next_run or now)
+        # Если отстали больше чем на период (бот был занят или запуск откладывался), догонять не пытаемся
+        if next_run - job.lead <= now: next_run = job.trigger.next_after(now)
+        job.next_run = next_run
+        self._schedule(job)
+
+    async def check_server(self, server: MinecraftServer) -> str:
+        """Причина не трогать сервер сейчас (по последнему пингу) или пустая строка, если всё в порядке."""
+        if server.pool.breaker.state == "open": return "RCON недоступен"
+        snapshot = server.monitor.fresh_snapshot()
+        if snapshot and not snapshot.online: return "сервер офлайн"
+        try:
+            status = await server.cache.get("status", lambda: fetch_server_status(server))
+        except Exception as e:
+            return f"сервер не отвечает на пинг ({str(e) or type(e).__name__})"
+        if status.latency > SCHEDULER_OVERLOAD_PING * 1000: return f"сервер перегружен: пинг {status.latency:.0f} мс"
+        return ""
+
+    async def _run(self, job: ScheduledJob, manual: bool):
+        current_admin.set((None, "планировщик"))
+        server, result = servers.get(job.server), None
+        try:
+            reason = await self.check_server(server) if server else f"сервера {job.server} нет в настройках"
+            if reason and not manual and server and job.defers < SCHEDULER_MAX_DEFERS:
+                job.defers += 1
+                metrics.inc("bot_scheduler_runs_total", result="deferred")
+                logger.warning(f"Задача #{job.id} отложена на {SCHEDULER_DEFER_DELAY} с: {reason}")
+                self.timers.push(time.time() + SCHEDULER_DEFER_DELAY, job.id)
+                self._wakeup.set()
+                return
+            if reason:
+                result = f"пропущено: {reason}"
+                metrics.inc("bot_scheduler_runs_total", result="skipped")
+                logger.warning(f"Задача #{job.id} ({job.title}) пропущена: {reason}")
+                if self.bot:
+                    await notify_admins(self.bot, f"⏰ Задача *\\#{job.id}* {escape_markdown(job.title)} пропущена: "
+                                                  f"{escape_markdown(reason)}")
+                return
+            if job.action == "restart" and self.bot:
+                await notify_admins(self.bot, f"🔄 Начат отсчёт рестарта *{escape_markdown(job.server)}*")
+            # Рестарт всегда получает полный отсчёт: отложенный, ручной или опоздавший (после перезапуска бота,
+            # когда игроки уже видели «Рестарт отменён») не догоняет назначенное время
+            at = max(time.time() + job.lead, 0 if manual else job.next_run)
+            result = await JOB_ACTIONS[job.action](job, server, at)
+            metrics.inc("bot_scheduler_runs_total", result="ok")
+            logger.info(f"Задача #{job.id} ({job.title}) на {job.server}: {result}")
+        except asyncio.CancelledError:
+            result = "отменено"
+            raise
+        except Exception as e:
+            result = f"ошибка: {e}"
+            metrics.inc("bot_scheduler_runs_total", result="error")
+            logger.error(f"Задача #{job.id} ({job.title}) завершилась ошибкой: {e}")
+        finally:
+            # При остановке бота ничего не трогаем: судьбу пропущенного запуска решит start() по SCHEDULER_MISFIRE_GRACE
+            if result is not None and not self._stopping:
+                job.defers = 0
+                job.last_run, job.last_result = time.time(), result
+                # Таймер уже стоит, если цикл переставил задачу, пока этот запуск шёл (пропуск из-за наложения)
+                if not manual and job.id not in self.timers: self._reschedule(job)
+                if job.id in self.jobs: self._save(job)
+
+scheduler = Scheduler(state_store)
+
+def collect_scheduler_metrics():
+    yield "bot_scheduler_jobs", "gauge", {}, len(scheduler.jobs)
+    yield "bot_scheduler_timers", "gauge", {}, len(scheduler.timers)
+
+metrics.collectors.append(collect_scheduler_metrics)
 
 # =========================================================================
 # --- УПРАВЛЕНИЕ ИНТЕРФЕЙСОМ БОТА (UI) ---
 # =========================================================================
 
+# --- Статичные клавиатуры и тексты: собираются один раз при запуске, а не на каждое нажатие ---
+
+def back_button(callback_data: str, text: str = "« Назад") -> list:
+    return [InlineKeyboardButton(text, callback_data=callback_data)]
+
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Статус сервера", callback_data="menu_status")],
+    [InlineKeyboardButton("⚙️ Управление сервером", callback_data="menu_server")],
+    [InlineKeyboardButton("👥 Управление игроками", callback_data="menu_players")],
+    [InlineKeyboardButton("🌍 Управление миром", callback_data="menu_world")],
+    [InlineKeyboardButton("⏰ Планировщик", callback_data="sched:list")],
+    [InlineKeyboardButton("ℹ️ О боте", callback_data="menu_about")],
+])
+
+_main_menus = {}  # (выбранный сервер, все серверы) -> клавиатура главного меню сети
+
+def main_menu_markup() -> InlineKeyboardMarkup:
+    """Главное меню; в сети из нескольких серверов — с переключателем серверов и режимом «Вся сеть»."""
+    if len(servers) < 2: return MAIN_MENU_MARKUP
+    current = current_server().name
+    key = (current, tuple(servers))
+    markup = _main_menus.get(key)
+    if markup is None:
+        selector = [InlineKeyboardButton(f"• {name}" if name == current else name, callback_data=f"server:select:{name}") for name in servers]
+        markup = _main_menus[key] = InlineKeyboardMarkup(
+            [selector[i:i + 3] for i in range(0, len(selector), 3)] + [list(row) for row in MAIN_MENU_MARKUP.inline_keyboard]
+            + [[InlineKeyboardButton("🌐 Вся сеть", callback_data="fleet:menu")]])
+    return markup
+
+SERVER_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⚙️ Рестарт (через /stop)", callback_data="action:confirm:stop")],
+    [InlineKeyboardButton("🔌 Список плагинов", callback_data="action:show:plugins")],
+    [InlineKeyboardButton("🕹️ Консольный режим", callback_data="wizard:console:start")],
+    back_button("menu_main"),
+])
+
+PLAYERS_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Список игроков онлайн", callback_data="action:show:players_list")],
+    [InlineKeyboardButton("⚖️ Наказания (Бан/Кик)", callback_data="wizard:punishment_menu")],
+    [InlineKeyboardButton("📜 Белый список (Whitelist)", callback_data="wizard:whitelist_menu")],
+    [InlineKeyboardButton("🕹️ Сменить режим игры", callback_data="wizard:gamemode_select_player")],
+    [InlineKeyboardButton("👑 Управление правами (OP)", callback_data="wizard:op_menu")],
+    [InlineKeyboardButton("✉️ Личное сообщение", callback_data="wizard:msg_select_player")],
+    [InlineKeyboardButton("📦 Массовые действия", callback_data="wizard:bulk_menu")],
+    back_button("menu_main"),
+])
+
+WORLD_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏳ Управление временем", callback_data="wizard:time_menu")],
+    [InlineKeyboardButton("🌦️ Управление погодой", callback_data="wizard:weather_menu")],
+    back_button("menu_main"),
+])
+
+ABOUT_TEXT = (
+    "ℹ️ *О боте и возможностях*\n\n"
+    "Этот бот использует протокол RCON для отправки команд на сервер\\.\n\n"
+    "✅ *Что МОЖНО делать:*\n"
+    "\\- Выполнять любые игровые команды\n"
+    "\\- Управлять игроками и миром\n"
+    "\\- Перезапускать сервер командой `/stop`\n\n"
+    "❌ *Что НЕЛЬЗЯ делать через бота:*\n"
+    "\\- *Управлять файлами*: Загружать/удалять плагины, моды, карты\\.\n"
+    "\\- *Просматривать ресурсы*: Узнать использование RAM/CPU сервера\\.\n\n"
+    "_Всё это делается только через FTP/SFTP или панель вашего хостинга\\._"
+)
+ABOUT_MARKUP = InlineKeyboardMarkup([back_button("menu_main", "« Назад в панель управления")])
+
+CONSOLE_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("Выйти из режима консоли", callback_data="wizard:console:stop")]])
+
+# Подтверждения опасных действий: команда -> (текст, клавиатура)
+CONFIRM_MENUS = {
+    'stop': ("🚨 *РЕСТАРТ СЕРВЕРА*\n\nБудет выполнена команда `/stop`\\. Большинство хостингов *автоматически перезапустят* сервер после этого\\. Для *полного выключения* используйте панель хостинга\\. Вы уверены?",
+             InlineKeyboardMarkup([[InlineKeyboardButton("Да, рестарт", callback_data="action:exec:stop"), InlineKeyboardButton("Отмена", callback_data="menu_server")]])),
+}
+
+# Подменю мастеров: шаг -> (заголовок, клавиатура)
+WIZARD_MENUS = {
+    "op_menu": ("👑 *Управление правами OP*", InlineKeyboardMarkup([
+        [InlineKeyboardButton("👑 Выдать OP", callback_data="wizard:op_select_player")],
+        [InlineKeyboardButton("🚫 Забрать OP", callback_data="wizard:deop_select_player")],
+        back_button("menu_players")])),
+    "punishment_menu": ("⚖️ *Управление наказаниями*", InlineKeyboardMarkup([
+        [InlineKeyboardButton("🚷 Кикнуть игрока", callback_data="wizard:kick_select_player")],
+        [InlineKeyboardButton("🚫 Забанить игрока", callback_data="wizard:ban_select_player")],
+        [InlineKeyboardButton("🔓 Разбанить игрока", callback_data="wizard:unban_prompt")],
+        back_button("menu_players")])),
+    "whitelist_menu": ("📜 *Управление Белым списком*", InlineKeyboardMarkup([
+        [InlineKeyboardButton("➕ Добавить в WL", callback_data="wizard:whitelist_add_select_player")],
+        [InlineKeyboardButton("➖ Удалить из WL", callback_data="wizard:whitelist_remove_select_player")],
+        [InlineKeyboardButton("📋 Показать WL", callback_data="action:exec:whitelist list")],
+        [InlineKeyboardButton("▶️ Включить WL", callback_data="action:exec:whitelist on"), InlineKeyboardButton("⏹️ Выключить WL", callback_data="action:exec:whitelist off")],
+        back_button("menu_players")])),
+    "time_menu": ("⏳ *Управление временем*", InlineKeyboardMarkup([
+        [InlineKeyboardButton("Рассвет (0)", callback_data="action:exec:time set 0"), InlineKeyboardButton("Полдень (6000)", callback_data="action:exec:time set 6000")],
+        [InlineKeyboardButton("Закат (12000)", callback_data="action:exec:time set 12000"), InlineKeyboardButton("Ночь (18000)", callback_data="action:exec:time set 18000")],
+        [InlineKeyboardButton("Задать время в тиках", callback_data="wizard:time_prompt_ticks")],
+        back_button("menu_world")])),
+    "weather_menu": ("🌦️ *Управление погодой*", InlineKeyboardMarkup([
+        [InlineKeyboardButton("☀️ Ясно", callback_data="action:exec:weather clear")],
+        [InlineKeyboardButton("💧 Дождь", callback_data="action:exec:weather rain")],
+        [InlineKeyboardButton("⚡️ Гроза", callback_data="action:exec:weather thunder")],
+        back_button("menu_world")])),
+    "bulk_menu": ("📦 *Массовые действия*\n\nВыберите действие, затем отправьте список ников \\(через пробел, запятую или с новой строки\\) или `.txt` файл\\.", InlineKeyboardMarkup(
+        [[InlineKeyboardButton(title, callback_data=f"wizard:bulk_prompt:{key}")] for key, (title, _) in BULK_ACTIONS.items()] + [
+        [InlineKeyboardButton("🚷 Кикнуть всех онлайн", callback_data="wizard:bulk_online:kick"), InlineKeyboardButton("🚫 Снять OP со всех онлайн", callback_data="wizard:bulk_online:deop")],
+        back_button("menu_players")])),
+}
+
+# Команды на всю сеть: ключ -> (название, запрос на ввод, шаблон команды)
+FLEET_ACTIONS = {
+    "say": ("📢 Объявление", "📢 Введите текст объявления:", "say {}"),
+    "whitelist_add": ("➕ Добавить в WL", "➕ Введите ник для добавления в WL:", "whitelist add {}"),
+    "ban": ("🚫 Забанить", "🚫 Введите ник для бана (причину можно указать через пробел):", "ban {}"),
+    "pardon": ("🔓 Разбанить", "🔓 Введите ник для разбана:", "pardon {}"),
+    "command": ("⌨️ Своя команда", "⌨️ Введите команду (без /):", "{}"),
+}
+
+# Шаблоны задач планировщика: ключ -> (название, действие, запрос на ввод, команды из строк после расписания)
+JOB_TEMPLATES = {
+    "restart": ("🔄 Рестарт с отсчётом", "restart",
+                "🔄 Введите расписание рестарта: cron (0 4 * * * — каждый день в 4:00) или интервал (12h). "
+                "Игроки увидят отсчёт в чате, затем мир сохранится (save-all) и сервер остановится (stop).",
+                lambda lines: []),
+    "announce": ("📢 Объявление", "commands",
+                 "📢 Первой строкой — расписание (30m или 0 */2 * * *), следующими — текст объявления (строка — сообщение).",
+                 lambda lines: [f"say {line}" for line in lines]),
+    "reset": ("🌤 Ясная погода и день", "commands",
+              "🌤 Введите расписание (например, 20m): будут выполняться weather clear и time set day.",
+              lambda lines: ["weather clear", "time set day"]),
+    "commands": ("⌨️ Свои команды", "commands",
+                 "⌨️ Первой строкой — расписание (1h или 30 3 * * 1), следующими — команды по одной на строку (без /).",
+                 lambda lines: parse_script("\n".join(lines))),
+}
+SCHEDULER_PAGE_SIZE = 8
+
+# Мастера выбора игрока: шаг -> (название действия, шаг выполнения, шаг ручного ввода, куда вернуться)
+PLAYER_WIZARDS = {
+    "op_select_player": ("Выдать OP", "op_exec", "op_prompt", "wizard:op_menu"),
+    "deop_select_player": ("Забрать OP", "deop_exec", "deop_prompt", "wizard:op_menu"),
+    "msg_select_player": ("Отправить сообщение", "msg_prompt_message", None, "menu_players"),
+    "gamemode_select_player": ("Сменить режим игры", "gamemode_select_mode", None, "menu_players"),
+    "kick_select_player": ("Кикнуть игрока", "kick_exec", None, "wizard:punishment_menu"),
+    "ban_select_player": ("Забанить игрока", "ban_prompt_reason", "ban_prompt", "wizard:punishment_menu"),
+    "whitelist_add_select_player": ("Добавить в WL", "whitelist_add_exec", "whitelist_add_prompt", "wizard:whitelist_menu"),
+    "whitelist_remove_select_player": ("Удалить из WL", "whitelist_remove_exec", "whitelist_remove_prompt", "wizard:whitelist_menu")
+}
+
+# Шаги, которые получают выбранного игрока первым аргументом
+PLAYER_TARGET_STEPS = {exec_action for _, exec_action, _, _ in PLAYER_WIZARDS.values()}
+
+# Команды для шагов, выполняющихся сразу после выбора игрока
+PLAYER_EXEC_COMMANDS = {"op_exec": "op", "deop_exec": "deop", "kick_exec": "kick",
+                        "whitelist_add_exec": "whitelist add", "whitelist_remove_exec": "whitelist remove"}
+
+GAMEMODE_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(f"{v.capitalize()} ({k})", callback_data=f"wizard:gamemode_exec:{v}")]
+     for k, v in {'c': 'creative', 's': 'survival', 'a': 'adventure', 'sp': 'spectator'}.items()]
+    + [back_button("wizard:gamemode_select_player")])
+
+# Запросы на ввод текста: шаг -> (next_action, уже экранированный текст запроса)
+TEXT_PROMPTS = {step: (action, escape_markdown(text)) for step, (action, text) in {
+    'op_prompt': ('op', "👑 Введите ник для выдачи OP:"), 'deop_prompt': ('deop', "🚫 Введите ник для снятия OP:"),
+    'time_prompt_ticks': ('time_ticks', "⏳ Введите время в тиках:"), 'ban_prompt': ('ban', "🚫 Введите ник для бана:"),
+    'unban_prompt': ('unban', "🔓 Введите ник для разбана:"), 'whitelist_add_prompt': ('whitelist_add', "➕ Введите ник для добавления в WL:"),
+    'whitelist_remove_prompt': ('whitelist_remove', "➖ Введите ник для удаления из WL:")}.items()}
+
+# Команды для ответов на эти запросы: next_action -> шаблон команды
+PROMPT_COMMANDS = {'op': "op {}", 'deop': "deop {}", 'time_ticks': "time set {}", 'ban': "ban {}", 'unban': "pardon {}",
+                   'whitelist_add': "whitelist add {}", 'whitelist_remove': "whitelist remove {}"}
+# Запросы ника: к ним показываются подсказки из истории игроков
+NICKNAME_PROMPTS = PROMPT_COMMANDS.keys() - {'time_ticks'}
+HISTORY_SUGGESTIONS = 8
+
+# --- Выбор игрока: постраничный, с поиском по началу ника ---
+
+# Сколько игроков показывать на одной странице выбора
+PICKER_PAGE_SIZE = 10
+PICKER_CACHE_SIZE = 256
+
+class PlayerIndex:
+    """Отсортированный индекс ников: поиск по префиксу и страница за O(log n + размер страницы)."""
+
+    def __init__(self, players: list):
+        self.names = sorted(players, key=str.casefold)
+        self._keys = [name.casefold() for name in self.names]
+
+    def page(self, page: int, size: int, prefix: str = "") -> tuple:
+        """Возвращает (ники на странице, номер страницы, всего страниц, всего подходящих ников)."""
+        lo, hi = 0, len(self.names)
+        if prefix:
+            key = prefix.casefold()
+            lo = bisect.bisect_left(self._keys, key)
+            # Все строки с этим префиксом меньше, чем префикс + максимальный символ Unicode
+            hi = bisect.bisect_left(self._keys, key + "\U0010ffff", lo)
+        pages = max(1, -(-(hi - lo) // size))
+        page = min(max(page, 0), pages - 1)
+        start = lo + page * size
+        return self.names[start:min(start + size, hi)], page, pages, hi - lo
+
+class PlayerTokens:
+    """Короткие токены вместо ников в callback_data (у Telegram лимит 64 байта).
+
+    Токен выдаётся нику один раз и не переиспользуется; помнятся последние MAX_TOKENS ников.
+    В токен входит случайная эпоха процесса: после перезапуска бота старые кнопки не указывают
+    на другого игрока, а получают ответ «список игроков устарел».
+    """
+
+    DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+    MAX_TOKENS = 5000
+
+    def __init__(self):
+        self.epoch = self._encode(secrets.randbelow(len(self.DIGITS) ** 4))
+        self._by_name, self._by_token = collections.OrderedDict(), {}
+        self._numbers = itertools.count()
+
+    def token(self, name: str) -> str:
+        token = self._by_name.get(name)
+        if token is not None:
+            self._by_name.move_to_end(name)
+            return token
+        token = f"{self.epoch}.{self._encode(next(self._numbers))}"
+        self._by_name[name], self._by_token[token] = token, name
+        if len(self._by_name) > self.MAX_TOKENS:
+            _, oldest = self._by_name.popitem(last=False)
+            del self._by_token[oldest]
+        return token
+
+    def resolve(self, token: str):
+        return self._by_token.get(token)
+
+    def _encode(self, number: int) -> str:
+        digits = ""
+        while True:
+            number, digit = divmod(number, len(self.DIGITS))
+            digits = self.DIGITS[digit] + digits
+            if not number: return digits
+
+player_tokens = PlayerTokens()
+_player_index = (None, None)  # (версия списка игроков, индекс)
+_pickers = collections.OrderedDict()  # (шаг, версия, страница, префикс) -> (текст, клавиатура)
+
+def resolve_player(arg: str):
+    """Ник из аргумента callback: '#токен' ищется в PlayerTokens, остальное считается ником как есть."""
+    return player_tokens.resolve(arg[1:]) if arg.startswith("#") else arg
+
+def suggestions_markup(names: list, typed: str = None) -> InlineKeyboardMarkup:
+    """Кнопки ников из истории для запроса ника; typed — кнопка, чтобы использовать введённый текст как есть."""
+    buttons = [InlineKeyboardButton(name, callback_data=f"wizard:prompt_pick:#{player_tokens.token(name)}") for name in names]
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    if typed: keyboard.append([InlineKeyboardButton(f"Использовать «{typed}»", callback_data=f"wizard:prompt_pick:#{player_tokens.token(typed)}")])
+    keyboard.append([InlineKeyboardButton("Отмена", callback_data="wizard:prompt_cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def complete_nickname(text: str) -> tuple:
+    """Дополняет введённый ник по истории: (ник, []) — выполнять, (None, варианты) — спросить, какой из них."""
+    matches = await state_store.find_players(text, HISTORY_SUGGESTIONS + 1)
+    # Точное совпадение (без учёта регистра) идёт первым среди ников с этим началом
+    if matches and matches[0].casefold() == text.casefold(): return matches[0], []
+    return (None, matches[:HISTORY_SUGGESTIONS]) if matches else (text, [])
+
+def get_player_index(players: list, version: int) -> PlayerIndex:
+    """Индекс строится один раз на каждую версию списка игроков."""
+    global _player_index
+    if _player_index[0] != version: _player_index = (version, PlayerIndex(players))
+    return _player_index[1]
+
+def render_player_picker(step: str, players: list, version: int, page: int = 0, prefix: str = "") -> tuple:
+    """Текст и клавиатура страницы выбора игрока; мемоизируются, пока не изменится состав игроков."""
+    key = (step, version, page, prefix)
+    rendered = _pickers.get(key)
+    if rendered is not None:
+        _pickers.move_to_end(key)
+        return rendered
+    title, exec_action, manual_action, back_menu = PLAYER_WIZARDS[step]
+    names, page, pages, total = get_player_index(players, version).page(page, PICKER_PAGE_SIZE, prefix)
+    keyboard = [[InlineKeyboardButton(name, callback_data=f"wizard:{exec_action}:#{player_tokens.token(name)}")] for name in names]
+    navigation = []
+    if page > 0: navigation.append(InlineKeyboardButton("◀️", callback_data=f"wizard:{step}:{page - 1}"))
+    if page < pages - 1: navigation.append(InlineKeyboardButton("▶️", callback_data=f"wizard:{step}:{page + 1}"))
+    if navigation: keyboard.append(navigation)
+    search_row = [InlineKeyboardButton("🔍 Поиск по нику", callback_data=f"wizard:picker_search:{step}")]
+    if prefix: search_row.append(InlineKeyboardButton("✖️ Сбросить поиск", callback_data=f"wizard:picker_clear:{step}"))
+    keyboard.append(search_row)
+    if manual_action: keyboard.append([InlineKeyboardButton("Ввести ник вручную", callback_data=f"wizard:{manual_action}")])
+    keyboard.append(back_button(back_menu))
+    found = f" на «{escape_markdown(prefix)}»" if prefix else ""
+    if total:
+        text = f"Выберите игрока для действия '{escape_markdown(title)}'\n_Игроков{found}: {total}, стр\\. {page + 1}/{pages}_"
+    else:
+        text = f"Игроков с ником{found} не найдено\\."
+    rendered = _pickers[key] = (text, InlineKeyboardMarkup(keyboard))
+    if len(_pickers) > PICKER_CACHE_SIZE: _pickers.popitem(last=False)
+    return rendered
+
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, message_text: str = None):
     """Отображает главное меню, редактируя существующее сообщение или отправляя новое."""
     query = update.callback_query
-    keyboard = [
-        [InlineKeyboardButton("📊 Статус сервера", callback_data="menu_status")],
-        [InlineKeyboardButton("⚙️ Управление сервером", callback_data="menu_server")],
-        [InlineKeyboardButton("👥 Управление игроками", callback_data="menu_players")],
-        [InlineKeyboardButton("🌍 Управление миром", callback_data="menu_world")],
-        [InlineKeyboardButton("ℹ️ О боте", callback_data="menu_about")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = main_menu_markup()
     if message_text is None:
         message_text = f"👋 Привет, {escape_markdown(update.effective_user.first_name)}\\! Выберите действие:"
+        if len(servers) > 1: message_text += f"\n🖥 Сервер: *{escape_markdown(current_server().name)}*"
     
     # Редактируем сообщение, если пришел запрос с кнопки, или отправляем новое
     if query:
@@ -123,16 +2263,164 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, mes
     else:
         await update.message.reply_text(text=message_text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2)
 
+async def show_rcon_output(update: Update, context: ContextTypes.DEFAULT_TYPE, chunks, render):
+    """Показывает ответ сервера (поток фрагментов, см. stream_rcon) постранично.
+
+    render(escaped_page, index, is_last) возвращает текст страницы. Первая страница заменяет
+    текущее сообщение (или приходит новым, если это ответ на текст), остальные приходят
+    новыми сообщениями, а главное меню — под последней.
+    """
+    query = update.callback_query
+    async def deliver(page, index, is_last):
+        text = render(page, index, is_last)
+        if index == 0 and is_last:
+            await show_main_menu(update, context, text)
+        elif index == 0 and query:
+            await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN_V2)
+        else:
+            await context.bot.send_message(update.effective_chat.id, text, parse_mode=ParseMode.MARKDOWN_V2,
+                                           reply_markup=main_menu_markup() if is_last else None)
+    await for_each_page(chunks, deliver)
+
+def report_page(icon: str, title: str):
+    """Отрисовка страниц отчёта rcon_report для show_rcon_output: заголовок title (MarkdownV2) и отчёт блоком кода."""
+    def render(page: str, index: int, is_last: bool) -> str:
+        heading = title if index == 0 else f"{title} \\(стр\\. {index + 1}\\)"
+        return f"{icon} *{heading}*\n```\n{page}\n```"
+    return render
+
+render_bulk_page = report_page("📦", "Массовое действие")
+render_fleet_page = report_page("🌐", "Вся сеть")
+
+async def run_in_console(update: Update, context: ContextTypes.DEFAULT_TYPE, chunks, title: str):
+    """Выводит ответ сервера в сообщение консоли; продолжение длинного ответа — отдельными сообщениями."""
+    chat_id = update.effective_chat.id
+    message_id = context.user_data.get('console_message_id')
+    if not message_id: return
+    console = current_server().console
+    session = console.sessions.get(chat_id)
+    # Консоль могла остаться открытой с прошлого запуска бота
+    if session is None or session.message_id != message_id: session = console.open(context.bot, chat_id, message_id)
+    async def deliver(page, index, is_last):
+        if index > 0:
+            await context.bot.send_message(chat_id, f"_Продолжение ответа \\(стр\\. {index + 1}\\):_\n```\n{page}\n```", parse_mode=ParseMode.MARKDOWN_V2)
+            return
+        more = "" if is_last else "\n_Продолжение ниже\\._"
+        session.show(f"{title}\n\n_Ответ сервера:_\n```\n{page}\n```{more}")
+    await for_each_page(chunks, deliver)
+
+async def run_bulk_action(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str, text: str):
+    """Применяет массовое действие BULK_ACTIONS[action] к списку ников из текста или файла."""
+    nicknames = parse_nicknames(text)
+    if action not in BULK_ACTIONS or not nicknames:
+        await show_main_menu(update, context, "❌ Список ников пуст\\.")
+        return
+    template = BULK_ACTIONS[action][1]
+    await show_rcon_output(update, context, bulk_report([template.format(n) for n in nicknames]), render_bulk_page)
+
+def fleet_targets(context: ContextTypes.DEFAULT_TYPE) -> list:
+    """Серверы, отмеченные админом для команд на всю сеть (по умолчанию — все)."""
+    names = context.user_data.get('fleet_targets')
+    return [server for name, server in servers.items() if names is None or name in names]
+
+async def run_fleet_action(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str, text: str):
+    """Выполняет FLEET_ACTIONS[action] с введённым текстом одновременно на отмеченных серверах."""
+    targets, text = fleet_targets(context), text.strip().lstrip("/")
+    if action not in FLEET_ACTIONS or not text or not targets:
+        await show_main_menu(update, context, "❌ Нечего выполнять: пустой ввод или не отмечен ни один сервер\\.")
+        return
+    await show_rcon_output(update, context, fleet_report(FLEET_ACTIONS[action][2].format(text), targets), render_fleet_page)
+
+async def create_scheduled_job(update: Update, context: ContextTypes.DEFAULT_TYPE, template: str, text: str):
+    """Создаёт задачу планировщика по шаблону: первая строка ввода — расписание, остальные — текст или команды."""
+    lines = [line.strip() for line in text.strip().splitlines() if line.strip()]
+    try:
+        if template not in JOB_TEMPLATES or not lines: raise ValueError("пустой ввод")
+        title, action, _, make_commands = JOB_TEMPLATES[template]
+        commands = make_commands(lines[1:])
+        if action == "commands" and not commands: raise ValueError("после расписания нужен текст или команды")
+        job = scheduler.add(title, current_server().name, action, lines[0], commands)
+    except ValueError as e:
+        context.user_data.update({'next_action': 'sched', 'sched_template': template})
+        await update.message.reply_text(f"❌ {e}. Попробуйте ещё раз:", reply_markup=InlineKeyboardMarkup([back_button("sched:list", "Отмена")]))
+        return
+    text, markup = render_job(job)
+    await update.message.reply_text(f"✅ Задача создана\\.\n\n{text}", reply_markup=markup, parse_mode=ParseMode.MARKDOWN_V2)
+
 @restricted
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start. Сбрасывает состояние и показывает главное меню."""
+    server = context.user_data.get('server')
+    # Режим консоли сбрасывается вместе с user_data — хвост лога для этого чата больше не нужен
+    current_server().console.close(update.effective_chat.id)
     context.user_data.clear()
+    # Выбранный сервер сети — не состояние диалога, его сохраняем
+    if server: context.user_data['server'] = server
     # Устанавливаем постоянные кнопки внизу, если это первый запуск для пользователя
     if 'reply_keyboard_sent' not in context.user_data:
         await update.message.reply_text("Панель управления активирована.", reply_markup=ReplyKeyboardMarkup([["/start"]], resize_keyboard=True))
         context.user_data['reply_keyboard_sent'] = True
     await show_main_menu(update, context)
 
+STATS_TOP_ROWS = 8
+
+def stats_table(title: str, name: str) -> str:
+    """Таблица перцентилей одной гистограммы: самые частые ряды, времена в миллисекундах."""
+    series = metrics.histograms.get(name)
+    if not series: return ""
+    lines = [title, f"{'':<20}{'p50':>5}{'p95':>5}{'p99':>5}{'шт':>6}"]
+    for key, histogram in sorted(series.items(), key=lambda item: -item[1].count)[:STATS_TOP_ROWS]:
+        p50, p95, p99 = (value * 1000 for value in histogram.percentiles(0.5, 0.95, 0.99))
+        label = ",".join(str(value) for _, value in key)[:19]
+        lines.append(f"{label:<20}{p50:>5.0f}{p95:>5.0f}{p99:>5.0f}{histogram.count:>6}")
+    return "\n".join(lines)
+
+def render_stats() -> str:
+    """Сводка метрик для команды /stats (MarkdownV2)."""
+    uptime = int(time.monotonic() - metrics.started)
+    rcon_errors = metrics.counters.get("bot_rcon_errors_total", {})
+    errors_by_kind = collections.Counter()
+    for key, value in rcon_errors.items(): errors_by_kind[dict(key)["kind"]] += value
+    tables = [stats_table("Действия, мс", "bot_handler_seconds"), stats_table("RCON, мс", "bot_rcon_seconds"),
+              stats_table("Telegram API, мс", "bot_telegram_api_seconds"), stats_table("Статус, мс", "bot_status_seconds")]
+    body = "\n\n".join(table for table in tables if table) or "Пока нет замеров"
+    breakers = ", ".join(f"{b.name}: {b.state}" for s in servers.values() for b in (s.pool.breaker, s.status_breaker))
+    hit_rates = [(s.name, s.cache.stats()['hit_rate']) for s in servers.values()]
+    hit_rate = ", ".join(f"{name} {rate:.0%}" for name, rate in hit_rates) if len(hit_rates) > 1 else f"{hit_rates[0][1]:.0%}"
+    return (f"📊 *Статистика за {uptime // 3600} ч {uptime % 3600 // 60} мин*\n\n"
+            f"```\n{body.translate(CODE_ESCAPE_TABLE)}\n```\n"
+            f"*Ошибки RCON:* {int(errors_by_kind['error'])}, таймаутов {int(errors_by_kind['timeout'])}, "
+            f"быстрых отказов {int(errors_by_kind['circuit'])}\n"
+            f"*Кэш:* {escape_markdown(hit_rate)} попаданий\n"
+            f"*Предохранители:* {escape_markdown(breakers)}")
+
+@restricted
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats: перцентили задержек, ошибки и попадания в кэш."""
+    await update.message.reply_text(render_stats(), parse_mode=ParseMode.MARKDOWN_V2)
+
+AUDIT_SHOW_ROWS = 20
+
+def render_audit(rows: list, verb: str = None) -> str:
+    """Записи журнала команд для /audit (MarkdownV2): время, админ, сервер, команда, задержка и размер ответа."""
+    title = f"📜 *Журнал команд{f' «{escape_markdown(verb)}»' if verb else ''}*"
+    if not rows: return f"{title}\n\nЗаписей нет\\."
+    lines = []
+    for ts, admin, server, command, latency_ms, response_bytes, error in reversed(rows):
+        result = f"❌ {error}" if error else f"{response_bytes} Б"
+        lines.append(f"{time.strftime('%d.%m %H:%M:%S', time.localtime(ts))} {admin} [{server}] {command[:60]} — {latency_ms:.0f} мс, {result}")
+    return f"{title}\n```\n" + "\n".join(lines).translate(CODE_ESCAPE_TABLE) + "\n```"
+
+@restricted
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик /audit [команда]: последние RCON-команды админов (например, /audit ban — только баны)."""
+    if not state_store.path:
+        await update.message.reply_text("Журнал команд выключен: укажите STATE_DB_PATH в настройках.")
+        return
+    verb = command_verb(context.args[0]) if context.args else None
+    rows = await state_store.audit_entries(AUDIT_SHOW_ROWS, verb)
+    await update.message.reply_text(render_audit(rows, verb), parse_mode=ParseMode.MARKDOWN_V2)
+
 # =========================================================================
 # --- ЛОГИКА РАБОТЫ МЕНЮ ---
 # =========================================================================
@@ -144,89 +2432,221 @@ async def button_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     action, *params = query.data.split(':')
 
-    # Словарь с обработчиками для каждого меню
-    menu_handlers = {
-        "menu_main": show_main_menu,
-        "menu_status": status_handler,
-        "menu_server": server_menu_handler,
-        "menu_players": players_menu_handler,
-        "menu_world": world_menu_handler,
-        "menu_about": about_menu_handler,
-    }
-
-    if action in menu_handlers:
-        await menu_handlers[action](update, context)
+    if action in MENU_HANDLERS:
+        await MENU_HANDLERS[action](update, context)
     elif action == "action": # Для простых действий в одно нажатие
         await action_handler(update, context, params)
     elif action == "wizard": # Для сложных, пошаговых действий
         await wizard_handler(update, context, params)
+    elif action == "server": # Переключение сервера сети
+        await select_server_handler(update, context, params)
+    elif action == "fleet": # Команды на всю сеть
+        await fleet_handler(update, context, params)
+    elif action == "sched": # Задачи по расписанию
+        await scheduler_handler(update, context, params)
 
 # --- Функции, отображающие каждое конкретное подменю ---
 
 async def status_handler(update, context):
     """Показывает подробный статус сервера."""
-    try:
-        server = JavaServer.lookup(f"{RCON_HOST}:{GAME_PORT}", timeout=3)
-        status = await server.async_status()
-        players_list = await get_online_players()
-        player_text = "\n\n*Игроки онлайн:*\n" + "\n".join([f"\\- ``{p}``" for p in players_list]) if players_list else ""
+    server = current_server()
+    snapshot = server.monitor.fresh_snapshot()
+    if snapshot and not snapshot.online:
+        # Мониторинг уже знает, что сервер лежит, — не ждём таймаутов
+        status = players = ConnectionError("сервер недоступен по данным мониторинга")
+    else:
+        status, players = await collect_server_status(server)
+    players_ok = not isinstance(players, Exception)
+    player_text = "\n\n*Игроки онлайн:*\n" + "\n".join([f"\\- ``{p}``" for p in players]) if players_ok and players else ""
+    if not isinstance(status, Exception):
         motd_escaped = escape_markdown(status.description)
         text = (f"✅ *Сервер ОНЛАЙН*\n\n_{motd_escaped}_\n\n"
                 f"⚙️ *Версия:* {escape_markdown(status.version.name)}\n"
                 f"👥 *Игроки:* {status.players.online} / {status.players.max}{player_text}")
-    except Exception as e:
-        logger.error(f"Ошибка статуса: {e}")
-        text = f"❌ *Сервер ОФФЛАЙН*\n\nНе удалось получить ответ от `{escape_markdown(RCON_HOST)}:{GAME_PORT}`"
+        if not players_ok:
+            logger.error(f"Ошибка RCON: {players}")
+            text += "\n\n⚠️ _Список игроков недоступен: RCON не отвечает\\._"
+    elif players_ok:
+        # Пинг не прошёл, но RCON отвечает — сервер запущен, показываем что есть
+        logger.error(f"Ошибка статуса: {status}")
+        text = (f"⚠️ *Сервер не отвечает на пинг*\n\nRCON при этом работает, так что сервер запущен\\.\n\n"
+                f"👥 *Игроки онлайн:* {len(players)}{player_text}")
+    else:
+        logger.error(f"Ошибка статуса: {status}")
+        text = f"❌ *Сервер ОФФЛАЙН*\n\nНе удалось получить ответ от `{escape_markdown(server.address)}`"
+    if len(servers) > 1: text = f"🖥 *{escape_markdown(server.name)}*\n\n{text}"
     await show_main_menu(update, context, text)
 
 async def server_menu_handler(update, context):
     """Показывает меню управления сервером."""
-    keyboard = [
-        [InlineKeyboardButton("⚙️ Рестарт (через /stop)", callback_data="action:confirm:stop")],
-        [InlineKeyboardButton("🔌 Список плагинов", callback_data="action:show:plugins")],
-        [InlineKeyboardButton("🕹️ Консольный режим", callback_data="wizard:console:start")],
-        [InlineKeyboardButton("« Назад", callback_data="menu_main")],
-    ]
-    await update.callback_query.edit_message_text("⚙️ *Управление сервером*", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
+    await update.callback_query.edit_message_text("⚙️ *Управление сервером*", reply_markup=SERVER_MENU_MARKUP, parse_mode=ParseMode.MARKDOWN_V2)
 
 async def players_menu_handler(update, context):
     """Показывает меню управления игроками."""
-    keyboard = [
-        [InlineKeyboardButton("📋 Список игроков онлайн", callback_data="action:show:players_list")],
-        [InlineKeyboardButton("⚖️ Наказания (Бан/Кик)", callback_data="wizard:punishment_menu")],
-        [InlineKeyboardButton("📜 Белый список (Whitelist)", callback_data="wizard:whitelist_menu")],
-        [InlineKeyboardButton("🕹️ Сменить режим игры", callback_data="wizard:gamemode_select_player")],
-        [InlineKeyboardButton("👑 Управление правами (OP)", callback_data="wizard:op_menu")],
-        [InlineKeyboardButton("✉️ Личное сообщение", callback_data="wizard:msg_select_player")],
-        [InlineKeyboardButton("« Назад", callback_data="menu_main")]
-    ]
-    await update.callback_query.edit_message_text("👥 *Управление игроками*", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
+    await update.callback_query.edit_message_text("👥 *Управление игроками*", reply_markup=PLAYERS_MENU_MARKUP, parse_mode=ParseMode.MARKDOWN_V2)
 
 async def world_menu_handler(update, context):
     """Показывает меню управления миром."""
-    keyboard = [
-        [InlineKeyboardButton("⏳ Управление временем", callback_data="wizard:time_menu")],
-        [InlineKeyboardButton("🌦️ Управление погодой", callback_data="wizard:weather_menu")],
-        [InlineKeyboardButton("« Назад", callback_data="menu_main")],
-    ]
-    await update.callback_query.edit_message_text("🌍 *Управление миром*", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
+    await update.callback_query.edit_message_text("🌍 *Управление миром*", reply_markup=WORLD_MENU_MARKUP, parse_mode=ParseMode.MARKDOWN_V2)
 
 async def about_menu_handler(update, context):
     """Показывает информацию о боте и его ограничениях."""
-    text = (
-        "ℹ️ *О боте и возможностях*\n\n"
-        "Этот бот использует протокол RCON для отправки команд на сервер\\.\n\n"
-        "✅ *Что МОЖНО делать:*\n"
-        "\\- Выполнять любые игровые команды\n"
-        "\\- Управлять игроками и миром\n"
-        "\\- Перезапускать сервер командой `/stop`\n\n"
-        "❌ *Что НЕЛЬЗЯ делать через бота:*\n"
-        "\\- *Управлять файлами*: Загружать/удалять плагины, моды, карты\\.\n"
-        "\\- *Просматривать ресурсы*: Узнать использование RAM/CPU сервера\\.\n\n"
-        "_Всё это делается только через FTP/SFTP или панель вашего хостинга\\._"
-    )
-    keyboard = [[InlineKeyboardButton("« Назад в панель управления", callback_data="menu_main")]]
-    await update.callback_query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
+    await update.callback_query.edit_message_text(text=ABOUT_TEXT, reply_markup=ABOUT_MARKUP, parse_mode=ParseMode.MARKDOWN_V2)
+
+async def select_server_handler(update, context, params):
+    """Переключает админа на другой сервер сети."""
+    name = ":".join(params[1:])
+    if name not in servers:
+        await show_main_menu(update, context, "⚠️ Такого сервера больше нет в настройках\\.")
+        return
+    # Консоль и незаконченные диалоги относятся к прежнему серверу
+    for server in servers.values(): server.console.close(update.effective_chat.id)
+    for key in ('console_mode', 'console_message_id', 'next_action', 'picker_search'): context.user_data.pop(key, None)
+    context.user_data['server'] = name
+    current_server_name.set(name)
+    await show_main_menu(update, context, f"🖥 Выбран сервер *{escape_markdown(name)}*\\. Выберите действие:")
+
+def render_fleet_menu(targets: list) -> tuple:
+    """Текст и клавиатура меню «Вся сеть»: отметки серверов, статус и команды на отмеченные серверы."""
+    toggles = [InlineKeyboardButton(f"{'✅' if server in targets else '▫️'} {name}", callback_data=f"fleet:toggle:{name}")
+               for name, server in servers.items()]
+    actions = [InlineKeyboardButton(title, callback_data=f"fleet:prompt:{key}") for key, (title, _, _) in FLEET_ACTIONS.items()]
+    keyboard = ([toggles[i:i + 3] for i in range(0, len(toggles), 3)]
+                + [[InlineKeyboardButton("📊 Статус всей сети", callback_data="fleet:status")]]
+                + [actions[i:i + 2] for i in range(0, len(actions), 2)] + [back_button("menu_main")])
+    text = (f"🌐 *Вся сеть*\n\nКоманды выполняются одновременно на отмеченных серверах "
+            f"\\({len(targets)} из {len(servers)}\\), ответы приходят одним сообщением\\.")
+    return text, InlineKeyboardMarkup(keyboard)
+
+def render_fleet_status(results: list) -> str:
+    """Сводка статуса сети для MarkdownV2: строка на сервер со временем ответа."""
+    lines, online, total_players = [], 0, 0
+    for server, status, players, elapsed in results:
+        name, took = escape_markdown(server.name), escape_markdown(f"{elapsed * 1000:.0f} мс")
+        if not isinstance(status, Exception):
+            online += 1
+            total_players += status.players.online
+            lines.append(f"✅ *{name}* — {status.players.online}/{status.players.max}, {took}")
+        elif not isinstance(players, Exception):
+            online += 1
+            total_players += len(players)
+            lines.append(f"⚠️ *{name}* — не отвечает на пинг, по RCON игроков: {len(players)}, {took}")
+        else:
+            lines.append(f"❌ *{name}* — офлайн \\(`{escape_markdown(server.address)}`\\), {took}")
+    return f"🌐 *Статус сети:* онлайн {online} из {len(results)}, игроков {total_players}\n\n" + "\n".join(lines)
+
+async def fleet_handler(update, context, params):
+    """Меню «Вся сеть»: отметка серверов, сводный статус и запросы команд на все отмеченные серверы."""
+    step, *args = params
+    query = update.callback_query
+    if step == "toggle":
+        name = ":".join(args)
+        selected = [server.name for server in fleet_targets(context)]
+        if name in selected: selected.remove(name)
+        elif name in servers: selected.append(name)
+        context.user_data['fleet_targets'] = selected
+    elif step == "status":
+        _, markup = render_fleet_menu(fleet_targets(context))
+        await query.edit_message_text(render_fleet_status(await fleet_status()), reply_markup=markup, parse_mode=ParseMode.MARKDOWN_V2)
+        return
+    elif step == "prompt" and args[0] in FLEET_ACTIONS:
+        context.user_data.update({'next_action': 'fleet', 'fleet_action': args[0]})
+        await query.edit_message_text(FLEET_ACTIONS[args[0]][1], reply_markup=InlineKeyboardMarkup([back_button("fleet:menu", "Отмена")]))
+        return
+    context.user_data.pop('next_action', None)
+    text, markup = render_fleet_menu(fleet_targets(context))
+    await query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN_V2)
+
+def format_moment(ts: float) -> str:
+    return time.strftime('%d.%m %H:%M', time.localtime(ts)) if ts else "—"
+
+def render_job_list(server: MinecraftServer, page: int) -> tuple:
+    """Текст и клавиатура списка задач сервера (MarkdownV2), ближайшие запуски — первыми."""
+    jobs = sorted((job for job in scheduler.jobs.values() if job.server == server.name),
+                  key=lambda job: (not job.enabled, job.next_run or 0))
+    pages = max(1, math.ceil(len(jobs) / SCHEDULER_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    shown = jobs[page * SCHEDULER_PAGE_SIZE:(page + 1) * SCHEDULER_PAGE_SIZE]
+    keyboard = [[InlineKeyboardButton(f"{'✅' if job.enabled else '⏸'} #{job.id} {job.title} · {format_moment(job.next_run) if job.enabled else 'выкл'}",
+                                      callback_data=f"sched:job:{job.id}")] for job in shown]
+    if pages > 1:
+        keyboard.append([InlineKeyboardButton("«", callback_data=f"sched:list:{page - 1}"),
+                         InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"sched:list:{page}"),
+                         InlineKeyboardButton("»", callback_data=f"sched:list:{page + 1}")])
+    keyboard += [[InlineKeyboardButton("➕ Новая задача", callback_data="sched:new")], back_button("menu_main")]
+    text = f"⏰ *Планировщик* сервера *{escape_markdown(server.name)}*\n\n"
+    text += f"Задач: {len(jobs)}\\. Выберите задачу или создайте новую\\." if jobs else "Задач пока нет\\."
+    return text, InlineKeyboardMarkup(keyboard)
+
+def render_job(job: ScheduledJob) -> tuple:
+    """Карточка задачи (MarkdownV2) с кнопками управления."""
+    commands = "\n".join(job.commands) if job.action == "commands" else "отсчёт в чате, save-all flush, stop"
+    text = (f"⏰ *Задача \\#{job.id}:* {escape_markdown(job.title)}\n\n"
+            f"🖥 *Сервер:* {escape_markdown(job.server)}\n"
+            f"🗓 *Расписание:* {escape_markdown(job.trigger.describe())}\n"
+            f"▶️ *Следующий запуск:* {escape_markdown(format_moment(job.next_run) if job.enabled else 'выключена')}\n"
+            f"🕘 *Последний запуск:* {escape_markdown(format_moment(job.last_run))}"
+            + (f" — {escape_markdown(job.last_result)}" if job.last_result else "")
+            + (" \\(выполняется\\)" if scheduler.running(job.id) else "")
+            + f"\n\n*Команды:*\n```\n{commands.translate(CODE_ESCAPE_TABLE)}\n```")
+    keyboard = [
+        [InlineKeyboardButton("⏸ Выключить" if job.enabled else "▶️ Включить", callback_data=f"sched:toggle:{job.id}"),
+         InlineKeyboardButton("🚀 Запустить сейчас", callback_data=f"sched:run:{job.id}")],
+        [InlineKeyboardButton("🗑 Удалить", callback_data=f"sched:delete:{job.id}")],
+        back_button("sched:list"),
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def scheduler_handler(update, context, params):
+    """Меню планировщика: список задач сервера, карточка задачи, создание по шаблону."""
+    step, *args = params
+    query = update.callback_query
+    job = scheduler.jobs.get(int(args[0])) if step in ("job", "toggle", "run", "delete", "delete_yes") and args[0].isdigit() else None
+    if step in ("job", "toggle", "run", "delete", "delete_yes") and job is None:
+        step, args, notice = "list", [], "⚠️ Такой задачи больше нет\\.\n\n"
+    else:
+        notice = ""
+    if step == "new":
+        if args and args[0] in JOB_TEMPLATES:
+            context.user_data.update({'next_action': 'sched', 'sched_template': args[0]})
+            await query.edit_message_text(JOB_TEMPLATES[args[0]][2], reply_markup=InlineKeyboardMarkup([back_button("sched:list", "Отмена")]))
+            return
+        keyboard = [[InlineKeyboardButton(title, callback_data=f"sched:new:{key}")] for key, (title, _, _, _) in JOB_TEMPLATES.items()]
+        await query.edit_message_text("➕ *Новая задача*\n\nВыберите, что делать по расписанию:",
+                                      reply_markup=InlineKeyboardMarkup(keyboard + [back_button("sched:list")]), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+    if step == "delete":
+        keyboard = [[InlineKeyboardButton("🗑 Да, удалить", callback_data=f"sched:delete_yes:{job.id}")], back_button(f"sched:job:{job.id}", "Отмена")]
+        await query.edit_message_text(f"Удалить задачу *\\#{job.id}* {escape_markdown(job.title)}?",
+                                      reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+    if step == "delete_yes":
+        scheduler.remove(job.id)
+        step, args, notice = "list", [], f"🗑 Задача \\#{job.id} удалена\\.\n\n"
+    elif step == "toggle":
+        scheduler.set_enabled(job.id, not job.enabled)
+    elif step == "run":
+        notice = "🚀 Задача запущена\\.\n\n" if scheduler.run_now(job.id) else "⏳ Задача уже выполняется\\.\n\n"
+    if step == "list":
+        if context.user_data.get('next_action') == 'sched': context.user_data.pop('next_action')
+        context.user_data.pop('sched_template', None)
+        text, markup = render_job_list(current_server(), int(args[0]) if args and args[0].lstrip("-").isdigit() else 0)
+    else:
+        text, markup = render_job(job)
+    try:
+        await query.edit_message_text(notice + text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN_V2)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e): raise
+
+# Обработчики пунктов меню для button_router (функции объявлены выше)
+MENU_HANDLERS = {
+    "menu_main": show_main_menu,
+    "menu_status": status_handler,
+    "menu_server": server_menu_handler,
+    "menu_players": players_menu_handler,
+    "menu_world": world_menu_handler,
+    "menu_about": about_menu_handler,
+}
 
 async def action_handler(update, context, params):
     """Обрабатывает простые действия, такие как выполнение команды или запрос подтверждения."""
@@ -234,18 +2654,24 @@ async def action_handler(update, context, params):
     query = update.callback_query
     text = ""
     if action_type == "confirm":
-        confirm_texts = {'stop': "🚨 *РЕСТАРТ СЕРВЕРА*\n\nБудет выполнена команда `/stop`\\. Большинство хостингов *автоматически перезапустят* сервер после этого\\. Для *полного выключения* используйте панель хостинга\\. Вы уверены?"}
-        keyboard = [[InlineKeyboardButton("Да, рестарт", callback_data=f"action:exec:{command}"), InlineKeyboardButton("Отмена", callback_data="menu_server")]]
-        await query.edit_message_text(confirm_texts[command], reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
+        confirm_text, confirm_markup = CONFIRM_MENUS[command]
+        await query.edit_message_text(confirm_text, reply_markup=confirm_markup, parse_mode=ParseMode.MARKDOWN_V2)
         return
     elif action_type == "exec":
         command_str = command + (" " + " ".join(args) if args else "")
-        response = await execute_rcon(command_str)
-        text = f"Выполнена команда `{escape_markdown(command_str)}`\n\n*Ответ сервера:*\n`{escape_markdown(response)}`"
+        def render(page, index, is_last):
+            if index == 0: return f"Выполнена команда `{escape_markdown(command_str)}`\n\n*Ответ сервера:*\n`{page}`"
+            return f"*Ответ сервера \\(стр\\. {index + 1}\\):*\n`{page}`"
+        await show_rcon_output(update, context, stream_rcon(command_str), render)
+        return
     elif action_type == "show":
         if command == "plugins":
-            response = await execute_rcon("plugins")
-            text = f"🔌 *Список плагинов:*\n`{escape_markdown(response)}`\n\n_Управление файлами плагинов доступно только через панель хостинга\\._"
+            def render(page, index, is_last):
+                title = "🔌 *Список плагинов:*" if index == 0 else f"🔌 *Список плагинов \\(стр\\. {index + 1}\\):*"
+                footer = "\n\n_Управление файлами плагинов доступно только через панель хостинга\\._" if is_last else ""
+                return f"{title}\n`{page}`{footer}"
+            await show_rcon_output(update, context, cached_rcon("plugins", "plugins"), render)
+            return
         elif command == "players_list":
             players = await get_online_players()
             text = "*Игроки онлайн:*\n" + "\n".join([f"\\- ``{p}``" for p in players]) if players else "На сервере нет игроков онлайн\\."
@@ -260,48 +2686,73 @@ async def wizard_handler(update, context, params):
     if step == "console":
         if args[0] == "start":
             context.user_data['console_mode'] = True
-            keyboard = [[InlineKeyboardButton("Выйти из режима консоли", callback_data="wizard:console:stop")]]
-            message = await query.edit_message_text("🕹️ *Режим консоли*\n\nОжидание команды\\.\\.\\.", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
-            context.user_data['console_message_id'] = message.message_id
+            session = current_server().console.open(context.bot, update.effective_chat.id, query.message.message_id)
+            context.user_data['console_message_id'] = session.message_id
+            session.refresh()
         elif args[0] == "stop":
             context.user_data.pop('console_mode', None)
             context.user_data.pop('console_message_id', None)
+            current_server().console.close(update.effective_chat.id)
             await show_main_menu(update, context, "✅ Вы вышли из режима консоли")
         return
 
     # --- Общий мастер для выбора игроков ---
-    player_wizards = {
-        "op_select_player": ("Выдать OP", "op_exec", "op_prompt", "wizard:op_menu"),
-        "deop_select_player": ("Забрать OP", "deop_exec", "deop_prompt", "wizard:op_menu"),
-        "msg_select_player": ("Отправить сообщение", "msg_prompt_message", None, "menu_players"),
-        "gamemode_select_player": ("Сменить режим игры", "gamemode_select_mode", None, "menu_players"),
-        "kick_select_player": ("Кикнуть игрока", "kick_exec", None, "wizard:punishment_menu"),
-        "ban_select_player": ("Забанить игрока", "ban_prompt_reason", "ban_prompt", "wizard:punishment_menu"),
-        "whitelist_add_select_player": ("Добавить в WL", "whitelist_add_exec", "whitelist_add_prompt", "wizard:whitelist_menu"),
-        "whitelist_remove_select_player": ("Удалить из WL", "whitelist_remove_exec", "whitelist_remove_prompt", "wizard:whitelist_menu")
-    }
-    if step in player_wizards:
-        title, exec_action, manual_action, back_menu = player_wizards[step]
+    if step in PLAYER_WIZARDS:
+        title, _, manual_action, back_menu = PLAYER_WIZARDS[step]
         players = await get_online_players()
-        keyboard = [[InlineKeyboardButton(p, callback_data=f"wizard:{exec_action}:{p}")] for p in players]
         if not players:
             prompt_text = f"Нет игроков онлайн для действия '{escape_markdown(title)}'\\. Вы можете ввести ник вручную\\."
-            keyboard = [[InlineKeyboardButton("Ввести ник вручную", callback_data=f"wizard:{manual_action}") if manual_action else None], [InlineKeyboardButton("« Назад", callback_data=back_menu)]]
+            keyboard = [[InlineKeyboardButton("Ввести ник вручную", callback_data=f"wizard:{manual_action}") if manual_action else None], back_button(back_menu)]
             keyboard = [row for row in keyboard if row[0] is not None] # Убираем пустые кнопки
             await query.edit_message_text(prompt_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
             return
+        # Вход в мастер из меню сбрасывает поиск; листание страниц его сохраняет
+        if not args: context.user_data.pop('picker_search', None)
+        if context.user_data.get('next_action') == 'picker_search': context.user_data.pop('next_action')
+        prefix = context.user_data.get('picker_search', {}).get(step, "")
+        page = int(args[0]) if args and args[0].isdigit() else 0
+        server = current_server()
+        text, markup = render_player_picker(step, players, (server.name, server.cache.version("players")), page, prefix)
+        await query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    # --- Поиск в мастере выбора игрока ---
+    if step == "picker_search":
+        context.user_data.update({'next_action': 'picker_search', 'picker_step': args[0], 'picker_message_id': query.message.message_id})
+        await query.edit_message_text("🔍 Введите начало ника:", reply_markup=InlineKeyboardMarkup([back_button(f"wizard:{args[0]}:0", "Отмена")]))
+        return
+    if step == "picker_clear":
+        context.user_data.pop('picker_search', None)
+        await wizard_handler(update, context, [args[0], "0"])
+        return
 
-        if manual_action: keyboard.append([InlineKeyboardButton("Ввести ник вручную", callback_data=f"wizard:{manual_action}")])
-        keyboard.append([InlineKeyboardButton("« Назад", callback_data=back_menu)])
-        await query.edit_message_text(f"Выберите игрока для действия '{escape_markdown(title)}':", reply_markup=InlineKeyboardMarkup(keyboard))
+    # --- Подсказка из истории ников в запросе ника ---
+    if step == "prompt_pick":
+        action, player = context.user_data.get('next_action'), resolve_player(args[0])
+        if action not in NICKNAME_PROMPTS or player is None:
+            await show_main_menu(update, context, "⚠️ Запрос устарел, начните действие заново\\.")
+            return
+        context.user_data.pop('next_action')
+        response = await execute_rcon(PROMPT_COMMANDS[action].format(player))
+        await show_main_menu(update, context, f"Выполнено\\.\n\n*Ответ:*\n`{escape_markdown(response)}`")
+        return
+    if step == "prompt_cancel":
+        context.user_data.pop('next_action', None)
+        await show_main_menu(update, context)
         return
 
+    # Шаги после выбора игрока получают в args[0] токен из кнопки (или ник) — превращаем его в ник
+    if args and step in PLAYER_TARGET_STEPS:
+        player = resolve_player(args[0])
+        if player is None:
+            await show_main_menu(update, context, "⚠️ Список игроков устарел, откройте выбор игрока заново\\.")
+            return
+        args = [player, *args[1:]]
+
     # --- Прямые действия с выбранными игроками ---
-    if step in ["op_exec", "deop_exec", "kick_exec", "whitelist_add_exec", "whitelist_remove_exec"]:
+    if step in PLAYER_EXEC_COMMANDS:
         player = args[0]
-        commands = {"op_exec": "op", "deop_exec": "deop", "kick_exec": "kick", 
-                    "whitelist_add_exec": "whitelist add", "whitelist_remove_exec": "whitelist remove"}
-        cmd = commands[step]
+        cmd = PLAYER_EXEC_COMMANDS[step]
         response = await execute_rcon(f"{cmd} {player}")
         await show_main_menu(update, context, f"Выполнена команда `{cmd} {escape_markdown(player)}`\n\n*Ответ:*\n`{escape_markdown(response)}`")
     
@@ -311,10 +2762,7 @@ async def wizard_handler(update, context, params):
         await query.edit_message_text(f"Введите причину бана для игрока ``{escape_markdown(args[0])}`` (или просто отправьте `-` для бана без причины):")
     elif step == "gamemode_select_mode":
         context.user_data['selected_player'] = args[0]
-        gamemode_map = {'c': 'creative', 's': 'survival', 'a': 'adventure', 'sp': 'spectator'}
-        keyboard = [[InlineKeyboardButton(f"{v.capitalize()} ({k})", callback_data=f"wizard:gamemode_exec:{v}")] for k, v in gamemode_map.items()]
-        keyboard.append([InlineKeyboardButton("« Назад", callback_data="wizard:gamemode_select_player")])
-        await query.edit_message_text(f"Выберите режим для ``{escape_markdown(args[0])}``:", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
+        await query.edit_message_text(f"Выберите режим для ``{escape_markdown(args[0])}``:", reply_markup=GAMEMODE_MARKUP, parse_mode=ParseMode.MARKDOWN_V2)
     elif step == "gamemode_exec":
         mode, player = args[0], context.user_data.pop('selected_player', 'неизвестно')
         response = await execute_rcon(f"gamemode {mode} {player}")
@@ -323,25 +2771,33 @@ async def wizard_handler(update, context, params):
         context.user_data.update({'selected_player': args[0], 'next_action': 'msg'})
         await query.edit_message_text(f"Введите сообщение для игрока ``{escape_markdown(args[0])}``:")
 
+    # --- Мастер: Массовые действия ---
+    elif step == "bulk_prompt":
+        context.user_data.update({'next_action': 'bulk', 'bulk_action': args[0]})
+        await query.edit_message_text(f"{escape_markdown(BULK_ACTIONS[args[0]][0])}: отправьте список ников или `.txt` файл\\.", parse_mode=ParseMode.MARKDOWN_V2)
+    elif step == "bulk_online":
+        players = await get_online_players()
+        if not players:
+            await show_main_menu(update, context, "На сервере нет игроков онлайн\\.")
+            return
+        keyboard = [[InlineKeyboardButton("Да, выполнить", callback_data=f"wizard:bulk_online_exec:{args[0]}"), InlineKeyboardButton("Отмена", callback_data="wizard:bulk_menu")]]
+        await query.edit_message_text(f"{escape_markdown(BULK_ACTIONS[args[0]][0])}: *все игроки онлайн* \\({len(players)}\\)\\. Вы уверены?", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
+    elif step == "bulk_online_exec":
+        await run_bulk_action(update, context, args[0], " ".join(await get_online_players()))
+
     # --- Отображение подменю ---
-    elif step in ["op_menu", "punishment_menu", "whitelist_menu", "time_menu", "weather_menu"]:
-        menu_map = {
-            "op_menu": ("👑 *Управление правами OP*", [[InlineKeyboardButton("👑 Выдать OP", callback_data="wizard:op_select_player")], [InlineKeyboardButton("🚫 Забрать OP", callback_data="wizard:deop_select_player")], [InlineKeyboardButton("« Назад", callback_data="menu_players")]]),
-            "punishment_menu": ("⚖️ *Управление наказаниями*", [[InlineKeyboardButton("🚷 Кикнуть игрока", callback_data="wizard:kick_select_player")], [InlineKeyboardButton("🚫 Забанить игрока", callback_data="wizard:ban_select_player")], [InlineKeyboardButton("🔓 Разбанить игрока", callback_data="wizard:unban_prompt")], [InlineKeyboardButton("« Назад", callback_data="menu_players")]]),
-            "whitelist_menu": ("📜 *Управление Белым списком*", [[InlineKeyboardButton("➕ Добавить в WL", callback_data="wizard:whitelist_add_select_player")], [InlineKeyboardButton("➖ Удалить из WL", callback_data="wizard:whitelist_remove_select_player")], [InlineKeyboardButton("📋 Показать WL", callback_data="action:exec:whitelist list")], [InlineKeyboardButton("▶️ Включить WL", callback_data="action:exec:whitelist on"), InlineKeyboardButton("⏹️ Выключить WL", callback_data="action:exec:whitelist off")], [InlineKeyboardButton("« Назад", callback_data="menu_players")]]),
-            "time_menu": ("⏳ *Управление временем*", [[InlineKeyboardButton("Рассвет (0)", callback_data="action:exec:time set 0"), InlineKeyboardButton("Полдень (6000)", callback_data="action:exec:time set 6000")], [InlineKeyboardButton("Закат (12000)", callback_data="action:exec:time set 12000"), InlineKeyboardButton("Ночь (18000)", callback_data="action:exec:time set 18000")], [InlineKeyboardButton("Задать время в тиках", callback_data="wizard:time_prompt_ticks")], [InlineKeyboardButton("« Назад", callback_data="menu_world")]]),
-            "weather_menu": ("🌦️ *Управление погодой*", [[InlineKeyboardButton("☀️ Ясно", callback_data="action:exec:weather clear")], [InlineKeyboardButton("💧 Дождь", callback_data="action:exec:weather rain")], [InlineKeyboardButton("⚡️ Гроза", callback_data="action:exec:weather thunder")], [InlineKeyboardButton("« Назад", callback_data="menu_world")]])}
-        title, keyboard_layout = menu_map[step]
-        await query.edit_message_text(title, reply_markup=InlineKeyboardMarkup(keyboard_layout), parse_mode=ParseMode.MARKDOWN_V2)
+    elif step in WIZARD_MENUS:
+        title, markup = WIZARD_MENUS[step]
+        await query.edit_message_text(title, reply_markup=markup, parse_mode=ParseMode.MARKDOWN_V2)
     
     # --- Запросы на ввод текста ---
-    prompts = {'op_prompt': ('op', "👑 Введите ник для выдачи OP:"), 'deop_prompt': ('deop', "🚫 Введите ник для снятия OP:"),
-               'time_prompt_ticks': ('time_ticks', "⏳ Введите время в тиках:"), 'ban_prompt': ('ban', "🚫 Введите ник для бана:"),
-               'unban_prompt': ('unban', "🔓 Введите ник для разбана:"), 'whitelist_add_prompt': ('whitelist_add', "➕ Введите ник для добавления в WL:"),
-               'whitelist_remove_prompt': ('whitelist_remove', "➖ Введите ник для удаления из WL:")}
-    if step in prompts:
-        context.user_data['next_action'] = prompts[step][0]
-        await query.edit_message_text(escape_markdown(prompts[step][1]))
+    if step in TEXT_PROMPTS:
+        context.user_data['next_action'], prompt_text = TEXT_PROMPTS[step]
+        markup = None
+        if context.user_data['next_action'] in NICKNAME_PROMPTS:
+            # Вручную обычно вводят тех, кого нет онлайн, — подсказываем недавно заходивших
+            markup = suggestions_markup(await state_store.recent_players(HISTORY_SUGGESTIONS))
+        await query.edit_message_text(prompt_text, reply_markup=markup)
 
 # =========================================================================
 # --- ОБРАБОТЧИК ТЕКСТОВЫХ СООБЩЕНИЙ ---
@@ -352,23 +2808,49 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_text = update.message.text
     # Обработка консольного режима
     if context.user_data.get('console_mode'):
-        chat_id = update.effective_chat.id
-        message_id = context.user_data.get('console_message_id')
         await update.message.delete()
-        if not message_id: return
-        response = await execute_rcon(user_text)
-        console_text = f"🕹️ *Режим консоли*\n\n_Последняя команда:_\n> ``{escape_markdown(user_text)}``\n\n_Ответ сервера:_\n```\n{escape_markdown(response)}\n```"
-        keyboard = [[InlineKeyboardButton("Выйти из режима консоли", callback_data="wizard:console:stop")]]
-        try:
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=console_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN_V2)
-        except BadRequest as e:
-            if "Message is not modified" not in str(e): logger.error(f"Ошибка обновления консоли: {e}")
+        commands = parse_script(user_text)
+        # Несколько строк — это скрипт: выполняем его пакетом по одному соединению
+        if len(commands) > 1:
+            await run_in_console(update, context, bulk_report(commands), f"_Пакет из {len(commands)} команд_")
+        else:
+            await run_in_console(update, context, stream_rcon(user_text), f"_Последняя команда:_\n> ``{escape_markdown(user_text)}``")
         return
 
     # Обработка ответов на запросы (wizard)
     if 'next_action' in context.user_data:
         action = context.user_data.pop('next_action')
         command = ""
+        if action == 'bulk':
+            try: await update.message.delete()
+            except Exception: pass
+            await run_bulk_action(update, context, context.user_data.pop('bulk_action', None), user_text)
+            return
+        if action == 'fleet':
+            try: await update.message.delete()
+            except Exception: pass
+            await run_fleet_action(update, context, context.user_data.pop('fleet_action', None), user_text)
+            return
+        if action == 'sched':
+            try: await update.message.delete()
+            except Exception: pass
+            await create_scheduled_job(update, context, context.user_data.pop('sched_template', None), user_text)
+            return
+        if action == 'picker_search':
+            step, message_id = context.user_data.pop('picker_step', None), context.user_data.pop('picker_message_id', None)
+            if step not in PLAYER_WIZARDS: return
+            try: await update.message.delete()
+            except Exception: pass
+            prefix = user_text.strip()[:16]
+            context.user_data['picker_search'] = {step: prefix}
+            players = await get_online_players()
+            server = current_server()
+            text, markup = render_player_picker(step, players, (server.name, server.cache.version("players")), 0, prefix)
+            if message_id:
+                await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message_id, text=text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN_V2)
+            else:
+                await update.message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN_V2)
+            return
         if action == 'msg':
             player = context.user_data.pop('selected_player', None)
             if player: command = f"msg {player} {user_text}"
@@ -376,30 +2858,285 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             player = context.user_data.pop('selected_player', None)
             reason = user_text if user_text != '-' else ''
             if player: command = f"ban {player} {reason}"
-        else:
-            actions_map = {'op': f"op {user_text}", 'deop': f"deop {user_text}", 'time_ticks': f"time set {user_text}", 'ban': f"ban {user_text}",
-                           'unban': f"pardon {user_text}", 'whitelist_add': f"whitelist add {user_text}", 'whitelist_remove': f"whitelist remove {user_text}"}
-            command = actions_map.get(action)
+        elif action in PROMPT_COMMANDS:
+            text = user_text.strip()
+            # Один ник (без причины бана и т.п.) дополняем по истории игроков
+            if action in NICKNAME_PROMPTS and text and " " not in text:
+                text, matches = await complete_nickname(text)
+                if matches:
+                    context.user_data['next_action'] = action
+                    try: await update.message.delete()
+                    except Exception: pass
+                    await update.message.reply_text(f"Игроки из истории, чей ник начинается на «{user_text.strip()}»:",
+                                                    reply_markup=suggestions_markup(matches, user_text.strip()))
+                    return
+            command = PROMPT_COMMANDS[action].format(text)
         if command:
             response = await execute_rcon(command)
             try: await update.message.delete()
             except Exception: pass
             await show_main_menu(update, context, f"Выполнено\\.\n\n*Ответ:*\n`{escape_markdown(response)}`")
 
+@restricted
+async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Принимает .txt файл: скрипт команд в режиме консоли или список ников для массового действия."""
+    document = update.message.document
+    in_console = context.user_data.get('console_mode')
+    if not in_console and context.user_data.get('next_action') != 'bulk':
+        await update.message.reply_text("Файл можно отправить в режиме консоли (скрипт команд) или в «📦 Массовых действиях» (список ников).")
+        return
+    if document.file_size and document.file_size > BULK_MAX_FILE_SIZE:
+        await update.message.reply_text(f"❌ Файл слишком большой (максимум {BULK_MAX_FILE_SIZE // 1024} КБ).")
+        return
+    text = (await (await document.get_file()).download_as_bytearray()).decode("utf-8-sig", errors="replace")
+    try: await update.message.delete()
+    except Exception: pass
+    if in_console:
+        commands = parse_script(text)
+        await run_in_console(update, context, bulk_report(commands), f"_Скрипт {escape_markdown(document.file_name or 'script.txt')}: {len(commands)} команд_")
+    else:
+        context.user_data.pop('next_action', None)
+        await run_bulk_action(update, context, context.user_data.pop('bulk_action', None), text)
+
+# =========================================================================
+# --- ВСТРОЕННЫЙ HTTP-СЕРВЕР (WEBHOOK) ---
+# Минимальный HTTP/1.1 на asyncio, чтобы webhook не требовал внешних зависимостей
+# =========================================================================
+
+class HttpError(Exception):
+    """Запрос, на который HttpServer отвечает статусом ошибки и закрывает соединение."""
+
+    def __init__(self, status: HTTPStatus):
+        super().__init__(status.phrase)
+        self.status = status
+
+class HttpServer:
+    """Небольшой асинхронный HTTP/1.1 сервер с keep-alive.
+
+    routes: {(метод, путь): async handler(headers, body) -> (статус, content-type, тело)}.
+    """
+
+    MAX_BODY_SIZE = 1024 * 1024
+    MAX_HEADERS, MAX_HEADER_BYTES = 100, 16 * 1024
+    # Соединение закрывается, если следующий запрос не начался за IDLE_TIMEOUT секунд
+    # или начатый запрос (заголовки и тело) не дочитан за REQUEST_TIMEOUT — медленные клиенты не держат задачи вечно
+    IDLE_TIMEOUT, REQUEST_TIMEOUT = 75, 10
+
+    def __init__(self, routes: dict):
+        self.routes = routes
+        self._server = None
+        self._connections = set()
+
+    async def start(self, host: str, port: int) -> int:
+        """Начинает принимать соединения; возвращает фактический порт (удобно при port=0)."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Перестаёт принимать соединения и закрывает открытые keep-alive соединения."""
+        if not self._server: return
+        self._server.close()
+        for writer in list(self._connections): writer.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), self.IDLE_TIMEOUT)
+                if not request_line: break
+                method, target, version = request_line.decode("latin-1").split()
+                try:
+                    headers, body = await asyncio.wait_for(self._read_request(reader), self.REQUEST_TIMEOUT)
+                except HttpError as e:
+                    self._respond(writer, e.status, "text/plain", b"", keep_alive=False)
+                    await writer.drain()
+                    break
+                handler = self.routes.get((method, target.split("?", 1)[0]))
+                if handler is None:
+                    status, content_type, payload = HTTPStatus.NOT_FOUND, "text/plain", b"Not Found"
+                else:
+                    try:
+                        status, content_type, payload = await handler(headers, body)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки HTTP-запроса {method} {target}: {e}")
+                        status, content_type, payload = HTTPStatus.INTERNAL_SERVER_ERROR, "text/plain", b""
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                self._respond(writer, status, content_type, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive: break
+        except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader) -> tuple:
+        """Заголовки и тело запроса (после строки запроса) с ограничением их числа и размера."""
+        headers, count, header_bytes = {}, 0, 0
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            count, header_bytes = count + 1, header_bytes + len(line)
+            if count > self.MAX_HEADERS or header_bytes > self.MAX_HEADER_BYTES:
+                raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > self.MAX_BODY_SIZE: raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        return headers, await reader.readexactly(length) if length else b""
+
+    def _respond(self, writer, status: HTTPStatus, content_type: str, payload: bytes, keep_alive: bool):
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + payload)
+
+def webhook_endpoint(application: Application, secret: str):
+    """Обработчик webhook: проверяет секрет Telegram и ставит обновление в очередь приложения."""
+    expected = secret.encode()
+    async def handle(headers: dict, body: bytes) -> tuple:
+        # Сравнение за постоянное время, чтобы секрет нельзя было подобрать по задержке ответа
+        if not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", "").encode(), expected):
+            return HTTPStatus.FORBIDDEN, "text/plain", b"Forbidden"
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except (ValueError, TypeError, KeyError):
+            return HTTPStatus.BAD_REQUEST, "text/plain", b"Bad Request"
+        # Отвечаем Telegram сразу: сама обработка идёт параллельно в Application
+        await application.update_queue.put(update)
+        return HTTPStatus.OK, "text/plain", b"OK"
+    return handle
+
+def metrics_endpoint():
+    """Обработчик /metrics: метрики бота в формате Prometheus."""
+    async def handle(headers: dict, body: bytes) -> tuple:
+        return HTTPStatus.OK, "text/plain; version=0.0.4; charset=utf-8", metrics.render().encode()
+    return handle
+
+metrics_server = HttpServer({("GET", "/metrics"): metrics_endpoint()})
+
+async def start_webhook(application: Application, secret: str, register: bool = True) -> HttpServer:
+    """Запускает приложение и HTTP-сервер webhook; register=False не трогает настройки бота в Telegram."""
+    await application.initialize()
+    if application.post_init: await application.post_init(application)
+    await application.start()
+    server = HttpServer({("POST", WEBHOOK_PATH): webhook_endpoint(application, secret)})
+    server.port = await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+    if register:
+        await application.bot.set_webhook(WEBHOOK_URL, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+    logger.info(f"Webhook слушает {WEBHOOK_LISTEN}:{server.port}{WEBHOOK_PATH}")
+    return server
+
+async def stop_webhook(application: Application, server: HttpServer):
+    """Мягкая остановка: больше не принимаем обновления, дорабатываем принятые и дожидаемся RCON-команд."""
+    await server.stop()
+    # Application.stop() дожидается обработки всех обновлений, уже попавших в очередь
+    if application.running: await application.stop()
+    await application.shutdown()
+    if application.post_shutdown: await application.post_shutdown(application)
+
+async def run_webhook(application: Application):
+    """Работает в режиме webhook до Ctrl+C / SIGTERM."""
+    server = await start_webhook(application, WEBHOOK_SECRET or secrets.token_urlsafe(32))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # На Windows обработчиков сигналов в asyncio нет — там остановка придёт как KeyboardInterrupt
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Остановка бота...")
+        await stop_webhook(application, server)
+
 # =========================================================================
 # --- ЗАПУСК БОТА ---
 # =========================================================================
-def main():
-    """Главная функция, которая собирает и запускает бота."""
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных чатов параллельно, а одного чата — строго в порядке поступления.
+
+    Медленная RCON-команда одного админа не задерживает остальных, а пошаговые диалоги
+    (next_action, console_mode в user_data) не перемешиваются, если админ нажимает кнопки быстро.
+    """
+
+    # Базовый семафор PTB берётся до очереди чата, поэтому его лимит делаем большим: иначе обновления
+    # одного чата, ждущие своей очереди, занимали бы места других чатов. Реальный лимит — self._running.
+    BACKLOG = 4096
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(self.BACKLOG)
+        self.max_running = max_concurrent_updates
+        self._running = asyncio.Semaphore(max_concurrent_updates)
+        self._chats = {}  # чат -> [замок очереди, сколько обновлений ждёт или выполняется]
+
+    async def do_process_update(self, update, coroutine):
+        chat = (update.effective_chat or update.effective_user) if isinstance(update, Update) else None
+        if chat is None:
+            async with self._running: await coroutine
+            return
+        entry = self._chats.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._running: await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]: del self._chats[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+async def post_init(application: Application):
+    """Запускает фоновые задачи после инициализации бота."""
+    if MONITOR_ENABLED:
+        for server in servers.values(): server.monitor.start(application)
+    await scheduler.start(application.bot)
+    if METRICS_PORT is not None:
+        port = await metrics_server.start(METRICS_LISTEN, METRICS_PORT)
+        logger.info(f"Метрики доступны на http://{METRICS_LISTEN}:{port}/metrics")
+
+async def post_shutdown(application: Application):
+    """Останавливает планировщик, дожидается незавершённых RCON-команд и закрывает соединения и базу состояния."""
+    await metrics_server.stop()
+    # До закрытия пулов: идущий отсчёт рестарта ещё успеет сообщить игрокам об отмене
+    await scheduler.stop()
+    for server in servers.values():
+        for chat_id in list(server.console.sessions): server.console.close(chat_id)
+    # Серверы дорабатывают команды одновременно, общий таймаут — SHUTDOWN_DRAIN_TIMEOUT
+    await asyncio.gather(*(server.pool.drain(SHUTDOWN_DRAIN_TIMEOUT) for server in servers.values()))
+    for server in servers.values(): await server.pool.close()
+    # Application.shutdown уже сохранил user_data — дописываем очередь и закрываем базу
+    await state_store.close()
+
+def build_application(request=None) -> Application:
+    """Собирает приложение с обработчиками. request позволяет подменить HTTP-клиент Telegram (для бенчмарков)."""
+    builder = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    builder.concurrent_updates(ChatOrderedUpdateProcessor(UPDATE_CONCURRENCY))
+    # Вызовы Bot API идут через обёртку с замером задержки; long polling (getUpdates) не замеряется
+    builder.request(InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256)))
+    if request is not None: builder.get_updates_request(request)
+    if state_store.path: builder.persistence(StatePersistence(state_store))
+    application = builder.build()
 
     # Регистрация обработчиков
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("audit", audit_command))
     application.add_handler(CallbackQueryHandler(button_router))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
-    
+    application.add_handler(MessageHandler(filters.Document.TXT, document_handler))
+    return application
+
+def main():
+    """Главная функция, которая собирает и запускает бота."""
+    application = build_application()
     logger.info("Бот 'Elite Panel Template' запущен...")
-    application.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Сборка многопакетных ответов RCON и разбиение вывода на страницы на поддельном сервере из bench_bot.py
+# Запуск: python -m pytest -q
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bench_bot
+import template_bot as bot
+
+CYRILLIC = "Сервер: привет, мир! Ёжик_в_тумане (версия 1.2.3) — включён\n"
+
+@pytest.fixture
+def rcon_server(request):
+    """Поддельный RCON-сервер в своём потоке; размер пакета — через @pytest.mark.parametrize(..., indirect=True)."""
+    server = bench_bot.FakeRconServer("test", latency=0, fragment_size=getattr(request, "param", 4096))
+    port = server.start_in_thread()
+    yield server, port
+    server.stop_thread()
+
+def run_on_pool(port: int, work):
+    """Выполняет work(pool) на свежем пуле и закрывает его."""
+    async def main():
+        pool = bot.RconPool("127.0.0.1", port, "test", size=1, name="test")
+        try:
+            return await work(pool)
+        finally:
+            await pool.close()
+    return asyncio.run(main())
+
+@pytest.mark.parametrize("rcon_server", [4096, 100], indirect=True)
+def test_long_response_is_reassembled(rcon_server):
+    server, port = rcon_server
+    resp = run_on_pool(port, lambda pool: pool.command("dump 2000"))
+    assert resp == bench_bot.dump_text(2000)
+    # Соединение после длинного ответа остаётся рабочим: маркер конца не «съел» следующий ответ
+    assert run_on_pool(port, lambda pool: pool.command("say ok")) == "Executed: say ok"
+
+@pytest.mark.parametrize("rcon_server", [7, 4095], indirect=True)
+def test_utf8_split_across_packets(rcon_server):
+    server, port = rcon_server
+    text = CYRILLIC * 300
+    # Нечётный размер пакета гарантирует, что двухбайтовые символы режутся между пакетами
+    assert len(text.encode("utf-8")) > server.fragment_size
+    server.respond = lambda command: text
+
+    async def work(pool):
+        return [chunk async for chunk in pool.stream("plugins")]
+    chunks = run_on_pool(port, work)
+    assert "".join(chunks) == text
+    assert not any("�" in chunk for chunk in chunks)
+
+@pytest.mark.parametrize("rcon_server", [4096, 333], indirect=True)
+@pytest.mark.parametrize("page_size", [bot.RCON_OUTPUT_PAGE_SIZE, 200])
+def test_paginate_respects_escaped_page_size(rcon_server, page_size):
+    server, port = rcon_server
+    # Почти каждый символ здесь экранируется — экранированный текст вдвое длиннее исходного
+    text = "".join(f"{i}_|().-[]{{}}!#+=~>*`" * 3 + "\n" for i in range(400)) + "_." * 5000
+    server.respond = lambda command: text
+
+    async def work(pool):
+        return [page async for page in bot.paginate(pool.stream("plugins"), page_size)]
+    pages = run_on_pool(port, work)
+    assert len(pages) > 1
+    assert all(len(bot.escape_markdown(page)) <= page_size for page in pages)
+    # Страницы режутся по строкам, поэтому сравниваем без переводов строк
+    assert "".join(pages).replace("\n", "") == text.replace("\n", "")